@@ -58,9 +58,9 @@ class Exp(MyExp):
     def get_data_loader(self, batch_size, is_distributed, no_aug=False, local_rank=0, cache_img=False):
         from exps.dataset.tal_flip_two_future_argoversedataset import TWO_ARGOVERSEDataset
         from exps.data.tal_flip_mosaicdetection import MosaicDetection
+        from exps.data.samplers import DimYoloBatchSampler
         from exps.data.data_augment_flip import DoubleTrainTransform
         from yolox.data import (
-            YoloBatchSampler,
             DataLoader,
             InfiniteSampler,
             worker_init_reset_seed,
@@ -73,6 +73,7 @@ class Exp(MyExp):
             img_size=self.input_size,
             preproc=DoubleTrainTransform(max_labels=50, hsv=False, flip=True),
             cache=cache_img,
+            shared_annotations=True,
         )
 
         dataset = MosaicDetection(dataset,
@@ -97,13 +98,15 @@ class Exp(MyExp):
         sampler = InfiniteSampler(len(self.dataset), seed=self.seed if self.seed else 0)
 
 
-        batch_sampler = YoloBatchSampler(
+        batch_sampler = DimYoloBatchSampler(
             sampler=sampler,
             batch_size=batch_size,
             drop_last=False,
-            mosaic=not no_aug)
+            mosaic=not no_aug,
+            input_dimension=self.input_size)
 
-        dataloader_kwargs = {"num_workers": self.data_num_workers, "pin_memory": True}
+        dataloader_kwargs = {"num_workers": self.data_num_workers, "pin_memory": True,
+                             "persistent_workers": self.data_num_workers > 0}
         dataloader_kwargs["batch_sampler"] = batch_sampler
 
         # Make sure each process has different random seed, especially for 'fork' method
@@ -131,7 +134,8 @@ class Exp(MyExp):
         else:
             sampler = torch.utils.data.SequentialSampler(valdataset)
 
-        dataloader_kwargs = {"num_workers": self.data_num_workers, "pin_memory": True, "sampler": sampler}
+        dataloader_kwargs = {"num_workers": self.data_num_workers, "pin_memory": True, "sampler": sampler,
+                             "persistent_workers": self.data_num_workers > 0}
         dataloader_kwargs["batch_size"] = batch_size
         val_loader = torch.utils.data.DataLoader(valdataset, **dataloader_kwargs)
 
@@ -156,11 +160,14 @@ class Exp(MyExp):
             dist.broadcast(tensor, 0)
 
         input_size = (tensor[0].item(), tensor[1].item())
+        # workers build the next batches at the new size, no need to re-fork them
+        data_loader.batch_sampler.input_dim = input_size
         return input_size
     
     def preprocess(self, inputs, targets, tsize):
-        scale_y = tsize[0] / self.input_size[0]
-        scale_x = tsize[1] / self.input_size[1]
+        # batches sampled before the last resize still come at their old size
+        scale_y = tsize[0] / inputs.shape[2]
+        scale_x = tsize[1] / inputs.shape[3]
         if scale_x != 1 or scale_y != 1:
             inputs = nn.functional.interpolate(
                 inputs, size=tsize, mode="bilinear", align_corners=False
@@ -11,7 +11,7 @@ class Exp(MyExp):
         super(Exp, self).__init__()
         self.depth = 0.67
         self.width = 0.75
-        self.data_num_workers = 0
+        self.data_num_workers = 8
         self.num_classes = 7
         self.input_size = (600, 960)  # (h,w)
         self.random_size = (50, 70)
@@ -57,9 +57,9 @@ class Exp(MyExp):
     def get_data_loader(self, batch_size, is_distributed, no_aug=False, local_rank=0, cache_img=False):
         from caryle.streamyolo.StreamYOLO.exps.dataset.tal_flip_one_future_argoversedataset import ONE_ARGOVERSEDataset
         from caryle.streamyolo.StreamYOLO.exps.data.tal_flip_mosaicdetection import MosaicDetection
+        from caryle.streamyolo.StreamYOLO.exps.data.samplers import DimYoloBatchSampler
         from caryle.streamyolo.StreamYOLO.exps.data.data_augment_flip import DoubleTrainTransform
         from yolox.data import (
-            YoloBatchSampler,
             DataLoader,
             InfiniteSampler,
             worker_init_reset_seed,
@@ -72,6 +72,7 @@ class Exp(MyExp):
             img_size=self.input_size,
             preproc=DoubleTrainTransform(max_labels=50, hsv=False, flip=True),
             cache=cache_img,
+            shared_annotations=True,
         )
 
         dataset = MosaicDetection(dataset,
@@ -95,13 +96,15 @@ class Exp(MyExp):
 
         sampler = InfiniteSampler(len(self.dataset), seed=self.seed if self.seed else 0)
 
-        batch_sampler = YoloBatchSampler(
+        batch_sampler = DimYoloBatchSampler(
             sampler=sampler,
             batch_size=batch_size,
             drop_last=False,
-            mosaic=not no_aug)
+            mosaic=not no_aug,
+            input_dimension=self.input_size)
 
-        dataloader_kwargs = {"num_workers": self.data_num_workers, "pin_memory": True}
+        dataloader_kwargs = {"num_workers": self.data_num_workers, "pin_memory": True,
+                             "persistent_workers": self.data_num_workers > 0}
         dataloader_kwargs["batch_sampler"] = batch_sampler
 
         # Make sure each process has different random seed, especially for 'fork' method.
@@ -130,7 +133,8 @@ class Exp(MyExp):
         else:
             sampler = torch.utils.data.SequentialSampler(valdataset)
 
-        dataloader_kwargs = {"num_workers": self.data_num_workers, "pin_memory": True, "sampler": sampler}
+        dataloader_kwargs = {"num_workers": self.data_num_workers, "pin_memory": True, "sampler": sampler,
+                             "persistent_workers": self.data_num_workers > 0}
         dataloader_kwargs["batch_size"] = batch_size
         val_loader = torch.utils.data.DataLoader(valdataset, **dataloader_kwargs)
 
@@ -155,12 +159,15 @@ class Exp(MyExp):
             dist.broadcast(tensor, 0)
 
         input_size = (tensor[0].item(), tensor[1].item())
+        # workers build the next batches at the new size, no need to re-fork them
+        data_loader.batch_sampler.input_dim = input_size
         return input_size
     
 
     def preprocess(self, inputs, targets, tsize):
-        scale_y = tsize[0] / self.input_size[0]
-        scale_x = tsize[1] / self.input_size[1]
+        # batches sampled before the last resize still come at their old size
+        scale_y = tsize[0] / inputs.shape[2]
+        scale_x = tsize[1] / inputs.shape[3]
         if scale_x != 1 or scale_y != 1:
             inputs = nn.functional.interpolate(
                 inputs, size=tsize, mode="bilinear", align_corners=False
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Copyright (c) Megvii, Inc. and its affiliates.
+
+from functools import wraps
+
+from torch.utils.data.sampler import BatchSampler as torchBatchSampler
+
+from yolox.data import YoloBatchSampler
+
+
+class DimYoloBatchSampler(YoloBatchSampler):
+    """
+    This batch sampler will generate mini-batches of (mosaic, index, input_dim) tuples.
+    The sampler runs in the main process, so changing ``input_dim`` (e.g. in
+    ``Exp.random_resize``) reaches persistent dataloader workers with the next
+    sampled batches, without re-forking them.
+    """
+
+    def __init__(self, *args, input_dimension=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.input_dim = input_dimension
+
+    def __iter__(self):
+        for batch in torchBatchSampler.__iter__(self):
+            yield [(self.mosaic, idx, self.input_dim) for idx in batch]
+
+
+def dim_mosaic_getitem(getitem_fn):
+    """
+    Same as ``Dataset.mosaic_getitem``, but also picks up the input dimension
+    sent by :class:`DimYoloBatchSampler`.
+    """
+
+    @wraps(getitem_fn)
+    def wrapper(self, index):
+        if not isinstance(index, int):
+            self.enable_mosaic = index[0]
+            if len(index) > 2 and index[2] is not None:
+                self._input_dim = index[2]
+            index = index[1]
+
+        ret_val = getitem_fn(self, index)
+
+        return ret_val
+
+    return wrapper
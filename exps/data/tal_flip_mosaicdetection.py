@@ -11,6 +11,8 @@ import random
 from yolox.data.datasets.datasets_wrapper import Dataset
 from copy import deepcopy
 
+from .samplers import dim_mosaic_getitem
+
 def box_candidates(box1, box2, wh_thr=2, ar_thr=20, area_thr=0.2):
     # box1(4,n), box2(4,n)
     # Compute candidate boxes which include follwing 5 things:
@@ -26,24 +28,21 @@ def box_candidates(box1, box2, wh_thr=2, ar_thr=20, area_thr=0.2):
     )  # candidates
 
 
-def random_perspective(
-    img,
-    targets=(),
+def get_perspective_matrix(
+    img_shape,
     degrees=10,
     translate=0.1,
     scale=0.1,
     shear=10,
-    perspective=0.0,
     border=(0, 0),
 ):
-    # targets = [cls, xyxy]
-    height = img.shape[0] + border[0] * 2  # shape(h,w,c)
-    width = img.shape[1] + border[1] * 2
+    height = img_shape[0] + border[0] * 2  # shape(h,w,c)
+    width = img_shape[1] + border[1] * 2
 
     # Center
     C = np.eye(3)
-    C[0, 2] = -img.shape[1] / 2  # x translation (pixels)
-    C[1, 2] = -img.shape[0] / 2  # y translation (pixels)
+    C[0, 2] = -img_shape[1] / 2  # x translation (pixels)
+    C[1, 2] = -img_shape[0] / 2  # y translation (pixels)
 
     # Rotation and Scale
     R = np.eye(3)
@@ -76,46 +75,113 @@ def random_perspective(
     # M = np.eye(3)
     ###########################
 
+    return M, s, width, height
+
+
+def warp_image(img, M, width, height, perspective=0.0):
+    # border value is given for 4 channels so that stacked frames (c > 3) are padded correctly
+    if perspective:
+        return cv2.warpPerspective(
+            img, M, dsize=(width, height), borderValue=(114, 114, 114, 114)
+        )
+    return cv2.warpAffine(
+        img, M[:2], dsize=(width, height), borderValue=(114, 114, 114, 114)
+    )
+
+
+def warp_boxes(boxes, M, s, width, height, perspective=0.0):
+    # boxes = xyxy, returns the warped boxes and the candidate mask
+    n = len(boxes)
+    # warp points
+    xy = np.ones((n * 4, 3))
+    xy[:, :2] = boxes[:, [0, 1, 2, 3, 0, 3, 2, 1]].reshape(
+        n * 4, 2
+    )  # x1y1, x2y2, x1y2, x2y1
+    xy = xy @ M.T  # transform
+    if perspective:
+        xy = (xy[:, :2] / xy[:, 2:3]).reshape(n, 8)  # rescale
+    else:  # affine
+        xy = xy[:, :2].reshape(n, 8)
+
+    # create new boxes
+    x = xy[:, [0, 2, 4, 6]]
+    y = xy[:, [1, 3, 5, 7]]
+    xy = np.concatenate((x.min(1), y.min(1), x.max(1), y.max(1))).reshape(4, n).T
+
+    # clip boxes
+    xy[:, [0, 2]] = xy[:, [0, 2]].clip(0, width)
+    xy[:, [1, 3]] = xy[:, [1, 3]].clip(0, height)
+
+    # filter candidates
+    i = box_candidates(box1=boxes[:, :4].T * s, box2=xy.T)
+    return xy, i
+
+
+def random_perspective(
+    img,
+    targets=(),
+    degrees=10,
+    translate=0.1,
+    scale=0.1,
+    shear=10,
+    perspective=0.0,
+    border=(0, 0),
+):
+    M, s, width, height = get_perspective_matrix(
+        img.shape, degrees, translate, scale, shear, border
+    )
+
     if (border[0] != 0) or (border[1] != 0) or (M != np.eye(3)).any():  # image changed
-        if perspective:
-            img = cv2.warpPerspective(
-                img, M, dsize=(width, height), borderValue=(114, 114, 114)
-            )
-        else:  # affine
-            img = cv2.warpAffine(
-                img, M[:2], dsize=(width, height), borderValue=(114, 114, 114)
-            )
+        img = warp_image(img, M, width, height, perspective)
 
     # Transform label coordinates
-    n = len(targets)
-    if n:
-        # warp points
-        xy = np.ones((n * 4, 3))
-        xy[:, :2] = targets[:, [0, 1, 2, 3, 0, 3, 2, 1]].reshape(
-            n * 4, 2
-        )  # x1y1, x2y2, x1y2, x2y1
-        xy = xy @ M.T  # transform
-        if perspective:
-            xy = (xy[:, :2] / xy[:, 2:3]).reshape(n, 8)  # rescale
-        else:  # affine
-            xy = xy[:, :2].reshape(n, 8)
-
-        # create new boxes
-        x = xy[:, [0, 2, 4, 6]]
-        y = xy[:, [1, 3, 5, 7]]
-        xy = np.concatenate((x.min(1), y.min(1), x.max(1), y.max(1))).reshape(4, n).T
-
-        # clip boxes
-        xy[:, [0, 2]] = xy[:, [0, 2]].clip(0, width)
-        xy[:, [1, 3]] = xy[:, [1, 3]].clip(0, height)
-
-        # filter candidates
-        i = box_candidates(box1=targets[:, :4].T * s, box2=xy.T)
+    if len(targets):
+        xy, i = warp_boxes(targets, M, s, width, height, perspective)
         targets = targets[i]
         targets[:, :4] = xy[i]
 
     return img, targets
 
+
+def random_perspective_pair(
+    img1,
+    img2,
+    targets1=(),
+    targets2=(),
+    degrees=10,
+    translate=0.1,
+    scale=0.1,
+    shear=10,
+    perspective=0.0,
+    border=(0, 0),
+):
+    """
+    Same as random_perspective, but the current frame (img1) and the support
+    frame (img2) share one sampled transform. Both frames are warped in a single
+    pass as one 6-channel image and both label sets are transformed together.
+    """
+    assert img1.shape == img2.shape
+    M, s, width, height = get_perspective_matrix(
+        img1.shape, degrees, translate, scale, shear, border
+    )
+
+    if (border[0] != 0) or (border[1] != 0) or (M != np.eye(3)).any():  # image changed
+        c = img1.shape[2]
+        img = warp_image(np.concatenate((img1, img2), axis=2), M, width, height, perspective)
+        img1 = np.ascontiguousarray(img[..., :c])
+        img2 = np.ascontiguousarray(img[..., c:])
+
+    # Transform both label sets at once, then split them back
+    n1 = len(targets1)
+    if n1 or len(targets2):
+        targets = np.concatenate((targets1, targets2), 0)
+        xy, i = warp_boxes(targets, M, s, width, height, perspective)
+        targets[:, :4] = xy
+        targets1 = targets[:n1][i[:n1]]
+        targets2 = targets[n1:][i[n1:]]
+
+    return img1, img2, targets1, targets2
+
 def get_mosaic_coordinate(mosaic_image, mosaic_index, xc, yc, w, h, input_h, input_w):
     # TODO update doc
     # index0 to top left part of image
@@ -259,7 +325,7 @@ class MosaicDetection(Dataset):
 
 
 
-    @Dataset.mosaic_getitem
+    @dim_mosaic_getitem
     def __getitem__(self, idx):
         #print(self.enable_mosaic)
         if self.enable_mosaic and random.random() < self.mosaic_prob:
@@ -353,18 +419,11 @@ class MosaicDetection(Dataset):
                 np.clip(mosaic_labels2[:, 1], 0, 2 * input_h, out=mosaic_labels2[:, 1])
                 np.clip(mosaic_labels2[:, 2], 0, 2 * input_w, out=mosaic_labels2[:, 2])
                 np.clip(mosaic_labels2[:, 3], 0, 2 * input_h, out=mosaic_labels2[:, 3])
-            mosaic_img1, mosaic_labels1 = random_perspective(
+            # current and support frames share one transform so that their geometry stays consistent
+            mosaic_img1, mosaic_img2, mosaic_labels1, mosaic_labels2 = random_perspective_pair(
                 mosaic_img1,
-                mosaic_labels1,
-                degrees=self.degrees,
-                translate=self.translate,
-                scale=self.scale,
-                shear=self.shear,
-                perspective=self.perspective,
-                border=[-input_h // 2, -input_w // 2],
-            )  # border to remove
-            mosaic_img2, mosaic_labels2 = random_perspective(
                 mosaic_img2,
+                mosaic_labels1,
                 mosaic_labels2,
                 degrees=self.degrees,
                 translate=self.translate,
@@ -372,7 +431,7 @@ class MosaicDetection(Dataset):
                 shear=self.shear,
                 perspective=self.perspective,
                 border=[-input_h // 2, -input_w // 2],
-            ) 
+            )  # border to remove
             # -----------------------------------------------------------------
             # CopyPaste: https://arxiv.org/abs/2012.07177
             # -----------------------------------------------------------------
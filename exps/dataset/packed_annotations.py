@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import atexit
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class PackedAnnotations:
+    """
+    Read-only annotation list packed into flat numpy arrays that are memory mapped
+    from disk. Dataloader workers share the same physical pages instead of holding
+    a copy-on-write list of python objects each (touching the refcounts of those
+    objects eventually copies every page into every worker).
+
+    Pickling only sends the directory path, so both fork and spawn workers map the
+    same files.
+
+    Each item is ``(res, support_res, img_info, resized_info, file_name, support_file_name)``,
+    the layout of ``ONE_ARGOVERSEDataset.annotations``.
+    """
+
+    _fields = ("res", "support_res")
+
+    def __init__(self, annotations, cache_dir=None):
+        """
+        Args:
+            annotations (list): list of annotation tuples to pack.
+            cache_dir (str): directory to store the arrays. A temporary directory,
+                removed at exit, is used if None.
+        """
+        if cache_dir is None:
+            cache_dir = tempfile.mkdtemp(prefix="streamyolo_anno_")
+            atexit.register(shutil.rmtree, cache_dir, True)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+
+        arrays = {}
+        for k, name in enumerate(self._fields):
+            labels = [anno[k] for anno in annotations]
+            offsets = np.zeros(len(labels) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(x) for x in labels])
+            arrays[name] = np.concatenate(labels, 0) if len(labels) else np.zeros((0, 5))
+            arrays[name + "_offsets"] = offsets
+        arrays["img_info"] = np.array([anno[2] for anno in annotations], dtype=np.int64)
+        arrays["resized_info"] = np.array([anno[3] for anno in annotations], dtype=np.int64)
+        arrays["file_name"] = np.array([anno[4].encode() for anno in annotations])
+        arrays["support_file_name"] = np.array([anno[5].encode() for anno in annotations])
+
+        for name, array in arrays.items():
+            np.save(os.path.join(cache_dir, name + ".npy"), array)
+        self._load()
+
+    def _load(self):
+        self.arrays = {
+            f[:-4]: np.load(os.path.join(self.cache_dir, f), mmap_mode="r")
+            for f in os.listdir(self.cache_dir) if f.endswith(".npy")
+        }
+
+    def __getstate__(self):
+        return {"cache_dir": self.cache_dir}
+
+    def __setstate__(self, state):
+        self.cache_dir = state["cache_dir"]
+        self._load()
+
+    def __len__(self):
+        return len(self.arrays["img_info"])
+
+    def __getitem__(self, index):
+        a = self.arrays
+        labels = []
+        for name in self._fields:
+            offsets = a[name + "_offsets"]
+            labels.append(a[name][offsets[index]:offsets[index + 1]])
+        return (
+            labels[0],
+            labels[1],
+            tuple(int(x) for x in a["img_info"][index]),
+            tuple(int(x) for x in a["resized_info"][index]),
+            a["file_name"][index].decode(),
+            a["support_file_name"][index].decode(),
+        )
@@ -12,6 +12,8 @@ import os
 from yolox.data.dataloading import get_yolox_datadir
 from yolox.data.datasets.datasets_wrapper import Dataset
 
+from .packed_annotations import PackedAnnotations
+
 from loguru import logger
 
 class TWO_ARGOVERSEDataset(Dataset):
@@ -19,7 +21,8 @@ class TWO_ARGOVERSEDataset(Dataset):
     COCO dataset class.
     """
     def __init__(self, data_dir='/data/Datasets/', json_file='train.json',
-                 name='train', img_size=(416,416), preproc=None, cache=False):
+                 name='train', img_size=(416,416), preproc=None, cache=False,
+                 shared_annotations=False):
         """
         COCO dataset initialization. Annotation data are read into memory by COCO API.
         Args:
@@ -29,6 +32,9 @@ class TWO_ARGOVERSEDataset(Dataset):
             img_size (int): target image size after pre-processing
             preproc: data augmentation strategy
             debug (bool): if True, only one data id is selected from the dataset
+            shared_annotations (bool): pack the annotations into memory mapped arrays
+                shared by all dataloader workers and release the COCO index.
+                Evaluation needs the COCO index, so only use it for training.
         """
         super().__init__(img_size)
         self.data_dir = data_dir
@@ -46,6 +52,9 @@ class TWO_ARGOVERSEDataset(Dataset):
         self.img_size = img_size
         self.preproc = preproc
         self.annotations = self._load_coco_annotations()
+        if shared_annotations:
+            self.annotations = PackedAnnotations(self.annotations)
+            self.coco = None
         self.imgs = None
 
     def __len__(self):
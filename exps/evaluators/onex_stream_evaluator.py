@@ -13,7 +13,6 @@ from yolox.utils import (
     is_main_process,
     postprocess,
     synchronize,
-    time_synchronized,
     xyxy2xywh
 )
 
@@ -27,6 +26,8 @@ import time
 from tabulate import tabulate
 import numpy as np
 from caryle.streamyolo.StreamYOLO.exps.data.argoverse_class import ARGOVERSE_CLASSES
+from ..model.prepare import prepare_input
+from ..utils.device import time_synchronized
 
 def per_class_mAP_table(coco_eval, class_names=ARGOVERSE_CLASSES, headers=["class", "AP"], colums=2):
     per_class_mAP = {}
@@ -104,10 +105,12 @@ class ONEX_COCOEvaluator:
             summary (sr): summary info of evaluation.
         """
         # TODO half to amp_test
-        tensor_type = torch.cuda.HalfTensor if half else torch.cuda.FloatTensor
         model = model.eval()
         if half:
             model = model.half()
+        # inputs follow the device and precision of the model (cuda, cpu, bf16 ...)
+        param = next(model.parameters())
+        device, dtype = param.device, param.dtype
         ids = []
         data_list = []
         progress_bar = tqdm if is_main_process() else iter
@@ -122,7 +125,7 @@ class ONEX_COCOEvaluator:
             model_trt = TRTModule()
             model_trt.load_state_dict(torch.load(trt_file))
 
-            x = torch.ones(1, 3, test_size[0], test_size[1]).cuda()
+            x = torch.ones(1, 3, test_size[0], test_size[1]).to(device)
             model(x)
             model = model_trt
 
@@ -130,31 +133,31 @@ class ONEX_COCOEvaluator:
                 progress_bar(self.dataloader)
         ):
             with torch.no_grad():
-                imgs = imgs.type(tensor_type)
+                imgs = prepare_input(imgs.to(device, dtype), model)
 
                 # skip the the last iters since batchsize might be not enough for batch inference
                 is_time_record = cur_iter < len(self.dataloader) - 1
                 if is_time_record:
-                    start = time.time()
+                    start = time.perf_counter()
 
                 outputs = model(imgs)
                 if decoder is not None:
                     outputs = decoder(outputs, dtype=outputs.type())
 
                 if is_time_record:
-                    infer_end = time_synchronized()
+                    infer_end = time_synchronized(device)
                     inference_time += infer_end - start
 
                 outputs = postprocess(
                     outputs, self.num_classes, self.confthre, self.nmsthre
                 )
                 if is_time_record:
-                    nms_end = time_synchronized()
+                    nms_end = time_synchronized(device)
                     nms_time += nms_end - infer_end
 
             data_list.extend(self.convert_to_coco_format(outputs, info_imgs, ids))
 
-        statistics = torch.cuda.FloatTensor([inference_time, nms_time, n_samples])
+        statistics = torch.tensor([inference_time, nms_time, n_samples], device=device)
         if distributed:
             data_list = gather(data_list, dst=0)
             data_list = list(itertools.chain(*data_list))
@@ -10,6 +10,22 @@ from caryle.streamyolo.StreamYOLO.exps.model.darknet import CSPDarknet
 from yolox.models.network_blocks import BaseConv, CSPLayer, DWConv
 
 
+class FrameBatchNorm2d(nn.BatchNorm2d):
+    """
+    BatchNorm2d over a batch of ``n_frames`` frames stacked along the batch
+    dimension. In training, every frame is normalized with its own batch
+    statistics and updates the running statistics in turn, exactly as when
+    the frames are run one after the other.
+    """
+
+    n_frames = 1
+
+    def forward(self, input):
+        if self.n_frames == 1 or not self.training:
+            return super().forward(input)
+        return torch.cat([super(FrameBatchNorm2d, self).forward(x) for x in input.chunk(self.n_frames)], dim=0)
+
+
 class DFPPAFPN(nn.Module):
     """
     YOLOv3 model. Darknet 53 is the default backbone of this model.
@@ -103,21 +119,93 @@ class DFPPAFPN(nn.Module):
                     stride=1,
                     act=act,
                 )
+
+        # per frame batch norm statistics when the frames are stacked in off_forward,
+        # same parameters and buffers (state dict keys) as nn.BatchNorm2d
+        for m in self.modules():
+            if type(m) is nn.BatchNorm2d:
+                m.__class__ = FrameBatchNorm2d
+
+        # keep the jian outputs instead of the PAN features in the on_pipe buffer,
+        # the support branch then reuses the projection done for the previous frame
+        self.buffer_jian = False
+        # run the frames of off_forward as one stacked batch, False for one pass per frame
+        self.stack_frames = True
     
 
 
+    def frames_forward(self, frames):
+        """
+        PAN features of several frames, and their jian projections, with the
+        frames stacked along the batch dimension to run backbone+PAN once.
+
+        Args:
+            frames: list of input images of the same shape, one per frame.
+
+        Returns:
+            Tuple[List[Tensor]]: per level (pan_out2, pan_out1, pan_out0), the
+                PAN features of every frame and their jian projections.
+        """
+        n_frames = len(frames)
+        jians = [self.jian2, self.jian1, self.jian0]
+        if not (self.stack_frames and self._set_bn_frames(n_frames)):
+            # batch norm layers that cannot split their statistics, one frame at a time
+            pan_outs = [self.pan_forward(x) for x in frames]
+            pan_outs = [list(level) for level in zip(*pan_outs)]
+            jian_outs = [[jian(x) for x in level] for jian, level in zip(jians, pan_outs)]
+            return pan_outs, jian_outs
+
+        try:
+            pan_outs = self.pan_forward(torch.cat(frames, dim=0))
+            jian_outs = [jian(x) for jian, x in zip(jians, pan_outs)]
+        finally:
+            self._set_bn_frames(1)
+        pan_outs = [x.chunk(n_frames, dim=0) for x in pan_outs]
+        jian_outs = [x.chunk(n_frames, dim=0) for x in jian_outs]
+        return pan_outs, jian_outs
+
+    def _set_bn_frames(self, n_frames):
+        # the statistics of training batch norm layers stay per frame, as with
+        # one pass per frame, False if a layer is not a FrameBatchNorm2d
+        # (e.g. after a SyncBatchNorm conversion)
+        stackable = True
+        for m in self.modules():
+            if isinstance(m, FrameBatchNorm2d):
+                m.n_frames = n_frames
+            elif isinstance(m, nn.modules.batchnorm._BatchNorm) and m.training:
+                stackable = False
+        return stackable
+
     def off_forward(self, input):
         """
         Args:
-            inputs: input images.
+            inputs: input images, the current frame then the support frames,
+                3 channels each.
 
         Returns:
             Tuple[Tensor]: FPN feature.
         """
+        pan_outs, jian_outs = self.frames_forward(torch.split(input, 3, dim=1))
+
+        # 0.5 channel, the projections of several support frames are averaged
+        outputs = []
+        for x, x_jians in zip(pan_outs, jian_outs):
+            support_jian = x_jians[1] if len(x_jians) == 2 else torch.stack(x_jians[1:]).mean(0)
+            outputs.append(torch.cat([x_jians[0], support_jian], dim=1) + x[0])
 
+        return tuple(outputs)
+
+    def pan_forward(self, input):
+        """
+        Args:
+            inputs: input images of a single frame.
+
+        Returns:
+            Tuple[Tensor]: PAN features (pan_out2, pan_out1, pan_out0) of the frame.
+        """
 
         #  backbone
-        rurrent_out_features = self.backbone(torch.split(input, 3, dim=1)[0])
+        rurrent_out_features = self.backbone(input)
         rurrent_features = [rurrent_out_features[f] for f in self.in_features]
         [rurrent_x2, rurrent_x1, rurrent_x0] = rurrent_features
 
@@ -139,40 +227,7 @@ class DFPPAFPN(nn.Module):
         rurrent_p_out0 = torch.cat([rurrent_p_out0, rurrent_fpn_out0], 1)  # 512->1024/32
         rurrent_pan_out0 = self.C3_n4(rurrent_p_out0)  # 1024->1024/32
 
-        #####
-
-
-        support_out_features = self.backbone(torch.split(input, 3, dim=1)[1])
-        support_features = [support_out_features[f] for f in self.in_features]
-        [support_x2, support_x1, support_x0] = support_features
-
-        support_fpn_out0 = self.lateral_conv0(support_x0)  # 1024->512/32
-        support_f_out0 = F.interpolate(support_fpn_out0, size=support_x1.shape[2:4], mode='nearest')  # 512/16
-        support_f_out0 = torch.cat([support_f_out0, support_x1], 1)  # 512->1024/16
-        support_f_out0 = self.C3_p4(support_f_out0)  # 1024->512/16
-
-        support_fpn_out1 = self.reduce_conv1(support_f_out0)  # 512->256/16
-        support_f_out1 = F.interpolate(support_fpn_out1, size=support_x2.shape[2:4], mode='nearest')  # 256/8
-        support_f_out1 = torch.cat([support_f_out1, support_x2], 1)  # 256->512/8
-        support_pan_out2 = self.C3_p3(support_f_out1)  # 512->256/8
-
-        support_p_out1 = self.bu_conv2(support_pan_out2)  # 256->256/16
-        support_p_out1 = torch.cat([support_p_out1, support_fpn_out1], 1)  # 256->512/16
-        support_pan_out1 = self.C3_n3(support_p_out1)  # 512->512/16
-
-        support_p_out0 = self.bu_conv1(support_pan_out1)  # 512->512/32
-        support_p_out0 = torch.cat([support_p_out0, support_fpn_out0], 1)  # 512->1024/32
-        support_pan_out0 = self.C3_n4(support_p_out0)  # 1024->1024/32
-
-        # 0.5 channel
-        pan_out2 = torch.cat([self.jian2(rurrent_pan_out2), self.jian2(support_pan_out2)], dim=1) + rurrent_pan_out2
-        pan_out1 = torch.cat([self.jian1(rurrent_pan_out1), self.jian1(support_pan_out1)], dim=1) + rurrent_pan_out1
-        pan_out0 = torch.cat([self.jian0(rurrent_pan_out0), self.jian0(support_pan_out0)], dim=1) + rurrent_pan_out0
-
-
-        outputs = (pan_out2, pan_out1, pan_out0)
-
-        return outputs
+        return rurrent_pan_out2, rurrent_pan_out1, rurrent_pan_out0
 
     def online_forward(self, input, buffer=None, node='star'):
         """
@@ -184,48 +239,83 @@ class DFPPAFPN(nn.Module):
         """
 
 
-        #  backbone
-        rurrent_out_features = self.backbone(input)
-        rurrent_features = [rurrent_out_features[f] for f in self.in_features]
-        [rurrent_x2, rurrent_x1, rurrent_x0] = rurrent_features
-
-        rurrent_fpn_out0 = self.lateral_conv0(rurrent_x0)  # 1024->512/32
-        rurrent_f_out0 = F.interpolate(rurrent_fpn_out0, size=rurrent_x1.shape[2:4], mode='nearest')  # 512/16
-        rurrent_f_out0 = torch.cat([rurrent_f_out0, rurrent_x1], 1)  # 512->1024/16
-        rurrent_f_out0 = self.C3_p4(rurrent_f_out0)  # 1024->512/16
-
-        rurrent_fpn_out1 = self.reduce_conv1(rurrent_f_out0)  # 512->256/16
-        rurrent_f_out1 = F.interpolate(rurrent_fpn_out1, size=rurrent_x2.shape[2:4], mode='nearest')  # 256/8
-        rurrent_f_out1 = torch.cat([rurrent_f_out1, rurrent_x2], 1)  # 256->512/8
-        rurrent_pan_out2 = self.C3_p3(rurrent_f_out1)  # 512->256/8
-
-        rurrent_p_out1 = self.bu_conv2(rurrent_pan_out2)  # 256->256/16
-        rurrent_p_out1 = torch.cat([rurrent_p_out1, rurrent_fpn_out1], 1)  # 256->512/16
-        rurrent_pan_out1 = self.C3_n3(rurrent_p_out1)  # 512->512/16
-
-        rurrent_p_out0 = self.bu_conv1(rurrent_pan_out1)  # 512->512/32
-        rurrent_p_out0 = torch.cat([rurrent_p_out0, rurrent_fpn_out0], 1)  # 512->1024/32
-        rurrent_pan_out0 = self.C3_n4(rurrent_p_out0)  # 1024->1024/32
+        rurrent_pan_out2, rurrent_pan_out1, rurrent_pan_out0 = self.pan_forward(input)
 
         #####
+        rurrent_jian2 = self.jian2(rurrent_pan_out2)
+        rurrent_jian1 = self.jian1(rurrent_pan_out1)
+        rurrent_jian0 = self.jian0(rurrent_pan_out0)
         if node=='star':
-            pan_out2 = torch.cat([self.jian2(rurrent_pan_out2), self.jian2(rurrent_pan_out2)], dim=1) + rurrent_pan_out2
-            pan_out1 = torch.cat([self.jian1(rurrent_pan_out1), self.jian1(rurrent_pan_out1)], dim=1) + rurrent_pan_out1
-            pan_out0 = torch.cat([self.jian0(rurrent_pan_out0), self.jian0(rurrent_pan_out0)], dim=1) + rurrent_pan_out0
+            # same frame on both branches, the 1x1 convs are only run once
+            [support_jian2, support_jian1, support_jian0] = [rurrent_jian2, rurrent_jian1, rurrent_jian0]
         elif node=='buffer':
+            if self.buffer_jian:
+                # the buffer already holds the projected features of the previous frame
+                [support_jian2, support_jian1, support_jian0] = buffer
+            else:
+                [support_pan_out2, support_pan_out1, support_pan_out0] = buffer
+                support_jian2 = self.jian2(support_pan_out2)
+                support_jian1 = self.jian1(support_pan_out1)
+                support_jian0 = self.jian0(support_pan_out0)
 
-            [support_pan_out2, support_pan_out1, support_pan_out0] = buffer
-
-            pan_out2 = torch.cat([self.jian2(rurrent_pan_out2), self.jian2(support_pan_out2)], dim=1) + rurrent_pan_out2
-            pan_out1 = torch.cat([self.jian1(rurrent_pan_out1), self.jian1(support_pan_out1)], dim=1) + rurrent_pan_out1
-            pan_out0 = torch.cat([self.jian0(rurrent_pan_out0), self.jian0(support_pan_out0)], dim=1) + rurrent_pan_out0
+        pan_out2 = torch.cat([rurrent_jian2, support_jian2], dim=1) + rurrent_pan_out2
+        pan_out1 = torch.cat([rurrent_jian1, support_jian1], dim=1) + rurrent_pan_out1
+        pan_out0 = torch.cat([rurrent_jian0, support_jian0], dim=1) + rurrent_pan_out0
 
 
         outputs = (pan_out2, pan_out1, pan_out0)
 
-        buffer_ = (rurrent_pan_out2,rurrent_pan_out1,rurrent_pan_out0)
+        if self.buffer_jian:
+            buffer_ = (rurrent_jian2, rurrent_jian1, rurrent_jian0)
+        else:
+            buffer_ = (rurrent_pan_out2,rurrent_pan_out1,rurrent_pan_out0)
 
         return outputs, buffer_
+
+    def stream_forward(self, input, first, buffer):
+        """
+        on_pipe forward without python branching, so that it can be traced and
+        exported with the buffer as explicit inputs and outputs.
+
+        Args:
+            input: input images of the current frame.
+            first: bool tensor, True for the first frame of a stream. The frame is
+                then its own support frame (star node) and ``buffer`` is ignored,
+                zeros of the right shapes can be given.
+            buffer: buffer returned for the previous frame.
+
+        Returns:
+            Tuple[Tensor]: FPN feature, buffer for the next frame.
+        """
+        rurrent_pan_outs = self.pan_forward(input)
+        jians = [self.jian2, self.jian1, self.jian0]
+        rurrent_jians = [jian(x) for jian, x in zip(jians, rurrent_pan_outs)]
+
+        buffer_ = tuple(rurrent_jians) if self.buffer_jian else tuple(rurrent_pan_outs)
+        support = [torch.where(first, x, b) for x, b in zip(buffer_, buffer)]
+        if self.buffer_jian:
+            support_jians = support
+        else:
+            support_jians = [jian(x) for jian, x in zip(jians, support)]
+
+        outputs = tuple(
+            torch.cat([x_jian, s_jian], dim=1) + x
+            for x, x_jian, s_jian in zip(rurrent_pan_outs, rurrent_jians, support_jians)
+        )
+        return outputs, buffer_
+
+    def buffer_shapes(self, input_size, batch_size=1):
+        """Shapes of the on_pipe buffer tensors for (h, w) inputs."""
+        h, w = input_size
+        shapes = []
+        for k, jian in enumerate([self.jian2, self.jian1, self.jian0]):
+            # every stride 2 layer gives ceil(size / 2)
+            for _ in range(3 if k == 0 else 1):
+                h, w = (h + 1) // 2, (w + 1) // 2
+            conv = jian.conv
+            channels = conv.out_channels if self.buffer_jian else conv.in_channels
+            shapes.append((batch_size, channels, h, w))
+        return shapes
     
 
 
@@ -236,8 +326,8 @@ class DFPPAFPN(nn.Module):
             if input.size()[1] == 3:
                 input = torch.cat([input, input], dim=1)
                 output = self.off_forward(input)
-            # offline train mode
-            elif input.size()[1] == 6:
+            # offline train mode, one or more support frames
+            elif input.size()[1] % 3 == 0:
                 output = self.off_forward(input)
             
             return output
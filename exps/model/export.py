@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Copyright (c) Megvii, Inc. and its affiliates.
+
+import inspect
+
+import torch
+import torch.nn as nn
+
+BUFFER_NAMES = ["buffer2", "buffer1", "buffer0"]
+
+
+class StreamingYOLOX(nn.Module):
+    """
+    on_pipe YOLOX with an explicit state, the graph is the same for every frame:
+    ``(frame, first, buffer2, buffer1, buffer0) -> (outputs, buffer2, buffer1, buffer0)``.
+
+    ``first`` is a bool tensor set for the first frame of a stream, the buffer is
+    then ignored and can be zeros (see :meth:`init_state`). The decoding grids are
+    fixed when tracing, so an exported model only runs at the traced input size.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, frame, first, buffer2, buffer1, buffer0):
+        fpn_outs, buffer_ = self.model.backbone.stream_forward(
+            frame, first, (buffer2, buffer1, buffer0)
+        )
+        outputs = self.model.head(fpn_outs)
+        return (outputs,) + tuple(buffer_)
+
+    def init_state(self, input_size, batch_size=1):
+        """``first`` flag and zero buffer for the first frame of (h, w) inputs."""
+        param = next(self.parameters())
+        first = torch.ones(1, dtype=torch.bool, device=param.device)
+        buffer = [
+            torch.zeros(shape, dtype=param.dtype, device=param.device)
+            for shape in self.model.backbone.buffer_shapes(input_size, batch_size)
+        ]
+        return first, buffer
+
+
+class ONNXStreamingModel:
+    """Run an exported ONNX streaming model with ONNX Runtime, same call as :class:`StreamingYOLOX`."""
+
+    def __init__(self, onnx_file, providers=("CPUExecutionProvider",)):
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(onnx_file, providers=list(providers))
+        self.input_names = [x.name for x in self.session.get_inputs()]
+
+    def __call__(self, frame, first, *buffer):
+        feed = {
+            name: x.detach().cpu().numpy()
+            for name, x in zip(self.input_names, (frame, first) + tuple(buffer))
+        }
+        return tuple(torch.from_numpy(x) for x in self.session.run(None, feed))
+
+
+def _example_inputs(streaming_model, input_size):
+    param = next(streaming_model.parameters())
+    frame = torch.rand(1, 3, input_size[0], input_size[1], device=param.device, dtype=param.dtype) * 255
+    first, buffer = streaming_model.init_state(input_size)
+    return (frame, first) + tuple(buffer)
+
+
+@torch.no_grad()
+def export_torchscript(model, input_size, output_file):
+    """
+    Trace the on_pipe model with an explicit state and save it as TorchScript.
+
+    Args:
+        model (nn.Module): YOLOX model in eval mode, possibly prepared.
+        input_size (tuple): (h, w) of the frames.
+        output_file (str): path of the saved module.
+
+    Returns:
+        ScriptModule: the traced module.
+    """
+    streaming_model = StreamingYOLOX(model).eval()
+    traced = torch.jit.trace(streaming_model, _example_inputs(streaming_model, input_size))
+    traced.save(output_file)
+    return traced
+
+
+@torch.no_grad()
+def export_onnx(model, input_size, output_file, opset=11):
+    """
+    Export the on_pipe model with an explicit state to ONNX.
+
+    Inputs are ``frame, first, buffer2, buffer1, buffer0``, outputs are
+    ``output, buffer2_out, buffer1_out, buffer0_out``.
+    """
+    streaming_model = StreamingYOLOX(model).eval()
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # the tracing exporter, the default one before torch 2.9
+        kwargs["dynamo"] = False
+    torch.onnx.export(
+        streaming_model,
+        _example_inputs(streaming_model, input_size),
+        output_file,
+        input_names=["frame", "first"] + BUFFER_NAMES,
+        output_names=["output"] + [name + "_out" for name in BUFFER_NAMES],
+        opset_version=opset,
+        **kwargs,
+    )
+    return output_file
+
+
+@torch.no_grad()
+def check_streaming_parity(model, streaming_model, input_size, n_frames=5, seed=0):
+    """
+    Run eager on_pipe inference and an exported streaming model over the same
+    random sequence.
+
+    Args:
+        model (nn.Module): eager YOLOX model.
+        streaming_model (callable): StreamingYOLOX, traced module or ONNXStreamingModel.
+
+    Returns:
+        list of float: max absolute output difference of every frame.
+    """
+    param = next(model.parameters())
+    generator = torch.Generator().manual_seed(seed)
+    frames = [
+        (torch.rand(1, 3, input_size[0], input_size[1], generator=generator) * 255).to(param.device, param.dtype)
+        for _ in range(n_frames)
+    ]
+
+    first, state = StreamingYOLOX(model).init_state(input_size)
+    buffer = None
+    diffs = []
+    for frame in frames:
+        ref, buffer = model(frame, buffer=buffer, mode='on_pipe')
+        output, *state = streaming_model(frame, first, *state)
+        first = torch.zeros_like(first)
+        diffs.append((output.to(ref) - ref).abs().max().item())
+    return diffs
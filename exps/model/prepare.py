@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Copyright (c) Megvii, Inc. and its affiliates.
+
+from loguru import logger
+
+import torch
+
+from yolox.utils import fuse_model
+
+
+def _unwrap(model):
+    return model.module if hasattr(model, "module") else model
+
+
+@torch.no_grad()
+def _parity_outputs(model, test_size, device, dtype):
+    """off_pipe outputs of a (current, support) pair and on_pipe outputs of a 3 frames sequence."""
+    generator = torch.Generator().manual_seed(0)
+    frames = [
+        (torch.rand(1, 3, test_size[0], test_size[1], generator=generator) * 255).to(device, dtype)
+        for _ in range(3)
+    ]
+    outputs = [model(prepare_input(torch.cat(frames[1::-1], dim=1), model), mode='off_pipe')]
+    buffer = None
+    for frame in frames:
+        output, buffer = model(prepare_input(frame, model), buffer=buffer, mode='on_pipe')
+        outputs.append(output)
+    return outputs
+
+
+def prepare_input(x, model):
+    """Convert images to the memory format the model was prepared for."""
+    memory_format = getattr(_unwrap(model), "memory_format", None)
+    if memory_format is None or x.dim() != 4:
+        return x
+    return x.contiguous(memory_format=memory_format)
+
+
+def prepare_model(
+    model, fuse=True, channels_last=False, check=True, test_size=(320, 512), rtol=1e-3, atol=1e-2
+):
+    """
+    Prepare a YOLOX + DFPPAFPN model for inference, in place.
+
+    Args:
+        model (nn.Module): model with loaded weights.
+        fuse (bool): fold BN into the convs and keep the projected (jian) features
+            in the on_pipe buffer, so each frame goes through the 1x1 convs once.
+        channels_last (bool): convert the weights to channels last memory format,
+            the inputs should be converted by :func:`prepare_input`.
+        check (bool): compare the off_pipe and on_pipe outputs on random frames with
+            the ones of the original model, raise a RuntimeError on mismatch.
+        test_size (tuple): (h, w) of the frames used by the check.
+
+    Returns:
+        nn.Module: the prepared model, in eval mode.
+    """
+    model.eval()
+    param = next(model.parameters())
+    device, dtype = param.device, param.dtype
+    if check:
+        ref_outputs = _parity_outputs(model, test_size, device, dtype)
+
+    inner = _unwrap(model)
+    if fuse:
+        fuse_model(inner)
+        inner.backbone.buffer_jian = True
+    if channels_last:
+        inner.to(memory_format=torch.channels_last)
+        inner.memory_format = torch.channels_last
+
+    if check:
+        outputs = _parity_outputs(model, test_size, device, dtype)
+        max_diff = max((out - ref).abs().max().item() for out, ref in zip(outputs, ref_outputs))
+        logger.info("prepared model max output difference: {:.3g}".format(max_diff))
+        for out, ref in zip(outputs, ref_outputs):
+            if not torch.allclose(out, ref, rtol=rtol, atol=atol):
+                raise RuntimeError(
+                    "prepared model outputs differ from the original ones "
+                    "(max difference {:.3g})".format(max_diff)
+                )
+    return model
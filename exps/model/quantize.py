@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Copyright (c) Megvii, Inc. and its affiliates.
+
+import copy
+
+import torch
+import torch.nn as nn
+
+from .export import StreamingYOLOX
+from .prepare import prepare_model
+
+
+class QuantizedYOLOX(nn.Module):
+    """
+    int8 on_pipe YOLOX for CPU inference, called like ``YOLOX`` in on_pipe mode:
+    ``outputs, buffer = model(frame, buffer=buffer, mode='on_pipe')``.
+
+    The backbone, the DFP fusion and the head convs run quantized, the box
+    decoding runs in float. With ``quantized_buffer`` the buffer is kept as
+    quint8 tensors between frames (4x smaller), it is dequantized when fed back.
+    """
+
+    def __init__(self, graph, model, quantized_buffer=False):
+        super().__init__()
+        self.graph = graph
+        self.head = model.head
+        self.backbone = model.backbone
+        self.quantized_buffer = quantized_buffer
+
+    def init_state(self, input_size, batch_size=1):
+        first = torch.ones(1, dtype=torch.bool)
+        buffer = [
+            torch.zeros(shape) for shape in self.backbone.buffer_shapes(input_size, batch_size)
+        ]
+        return first, buffer
+
+    def forward(self, x, targets=None, buffer=None, mode='on_pipe'):
+        assert mode == 'on_pipe', "only the on_pipe mode is quantized"
+        if buffer is None:
+            first, buffer = self.init_state(x.shape[2:4], x.shape[0])
+        else:
+            first = torch.zeros(1, dtype=torch.bool)
+            buffer = [b.dequantize() if b.is_quantized else b for b in buffer]
+        outputs, *buffer_ = self.graph(x, first, *buffer)
+        if self.quantized_buffer:
+            buffer_ = [torch.quantize_per_tensor_dynamic(b, torch.quint8, False) for b in buffer_]
+
+        self.head.hw = [shape[2:4] for shape in self.backbone.buffer_shapes(x.shape[2:4])]
+        outputs = self.head.decode_outputs(outputs, dtype=outputs.type())
+        return outputs, tuple(buffer_)
+
+
+@torch.no_grad()
+def quantize_model(model, calib_sequences, input_size, backend="x86", quantized_buffer=False):
+    """
+    Post-training static quantization of the on_pipe model.
+
+    Args:
+        model (nn.Module): float YOLOX model with loaded weights, left unchanged.
+        calib_sequences (iterable): calibration sequences, each an iterable of
+            (1, 3, h, w) float frames fed in order, so that the buffer path is
+            calibrated on real consecutive frames.
+        input_size (tuple): (h, w) of the frames.
+        backend (str): quantized engine, "x86", "fbgemm" or "qnnpack" (arm).
+        quantized_buffer (bool): keep the buffer quantized between frames.
+
+    Returns:
+        QuantizedYOLOX: the quantized model, on CPU.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    if backend in torch.backends.quantized.supported_engines:
+        torch.backends.quantized.engine = backend
+
+    model = prepare_model(copy.deepcopy(model).cpu().float(), fuse=True, check=False)
+    model.head.decode_in_inference = False
+    streaming_model = StreamingYOLOX(model).eval()
+    first, buffer = streaming_model.init_state(input_size)
+    example_inputs = (torch.zeros(1, 3, input_size[0], input_size[1]), first) + tuple(buffer)
+    graph = prepare_fx(streaming_model, get_default_qconfig_mapping(backend), example_inputs)
+
+    for frames in calib_sequences:
+        first, buffer = streaming_model.init_state(input_size)
+        for frame in frames:
+            _, *buffer = graph(frame.float().cpu(), first, *buffer)
+            first = torch.zeros_like(first)
+
+    graph = convert_fx(graph)
+    model.head.decode_in_inference = True
+    return QuantizedYOLOX(graph, model, quantized_buffer).eval()
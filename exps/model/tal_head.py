@@ -285,6 +285,12 @@ class TALHead(nn.Module):
             support_label = labels[1]
         nlabel = (label_cut.sum(dim=2) > 0).sum(dim=1)  # number of objects
         support_nlabel = (support_label.sum(dim=2) > 0).sum(dim=1)  # number of objects
+        max_gt = labels[0].shape[1]
+
+        # [batch, max_gt], temporal-aware iou of every gt with the support gt
+        temporal_ious = self.get_temporal_ious(
+            labels[0][..., 1:5], labels[1][..., 1:5], support_nlabel
+        )
 
         total_num_anchors = outputs.shape[1]
         x_shifts = torch.cat(x_shifts, 1)  # [1, n_anchors_all]
@@ -298,14 +304,13 @@ class TALHead(nn.Module):
         l1_targets = []
         obj_targets = []
         fg_masks = []
-        ious_targets = []
+        gt_inds = []
 
         num_fg = 0.0
         num_gts = 0.0
 
         for batch_idx in range(outputs.shape[0]):
             num_gt = int(nlabel[batch_idx])
-            support_num_gt = int(support_nlabel[batch_idx])
             num_gts += num_gt
             if num_gt == 0:
                 cls_target = outputs.new_zeros((0, self.num_classes))
@@ -313,10 +318,9 @@ class TALHead(nn.Module):
                 l1_target = outputs.new_zeros((0, 4))
                 obj_target = outputs.new_zeros((total_num_anchors, 1))
                 fg_mask = outputs.new_zeros(total_num_anchors).bool()
-                ious_target = outputs.new_zeros((0, 1))
+                gt_ind = nlabel.new_zeros(0)
             else:
                 gt_bboxes_per_image = labels[0][batch_idx, :num_gt, 1:5]
-                support_gt_bboxes_per_image = labels[1][batch_idx, :support_num_gt, 1:5]
                 gt_classes = labels[0][batch_idx, :num_gt, 0]
                 bboxes_preds_per_image = bbox_preds[batch_idx]
 
@@ -391,22 +395,10 @@ class TALHead(nn.Module):
                         y_shifts=y_shifts[0][fg_mask],
                     )
 
-                ####
-                if support_num_gt == 0:
-                    ious = torch.ones((num_gt, 1)).cuda()
-                    ious_target = ious[matched_gt_inds]
-                else:
-                    pair_iou_between_current_and_support = bboxes_iou(gt_bboxes_per_image,
-                                                                  support_gt_bboxes_per_image, False)
-
-                    ious, support_id = torch.max(pair_iou_between_current_and_support, dim=1)
-                    filter_id = (ious < self.ignore_thr)
-                    ious[filter_id] = self.ignore_value
-
+                # index into the flattened temporal_ious
+                gt_ind = matched_gt_inds + batch_idx * max_gt
 
-                    ious_target = ious[matched_gt_inds].unsqueeze(1)
-
-            ious_targets.append(ious_target)
+            gt_inds.append(gt_ind)
 
             cls_targets.append(cls_target)
             reg_targets.append(reg_target)
@@ -415,7 +407,7 @@ class TALHead(nn.Module):
             if self.use_l1:
                 l1_targets.append(l1_target)
 
-        ious_targets = torch.cat(ious_targets, 0)
+        ious_targets = temporal_ious.view(-1)[torch.cat(gt_inds, 0)]
 
         cls_targets = torch.cat(cls_targets, 0)
         reg_targets = torch.cat(reg_targets, 0)
@@ -425,7 +417,6 @@ class TALHead(nn.Module):
             l1_targets = torch.cat(l1_targets, 0)
 
         #####################
-        ious_targets = ious_targets.squeeze(1)
         gamma = self.gamma
         weight = 1 / (ious_targets ** gamma + 1e-8)
         #print(bbox_preds.view(-1, 4)[fg_masks])
@@ -471,6 +462,41 @@ class TALHead(nn.Module):
             num_fg / max(num_gts, 1),
         )
 
+    def get_temporal_ious(self, gt_bboxes, support_gt_bboxes, support_nlabel):
+        """
+        Max iou of every gt box with the support gt boxes of its image, set to
+        ignore_value below ignore_thr and to 1 without support boxes, computed
+        on the padded labels of the whole batch.
+
+        Args:
+            gt_bboxes (Tensor): [batch, max_gt, 4] in cxcywh.
+            support_gt_bboxes (Tensor): [batch, max_support_gt, 4] in cxcywh.
+            support_nlabel (Tensor): [batch] number of support gt boxes, the first ones.
+        """
+        # bboxes_iou(xyxy=False) of every pair in each image
+        tl = torch.max(
+            (gt_bboxes[:, :, None, :2] - gt_bboxes[:, :, None, 2:] / 2),
+            (support_gt_bboxes[:, None, :, :2] - support_gt_bboxes[:, None, :, 2:] / 2),
+        )
+        br = torch.min(
+            (gt_bboxes[:, :, None, :2] + gt_bboxes[:, :, None, 2:] / 2),
+            (support_gt_bboxes[:, None, :, :2] + support_gt_bboxes[:, None, :, 2:] / 2),
+        )
+        area_a = torch.prod(gt_bboxes[..., 2:], 2)
+        area_b = torch.prod(support_gt_bboxes[..., 2:], 2)
+        en = (tl < br).to(tl.dtype).prod(dim=3)
+        area_i = torch.prod(br - tl, 3) * en
+        pair_ious = area_i / (area_a[:, :, None] + area_b[:, None, :] - area_i)
+
+        support_mask = (
+            torch.arange(support_gt_bboxes.shape[1], device=support_nlabel.device)
+            < support_nlabel[:, None]
+        )
+        pair_ious = pair_ious.masked_fill(~support_mask[:, None, :], -1.0)
+        ious = pair_ious.max(dim=2).values
+        ious = ious.masked_fill(ious < self.ignore_thr, self.ignore_value)
+        return ious.masked_fill((support_nlabel == 0)[:, None], 1.0)
+
     def get_l1_target(self, l1_target, gt, stride, x_shifts, y_shifts, eps=1e-8):
         l1_target[:, 0] = gt[:, 0] / stride - x_shifts
         l1_target[:, 1] = gt[:, 1] / stride - y_shifts
@@ -498,6 +524,7 @@ class TALHead(nn.Module):
         mode="gpu",
     ):
 
+        device = gt_bboxes_per_image.device
         if mode == "cpu":
             print("------------CPU Mode for This Batch-------------")
             gt_bboxes_per_image = gt_bboxes_per_image.cpu().float()
@@ -580,10 +607,10 @@ class TALHead(nn.Module):
         """
 
         if mode == "cpu":
-            gt_matched_classes = gt_matched_classes.cuda()
-            fg_mask = fg_mask.cuda()
-            pred_ious_this_matching = pred_ious_this_matching.cuda()
-            matched_gt_inds = matched_gt_inds.cuda()
+            gt_matched_classes = gt_matched_classes.to(device)
+            fg_mask = fg_mask.to(device)
+            pred_ious_this_matching = pred_ious_this_matching.to(device)
+            matched_gt_inds = matched_gt_inds.to(device)
 
         return (
             gt_matched_classes,
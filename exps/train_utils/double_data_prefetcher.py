@@ -2,54 +2,106 @@
 # -*- coding:utf-8 -*-
 # Copyright (c) Megvii, Inc. and its affiliates.
 
+import collections
+import queue
+import threading
+import time
+
 import torch
 
 
+def _apply(obj, fn):
+    """Apply `fn` to every tensor of a nested tuple/list, keeping its structure."""
+    if isinstance(obj, torch.Tensor):
+        return fn(obj)
+    if isinstance(obj, (tuple, list)):
+        return type(obj)(_apply(x, fn) for x in obj)
+    return obj
+
+
 class DataPrefetcher:
     """
     DataPrefetcher is inspired by code of following file:
     https://github.com/NVIDIA/apex/blob/master/examples/imagenet/main_amp.py
     It could speedup your pytorch dataloader. For more information, please check
     https://github.com/NVIDIA/apex/issues/304#issuecomment-493562789.
+
+    Batches are pulled from the loader by a background thread, so fetching (and the
+    augmentation itself when the loader has no worker) overlaps with the training
+    step. On CUDA, up to `depth` batches are copied ahead on a side stream. Targets
+    can be any nested tuple of tensors (one, two or N future labels).
+
+    `stall_time` is the time the last `next` call waited for data, a step is
+    loader-bound when it is not negligible compared to the iteration time.
     """
 
-    def __init__(self, loader):
+    def __init__(self, loader, depth=2):
         self.loader = iter(loader)
-        self.stream = torch.cuda.Stream()
-        self.input_cuda = self._input_cuda_for_image
-        self.record_stream = DataPrefetcher._record_stream_for_image
-        self.preload()
+        self.depth = max(int(depth), 1)
+        self.use_cuda = torch.cuda.is_available()
+        self.stream = torch.cuda.Stream() if self.use_cuda else None
 
-    def preload(self):
+        self.stall_time = 0.0
+        self.total_stall_time = 0.0
+        self.exhausted = False
+        self.batches = collections.deque()
+        self.queue = queue.Queue(maxsize=self.depth)
+        self.thread = threading.Thread(target=self._load_loop, daemon=True)
+        self.thread.start()
+        self.preload(block=True)
+
+    def _load_loop(self):
         try:
-            self.next_input, self.next_target, _, _ = next(self.loader)
-        except StopIteration:
-            self.next_input = None
-            self.next_target = None
+            for batch in self.loader:
+                self.queue.put(batch)
+        except Exception as e:
+            # re-raised by the main thread
+            self.queue.put(e)
             return
+        self.queue.put(None)
+
+    def preload(self, block=False):
+        """Move the batches fetched by the loader thread to the device, up to `depth`."""
+        while not self.exhausted and len(self.batches) < self.depth:
+            try:
+                batch = self.queue.get(block=block)
+            except queue.Empty:
+                return
+            if batch is None:
+                self.exhausted = True
+                return
+            if isinstance(batch, Exception):
+                raise batch
+            # only block for the first one
+            block = False
 
-        with torch.cuda.stream(self.stream):
-            self.input_cuda()
-            self.next_target = (self.next_target[0].cuda(non_blocking=True), self.next_target[1].cuda(non_blocking=True))
-            # self.next_target = self.next_target.cuda(non_blocking=True)
+            input, target = batch[0], batch[1]
+            event = None
+            if self.use_cuda:
+                with torch.cuda.stream(self.stream):
+                    input = input.cuda(non_blocking=True)
+                    target = _apply(target, lambda t: t.cuda(non_blocking=True))
+                    event = torch.cuda.Event()
+                    event.record(self.stream)
+            self.batches.append((input, target, event))
 
     def next(self):
-        torch.cuda.current_stream().wait_stream(self.stream)
-        input = self.next_input
-        target = self.next_target
-        if input is not None:
-            self.record_stream(input)
-        if target is not None:
-            target[0].record_stream(torch.cuda.current_stream())
-            target[1].record_stream(torch.cuda.current_stream())
-            # target.record_stream(torch.cuda.current_stream())
-        self.preload()
-        return input, (target[0], target[1])
-        # return input, target
-
-    def _input_cuda_for_image(self):
-        self.next_input = self.next_input.cuda(non_blocking=True)
-
-    @staticmethod
-    def _record_stream_for_image(input):
-        input.record_stream(torch.cuda.current_stream())
+        start = time.perf_counter()
+        if not self.batches:
+            self.preload(block=True)
+        if not self.batches:
+            self.stall_time = time.perf_counter() - start
+            return None, None
+
+        input, target, event = self.batches.popleft()
+        if event is not None:
+            current_stream = torch.cuda.current_stream()
+            current_stream.wait_event(event)
+            input.record_stream(current_stream)
+            _apply(target, lambda t: t.record_stream(current_stream))
+        self.stall_time = time.perf_counter() - start
+        self.total_stall_time += self.stall_time
+
+        # top up without waiting, the remaining batches are fetched during this step
+        self.preload(block=False)
+        return input, target
@@ -13,6 +13,7 @@ from torch.utils.tensorboard import SummaryWriter
 
 # from yolox.data import DataPrefetcher
 from .double_data_prefetcher import DataPrefetcher
+from .worker_memory import worker_mem_usage
 from yolox.exp import Exp
 from yolox.utils import (
     MeterBuffer,
@@ -99,9 +100,9 @@ class Trainer:
         inps = inps.to(self.data_type)
         # targets = targets.to(self.data_type)
         # targets.requires_grad = False
-        targets = (targets[0].to(self.data_type), targets[1].to(self.data_type))
-        targets[0].requires_grad = False
-        targets[1].requires_grad = False
+        targets = tuple(t.to(self.data_type) for t in targets)
+        for t in targets:
+            t.requires_grad = False
         inps, targets = self.exp.preprocess(inps, targets, self.input_size)
         data_end_time = time.time()
 
@@ -126,6 +127,7 @@ class Trainer:
         self.meter.update(
             iter_time=iter_end_time - iter_start_time,
             data_time=data_end_time - iter_start_time,
+            stall_time=self.prefetcher.stall_time,
             lr=lr,
             **outputs,
         )
@@ -157,7 +159,9 @@ class Trainer:
             cache_img=self.args.cache,
         )
         logger.info("init prefetcher, this might take one minute or less...")
-        self.prefetcher = DataPrefetcher(self.train_loader)
+        self.prefetcher = DataPrefetcher(
+            self.train_loader, depth=getattr(self.exp, "prefetch_depth", 2)
+        )
         # max_iter means iters per epoch
         self.max_iter = len(self.train_loader)
 
@@ -254,6 +258,18 @@ class Trainer:
                 ["{}: {:.3f}s".format(k, v.avg) for k, v in time_meter.items()]
             )
 
+            # dataloader workers memory, rss double counts the pages shared between workers
+            worker_str = ""
+            worker_mem = worker_mem_usage() if self.exp.data_num_workers > 0 else []
+            if worker_mem:
+                worker_rss = [rss for _, rss, _ in worker_mem]
+                worker_pss = [pss for _, _, pss in worker_mem if pss is not None]
+                worker_str = ", workers: {}, worker rss: {:.0f}/{:.0f}Mb (mean/max)".format(
+                    len(worker_mem), sum(worker_rss) / len(worker_rss), max(worker_rss)
+                )
+                if worker_pss:
+                    worker_str += ", worker pss: {:.0f}Mb (total)".format(sum(worker_pss))
+
             logger.info(
                 "{}, mem: {:.0f}Mb, {}, {}, lr: {:.3e}".format(
                     progress_str,
@@ -262,6 +278,7 @@ class Trainer:
                     loss_str,
                     self.meter["lr"].latest,
                 )
+                + worker_str
                 + (", size: {:d}, {}".format(self.input_size[0], eta_str))
             )
 
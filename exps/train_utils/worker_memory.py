@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import os
+
+
+def _read_status_kb(path, key):
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(key):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def get_worker_pids(parent_pid=None):
+    """
+    Pids of the child processes of `parent_pid` (the dataloader workers of the
+    current process by default). Only supported on linux, [] otherwise.
+    """
+    parent_pid = os.getpid() if parent_pid is None else parent_pid
+    pids = []
+    if not os.path.isdir("/proc"):
+        return pids
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(name)) as f:
+                # the command name may contain spaces, ppid is the 2nd field after it
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        if ppid == parent_pid:
+            pids.append(int(name))
+    return sorted(pids)
+
+
+def worker_mem_usage(parent_pid=None):
+    """
+    Memory usage of every dataloader worker in Mb.
+
+    RSS counts the pages shared with the main process (model code, mmap-ed
+    annotations, ...) once per worker, PSS splits them between the processes
+    sharing them, so the sum of PSS is the real footprint of the workers.
+
+    Returns:
+        list of (pid, rss, pss), pss is None if the kernel does not report it.
+    """
+    usage = []
+    for pid in get_worker_pids(parent_pid):
+        rss = _read_status_kb("/proc/{}/status".format(pid), "VmRSS:")
+        if rss is None:
+            continue
+        pss = _read_status_kb("/proc/{}/smaps_rollup".format(pid), "Pss:")
+        usage.append((pid, rss / 1024, None if pss is None else pss / 1024))
+    return usage
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Copyright (c) Megvii, Inc. and its affiliates.
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+
+def _set_affinity(tid, cores):
+    if hasattr(os, "sched_setaffinity") and cores:
+        try:
+            os.sched_setaffinity(tid, cores)
+        except OSError:
+            # the thread exited meanwhile
+            pass
+
+
+class CPURuntime:
+    """
+    CPU streaming runtime. The model runs on the calling thread with torch intra-op
+    threads pinned to the first ``model_threads`` cores, preprocessing and
+    postprocessing (NMS) run on one worker thread each, pinned to the remaining
+    cores (or to the last core if the model takes all of them), so they do not
+    compete with the intra-op threads.
+
+    Postprocessing is asynchronous: the next frame can go through the model while
+    the NMS of the previous one runs. Its results, and its exceptions, are handed
+    back to the calling thread by :meth:`done_posts` and :meth:`wait`.
+    """
+
+    def __init__(self, cores=None, model_threads=None):
+        """
+        Args:
+            cores (list): cores to use, the affinity of the process if None.
+            model_threads (int): cores given to the model, all but one if None.
+        """
+        if cores is None:
+            cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else \
+                list(range(os.cpu_count()))
+        self.cores = list(cores)
+        self.worker_tids = set()
+        self.pre_pool = ThreadPoolExecutor(1, initializer=self._init_worker)
+        self.post_pool = ThreadPoolExecutor(1, initializer=self._init_worker)
+        self.post_futures = deque()
+        self.stage_latency = {}
+
+        import cv2
+
+        # resizing runs on the calling worker thread only
+        cv2.setNumThreads(0)
+        if model_threads is None:
+            model_threads = max(len(self.cores) - 1, 1)
+        self.set_split(model_threads)
+
+    def _init_worker(self):
+        self.worker_tids.add(threading.get_native_id())
+        _set_affinity(0, self.worker_cores)
+
+    def set_split(self, model_threads):
+        self.model_threads = min(max(int(model_threads), 1), len(self.cores))
+        self.model_cores = self.cores[:self.model_threads]
+        self.worker_cores = self.cores[self.model_threads:] or self.cores[-1:]
+        torch.set_num_threads(self.model_threads)
+        self.pin()
+
+    def pin(self):
+        """Pin every thread of the process, the intra-op threads may be created lazily."""
+        if not os.path.isdir("/proc/self/task"):
+            return
+        for name in os.listdir("/proc/self/task"):
+            tid = int(name)
+            _set_affinity(tid, self.worker_cores if tid in self.worker_tids else self.model_cores)
+
+    def submit_pre(self, fn, *args):
+        return self.pre_pool.submit(fn, *args)
+
+    def submit_post(self, fn, *args):
+        future = self.post_pool.submit(fn, *args)
+        self.post_futures.append(future)
+        return future
+
+    def done_posts(self):
+        """Results of the finished postprocessing, in submission order, raises their exceptions."""
+        results = []
+        while self.post_futures and self.post_futures[0].done():
+            results.append(self.post_futures.popleft().result())
+        return results
+
+    def wait(self):
+        """Wait for the pending postprocessing, and return as :meth:`done_posts`."""
+        results = []
+        while self.post_futures:
+            results.append(self.post_futures.popleft().result())
+        return results
+
+    def tune(self, pre_fn, model_fn, post_fn, n_iters=5, candidates=None):
+        """
+        Pick the core split with the lowest pre + model + post latency of a frame.
+
+        Args:
+            pre_fn (callable): () -> model input.
+            model_fn (callable): model input -> model output, called on this thread.
+            post_fn (callable): model output -> anything.
+            candidates (list): model thread counts to try, a few splits around
+                "all cores but one" if None.
+
+        Returns:
+            dict: the chosen configuration, see :meth:`config`.
+        """
+        n = len(self.cores)
+        if candidates is None:
+            candidates = sorted({max(n - k, 1) for k in (0, 1, 2)} | {max(n // 2, 1)})
+        for model_threads in candidates:
+            self.set_split(model_threads)
+            latency = []
+            for i in range(n_iters + 1):
+                t0 = time.perf_counter()
+                x = self.submit_pre(pre_fn).result()
+                self.pin()
+                t1 = time.perf_counter()
+                y = model_fn(x)
+                t2 = time.perf_counter()
+                self.post_pool.submit(post_fn, y).result()
+                t3 = time.perf_counter()
+                if i:
+                    # the first iteration of a split warms it up
+                    latency.append((t1 - t0, t2 - t1, t3 - t2))
+            self.stage_latency[model_threads] = np.mean(latency, axis=0).tolist()
+
+        best = min(self.stage_latency, key=lambda k: sum(self.stage_latency[k]))
+        self.set_split(best)
+        return self.config()
+
+    def config(self):
+        return {
+            'cores': self.cores,
+            'model_threads': self.model_threads,
+            'model_cores': self.model_cores,
+            'worker_cores': self.worker_cores,
+            # model threads -> mean (pre, model, post) latency in s measured by tune
+            'stage_latency': self.stage_latency,
+        }
+
+    def shutdown(self):
+        self.pre_pool.shutdown()
+        self.post_pool.shutdown()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Copyright (c) Megvii, Inc. and its affiliates.
+
+import time
+
+import torch
+
+PRECISIONS = {
+    "fp32": torch.float32,
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+}
+
+
+def get_device(name="auto"):
+    """torch.device from a flag value, "auto" picks cuda when available."""
+    if name is None or name == "auto":
+        name = "cuda" if torch.cuda.is_available() else "cpu"
+    return torch.device(name)
+
+
+def get_dtype(precision, device):
+    """
+    Args:
+        precision (str): "fp32", "fp16" or "bf16".
+        device (torch.device): fp16 is only supported on cuda.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError("Unsupported precision {}, use one of {}".format(precision, list(PRECISIONS)))
+    if precision == "fp16" and device.type != "cuda":
+        raise ValueError("fp16 inference needs a cuda device, use bf16 or fp32 on {}".format(device))
+    return PRECISIONS[precision]
+
+
+def device_synchronize(device):
+    """Wait for the pending kernels of `device`, a no-op for the cpu."""
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def time_synchronized(device):
+    """device-accurate time"""
+    device_synchronize(device)
+    return time.perf_counter()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Copyright (c) Megvii, Inc. and its affiliates.
+
+from collections import deque
+
+import numpy as np
+import torch.nn.functional as F
+
+
+class ScaleController:
+    """
+    Pick the input scale of a streaming detector from a moving window of its
+    measured latency against the ``1/fps`` frame budget.
+
+    The scale goes down as soon as the mean latency of the window exceeds the
+    budget, and up when the latency predicted for the next scale (the runtime
+    is assumed to grow with the image area) stays below ``up_margin`` of the
+    budget. The window is cleared after a switch, so every decision is made on
+    latencies measured at the current scale.
+    """
+
+    def __init__(self, scales, fps, init_scale=None, window=10, up_margin=0.8, down_margin=1.0):
+        """
+        Args:
+            scales (list): candidate input scales.
+            fps (float): frame rate of the stream.
+            init_scale (float): starting scale, the largest one if None.
+            window (int): number of frames of the moving window.
+        """
+        self.scales = sorted(scales)
+        self.budget = 1.0 / fps
+        self.window = deque(maxlen=window)
+        self.up_margin = up_margin
+        self.down_margin = down_margin
+        if init_scale is None:
+            self.idx = len(self.scales) - 1
+        else:
+            self.idx = int(np.argmin([abs(s - init_scale) for s in self.scales]))
+        self.n_switch = 0
+
+    @property
+    def scale(self):
+        return self.scales[self.idx]
+
+    def update(self, latency):
+        """Add the latency (s) of a frame processed at the current scale, return the next scale."""
+        self.window.append(latency)
+        if len(self.window) < self.window.maxlen:
+            return self.scale
+
+        mean_latency = np.mean(self.window)
+        idx = self.idx
+        if mean_latency > self.down_margin * self.budget and idx > 0:
+            idx -= 1
+        elif idx < len(self.scales) - 1:
+            predicted = mean_latency * (self.scales[idx + 1] / self.scales[idx]) ** 2
+            if predicted < self.up_margin * self.budget:
+                idx += 1
+
+        if idx != self.idx:
+            self.idx = idx
+            self.window.clear()
+            self.n_switch += 1
+        return self.scale
+
+
+def resize_buffer(buffer, shapes):
+    """
+    Resample a DFP buffer to the feature shapes of another input scale.
+
+    Args:
+        buffer (tuple): buffer returned by the on_pipe model, may be quantized.
+        shapes (list): target shapes, see ``DFPPAFPN.buffer_shapes``.
+    """
+    if buffer is None:
+        return None
+    resized = []
+    for b, shape in zip(buffer, shapes):
+        if b.is_quantized:
+            b = b.dequantize()
+        if tuple(b.shape[2:4]) != tuple(shape[2:4]):
+            b = F.interpolate(b, size=tuple(shape[2:4]), mode='bilinear', align_corners=False)
+        resized.append(b)
+    return tuple(resized)
@@ -146,7 +146,7 @@ def vis_det(img, bboxes, labels, class_names,
                     m.astype(np.uint8), out_scale,
                     interpolation='nearest'
                 )
-            m = m.astype(np.bool)
+            m = m.astype(bool)
             img[m] = 0.5*img[m] + 0.5*color
 
     bbox_color = (0, 255, 0)
@@ -177,7 +177,7 @@ def vis_det(img, bboxes, labels, class_names,
         imwrite(img, out_file)
     return img
 
-def eval_ccf(db, results, class_subset=None, iou_type='bbox'):
+def eval_ccf(db, results, class_subset=None, iou_type='bbox', img_ids=None):
     # ccf means CoCo Format
     if isinstance(results, str):
         if results.endswith('.pkl'):
@@ -189,6 +189,8 @@ def eval_ccf(db, results, class_subset=None, iou_type='bbox'):
     cocoEval = COCOeval(db, results, iou_type)
     if class_subset is not None:
         cocoEval.params.catIds = class_subset
+    if img_ids is not None:
+        cocoEval.params.imgIds = img_ids
         
     cocoEval.evaluate()
     cocoEval.accumulate()
@@ -210,6 +212,7 @@ def result_from_ccf(ccf, iid, start_idx=None, mask=True, sequential=True):
         dets = ccf[start_idx:end_idx]
     else:
         dets = [r for r in ccf if r['image_id'] == iid]
+        end_idx = start_idx
     
     bboxes = np.array([d['bbox'] for d in dets])
     scores = np.array([d['score'] for d in dets])
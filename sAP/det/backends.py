@@ -0,0 +1,90 @@
+'''
+Detector backends
+A backend hides the detector behind a common interface, so that the
+streaming meta-detectors run on top of either mmdet or StreamYOLO:
+    reset() at the start of every sequence
+    __call__(img) on an RGB frame returns (bboxes (ltrb), scores, labels)
+    in the dataset classes, with the device synchronized
+'''
+
+import numpy as np
+
+import torch
+
+from det import parse_det_result
+
+
+class MMDetBackend():
+    def __init__(self, opts, class_mapping=None, n_class=None):
+        from det.det_apis import init_detector, inference_detector
+
+        self.model = init_detector(opts)
+        self.inference_detector = inference_detector
+        self.gpu_pre = not opts.cpu_pre
+        self.class_mapping = class_mapping
+        self.n_class = n_class
+
+    def reset(self):
+        pass
+
+    def __call__(self, img):
+        result = self.inference_detector(self.model, img, gpu_pre=self.gpu_pre)
+        torch.cuda.synchronize()
+        bboxes, scores, labels, _ = \
+            parse_det_result(result, self.class_mapping, self.n_class)
+        return bboxes, scores, labels
+
+class StreamYOLOBackend():
+    ''' on_pipe YOLOX, the DFP buffer persists across the frames of a sequence '''
+
+    def __init__(self, opts, w_img, h_img):
+        from yolox.exp import get_exp
+        from caryle.streamyolo.StreamYOLO.exps.model.prepare import prepare_model, prepare_input
+        from caryle.streamyolo.StreamYOLO.exps.utils.device import get_device, get_dtype
+        from streamyolo.streamyolo_det import preproc, inference
+
+        exp = get_exp(opts.config, None)
+        model = exp.get_model()
+        ckpt = torch.load(opts.weights, map_location='cpu')
+        model.load_state_dict(ckpt['model'])
+        model.eval()
+
+        self.device = get_device(opts.device)
+        precision = opts.precision or ('fp16' if self.device.type == 'cuda' else 'fp32')
+        self.dtype = get_dtype(precision, self.device)
+        model.to(self.device)
+        if opts.fuse:
+            # in fp32, before the precision conversion
+            model = prepare_model(model, fuse=True)
+        model.eval()
+        model.to(self.dtype)
+        self.model = model
+
+        self.in_scale = 0.5 if opts.in_scale is None else opts.in_scale
+        self.input_size = (int(h_img*self.in_scale), int(w_img*self.in_scale))
+        self.preproc = preproc
+        self.prepare_input = prepare_input
+        self.inference = inference
+        self.buffer = None
+
+    def reset(self):
+        self.buffer = None
+
+    @torch.no_grad()
+    def __call__(self, img):
+        # the model is trained on BGR frames
+        x = self.preproc(img, self.input_size)[::-1]
+        x = torch.from_numpy(np.ascontiguousarray(x)).unsqueeze(0).to(self.device, self.dtype)
+        x = self.prepare_input(x, self.model)
+        outputs, self.buffer = self.model(x, buffer=self.buffer, mode='on_pipe')
+        # the detections are copied to the host, which synchronizes the device
+        bboxes, scores, labels, _ = self.inference(outputs[0].float(), in_scale=self.in_scale)
+        return bboxes, scores, labels
+
+def init_backend(opts, class_mapping, n_class, w_img, h_img):
+    if opts.backend == 'mmdet':
+        return MMDetBackend(opts, class_mapping, n_class)
+    elif opts.backend == 'streamyolo':
+        return StreamYOLOBackend(opts, w_img, h_img)
+    else:
+        raise ValueError(f'Unknown detector backend "{opts.backend}"')
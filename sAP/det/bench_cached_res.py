@@ -0,0 +1,87 @@
+'''
+Cached-result lookup benchmark
+Times the per-frame lookups of result_from_ccf (sequential and
+non-sequential) against the indexed CachedResults on a synthetic
+results_ccf list, and checks that they return the same detections
+'''
+
+import argparse, pickle, tempfile
+from os.path import join
+from time import perf_counter
+
+import numpy as np
+
+# the line below is for running in both the current directory
+# and the repo's root directory
+import sys; sys.path.insert(0, '..'); sys.path.insert(0, '.')
+from util.bbox import ltwh2ltrb_
+from det import result_from_ccf
+from det.cached_res import CachedResults
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-imgs', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--dets-per-img', type=int, default=30)
+    parser.add_argument('--n-query', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+
+    opts = parser.parse_args()
+    return opts
+
+def make_ccf(rng, n_img, dets_per_img):
+    ccf = []
+    for iid in range(n_img):
+        for _ in range(rng.poisson(dets_per_img)):
+            ccf.append({
+                'image_id': iid,
+                'bbox': rng.uniform(0, 500, 4).tolist(),
+                'score': rng.rand(),
+                'category_id': int(rng.randint(0, 8)),
+            })
+    return ccf
+
+def main():
+    opts = parse_args()
+    rng = np.random.RandomState(opts.seed)
+
+    print(f'{"images":>7s}{"load (s)":>10s}{"sequential (us)":>17s}'
+        f'{"non-seq (us)":>14s}{"indexed (us)":>14s}{"identical":>11s}')
+    for n_img in opts.n_imgs:
+        ccf = make_ccf(rng, n_img, opts.dets_per_img)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = join(tmp_dir, 'results_ccf.pkl')
+            pickle.dump(ccf, open(path, 'wb'))
+            t1 = perf_counter()
+            cached_res = CachedResults(path)
+            t_load = perf_counter() - t1
+
+        # the frames of a sequence, as processed by srt_det.py
+        start = rng.randint(0, n_img - opts.n_query)
+        iids = np.arange(start, start + opts.n_query)
+
+        t1 = perf_counter()
+        # sequential scan from the start of the list, as for the first sequence
+        end_idx = 0
+        outs_seq = []
+        for iid in iids:
+            end_idx, bboxes, scores, labels, masks = result_from_ccf(ccf, iid, end_idx)
+            outs_seq.append((ltwh2ltrb_(bboxes), scores, labels))
+        t2 = perf_counter()
+        # the non-sequential mode on a subset of the queries, O(N) each
+        n_nonseq = max(1, opts.n_query//20)
+        for iid in iids[:n_nonseq]:
+            result_from_ccf(ccf, iid, sequential=False)
+        t3 = perf_counter()
+        outs_idx = [cached_res({'id': iid})[1:4] for iid in iids]
+        t4 = perf_counter()
+
+        identical = all(
+            np.array_equal(a, b) for out_seq, out_idx in zip(outs_seq, outs_idx)
+            for a, b in zip(out_seq, out_idx)
+        )
+        print(f'{n_img:7d}{t_load:10.2f}{1e6*(t2 - t1)/opts.n_query:17.2f}'
+            f'{1e6*(t3 - t2)/n_nonseq:14.2f}{1e6*(t4 - t3)/opts.n_query:14.2f}{str(identical):>11s}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+'''
+Cached detector outputs
+Lets the simulated detectors replay the outputs of an offline run, stored
+either as a dict from image id to the raw mmdet result (pkl), or as a
+results_ccf list (pkl or json)
+
+A results_ccf list is indexed once at load time: its detections are
+grouped by image id into contiguous arrays, so that the detections of a
+frame are read-only views of these arrays found with one dict lookup
+'''
+
+import json, pickle
+
+import numpy as np
+
+from util.bbox import ltwh2ltrb_
+from det import parse_det_result
+
+
+class CachedResults():
+    def __init__(self, path, coco_mapping=None, n_class=None):
+        if path.endswith('.json'):
+            results = json.load(open(path))
+        else:
+            results = pickle.load(open(path, 'rb'))
+        self.in_ccf = isinstance(results, list)
+        self.coco_mapping = coco_mapping
+        self.n_class = n_class
+        if self.in_ccf:
+            self._index_ccf(results)
+        else:
+            self.results = results
+
+    def _index_ccf(self, ccf):
+        n = len(ccf)
+        iids = np.array([r['image_id'] for r in ccf], dtype=np.int64)
+        # the order of the detections of an image is kept
+        order = np.argsort(iids, kind='stable')
+        if n:
+            self.bboxes = ltwh2ltrb_(np.array([ccf[i]['bbox'] for i in order]))
+            self.scores = np.array([ccf[i]['score'] for i in order])
+            self.labels = np.array([ccf[i]['category_id'] for i in order])
+        else:
+            self.bboxes = np.empty((0, 4))
+            self.scores = np.empty((0,))
+            self.labels = np.empty((0,), dtype=np.int64)
+        if n and 'segmentation' in ccf[0]:
+            self.masks = np.empty(n, dtype=object)
+            for j, i in enumerate(order):
+                self.masks[j] = ccf[i]['segmentation']
+        else:
+            self.masks = None
+        for a in (self.bboxes, self.scores, self.labels, self.masks):
+            if a is not None:
+                a.flags.writeable = False
+
+        uniq, starts, counts = np.unique(iids[order], return_index=True, return_counts=True)
+        self.index = dict(zip(uniq.tolist(), zip(starts.tolist(), (starts + counts).tolist())))
+
+    def __call__(self, img):
+        '''
+        Raw result (None for results_ccf), bboxes (ltrb), scores, labels and
+        masks (None if not available or no detection) of an image
+        '''
+        if self.in_ccf:
+            start, end = self.index.get(img['id'], (0, 0))
+            masks = None if self.masks is None or start == end else self.masks[start:end]
+            return None, self.bboxes[start:end], self.scores[start:end], \
+                self.labels[start:end], masks
+        result = self.results[img['id']]
+        return (result,) + parse_det_result(result, self.coco_mapping, self.n_class)
@@ -0,0 +1,212 @@
+'''
+Simulated real-time detection of one sequence
+The outputs come from get_result(fidx), which returns the raw result (or
+None), bboxes, scores, labels and masks of frame fidx, and the runtimes are
+drawn from a runtime distribution (np.random), given the number of
+detections for a load-conditioned one
+'''
+
+from collections import deque
+from heapq import heappush, heappop
+
+import numpy as np
+
+
+def simulate_seq(n_frame, get_result, runtime_dist, fps, det_stride=1, scheduler=None,
+    keep_raw=True):
+    ''' Single detector, the latest frame is processed once the previous one is done '''
+    timestamps = []
+    results_raw = [] if keep_raw else None
+    results_parsed = []
+    input_fidx = []
+    runtime = []
+    last_fidx = None
+    load_conditioned = getattr(runtime_dist, 'load_conditioned', False)
+
+    t_total = n_frame/fps
+    t_elapsed = 0
+    if scheduler is None:
+        stride_cnt = 0
+
+    while 1:
+        if t_elapsed >= t_total:
+            break
+
+        # identify latest available frame
+        fidx_continous = t_elapsed*fps
+        fidx = int(np.floor(fidx_continous))
+        if fidx == last_fidx:
+            # algorithm is fast and has some idle time
+            fidx += 1
+            if fidx == n_frame:
+                break
+            t_elapsed = fidx/fps
+
+        last_fidx = fidx
+
+        if scheduler is not None:
+            if scheduler.should_wait(t_elapsed, input_fidx[-1] if input_fidx else None):
+                # wait till next frame
+                continue
+        else:
+            if stride_cnt % det_stride == 0:
+                stride_cnt = 1
+            else:
+                stride_cnt += 1
+                continue
+
+        result, bboxes, scores, labels, masks = get_result(fidx)
+
+        rt_this = runtime_dist.draw(load=len(bboxes)) if load_conditioned \
+            else runtime_dist.draw()
+        if scheduler is not None:
+            scheduler.update(rt_this)
+        t_elapsed += rt_this
+        if t_elapsed >= t_total:
+            break
+
+        timestamps.append(t_elapsed)
+        if results_raw is not None:
+            results_raw.append(result)
+        results_parsed.append((bboxes, scores, labels, masks))
+        input_fidx.append(fidx)
+        runtime.append(rt_this)
+
+    out_dict = {
+        'results_parsed': results_parsed,
+        'timestamps': timestamps,
+        'input_fidx': input_fidx,
+        'runtime': runtime,
+    }
+    if results_raw is not None:
+        out_dict['results_raw'] = results_raw
+    return out_dict
+
+def simulate_seq_inf(n_frame, get_result, runtime_dist, fps, keep_raw=True):
+    ''' Infinite detectors, every frame is processed as soon as it arrives '''
+    timestamps = []
+    results_raw = [] if keep_raw else None
+    results_parsed = []
+    input_fidx = []
+    runtime = []
+    load_conditioned = getattr(runtime_dist, 'load_conditioned', False)
+
+    for ii in range(n_frame):
+        t = ii/fps
+
+        result, bboxes, scores, labels, masks = get_result(ii)
+
+        rt_this = runtime_dist.draw(load=len(bboxes)) if load_conditioned \
+            else runtime_dist.draw()
+        t_finishing = t + rt_this
+
+        timestamps.append(t_finishing)
+        if results_raw is not None:
+            results_raw.append(result)
+        results_parsed.append((bboxes, scores, labels, masks))
+        input_fidx.append(ii)
+        runtime.append(rt_this)
+
+    # since parallel excecution, the order is not guaranteed
+    idx = np.argsort(timestamps)
+    out_dict = {
+        'results_parsed': [results_parsed[i] for i in idx],
+        'timestamps': [timestamps[i] for i in idx],
+        'input_fidx': [input_fidx[i] for i in idx],
+        'runtime': [runtime[i] for i in idx],
+    }
+    if results_raw is not None:
+        out_dict['results_raw'] = [results_raw[i] for i in idx]
+    return out_dict
+
+def simulate_seq_k(n_frame, get_result, runtime_dist, fps, n_worker, dispatch='latest',
+    queue_size=2, keep_raw=True):
+    '''
+    n_worker detectors in parallel, each with its runtime drawn from the
+    distribution, with the frames dispatched to them by:
+        latest: a free detector takes the latest frame not taken yet, or
+            waits for the next one (simulate_seq() for a single detector)
+        round_robin: frame i goes to detector i % n_worker, and is dropped
+            if this detector is busy
+        drop_oldest: a free detector takes the oldest frame of a FIFO queue
+            of queue_size frames, and the oldest frame is dropped when a
+            frame arrives to a full queue
+    An idle detector takes a frame as soon as it arrives, and the outputs
+    after the end of the sequence are dropped, as in simulate_seq()
+    '''
+    assert dispatch in ('latest', 'round_robin', 'drop_oldest'), dispatch
+    assert queue_size >= 1, queue_size
+    timestamps = []
+    results_raw = [] if keep_raw else None
+    results_parsed = []
+    input_fidx = []
+    runtime = []
+    load_conditioned = getattr(runtime_dist, 'load_conditioned', False)
+
+    t_total = n_frame/fps
+    idle = set(range(n_worker))     # the first idle detector takes the frame
+    busy = []                       # heap of (finishing time, detector, job)
+    queue = deque()                 # frames waiting for a detector
+
+    def start(w, fidx, t):
+        result, bboxes, scores, labels, masks = get_result(fidx)
+        rt_this = runtime_dist.draw(load=len(bboxes)) if load_conditioned \
+            else runtime_dist.draw()
+        heappush(busy, (t + rt_this, w, (fidx, rt_this, result, (bboxes, scores, labels, masks))))
+
+    def finish():
+        t, w, (fidx, rt_this, result, parsed) = heappop(busy)
+        if t < t_total:
+            timestamps.append(t)
+            if results_raw is not None:
+                results_raw.append(result)
+            results_parsed.append(parsed)
+            input_fidx.append(fidx)
+            runtime.append(rt_this)
+        if queue and dispatch != 'round_robin' and t < t_total:
+            start(w, queue.popleft(), t)
+        else:
+            idle.add(w)
+
+    for ii in range(n_frame):
+        # the detectors done before the frame arrives, which is taken by a
+        # detector done at the same time
+        while busy and busy[0][0]*fps < ii:
+            finish()
+
+        t = ii/fps
+        if dispatch == 'round_robin':
+            # no queue to take the frame from, a detector done when it
+            # arrives is idle (up to the rounding of the sums of runtimes)
+            while busy and busy[0][0]*fps <= ii + 1e-9:
+                finish()
+            w = ii % n_worker
+            if w in idle:
+                idle.remove(w)
+                start(w, ii, t)
+            continue
+
+        if dispatch == 'latest':
+            queue.clear()
+        queue.append(ii)
+        if len(queue) > queue_size:
+            queue.popleft()
+        # frames do not wait in the queue while a detector is idle
+        while queue and idle:
+            w = min(idle)
+            idle.remove(w)
+            start(w, queue.popleft(), t)
+    while busy:
+        finish()
+
+    # the detectors may finish out of order
+    idx = np.argsort(timestamps, kind='stable')
+    out_dict = {
+        'results_parsed': [results_parsed[i] for i in idx],
+        'timestamps': [timestamps[i] for i in idx],
+        'input_fidx': [input_fidx[i] for i in idx],
+        'runtime': [runtime[i] for i in idx],
+    }
+    if results_raw is not None:
+        out_dict['results_raw'] = [results_raw[i] for i in idx]
+    return out_dict
@@ -1,10 +1,13 @@
 '''
 Simulated real-time detection
 In simluation, both the output and the runtime can be specified
+With --n-worker > 1, the frames are dispatched to several detectors
+running in parallel (see simulate_seq_k in det/sim.py), and also to a single
+one with a --dispatch other than latest
 '''
 
 import argparse, json, pickle
-from os.path import join, isfile, basename
+from os.path import join, isfile
 
 from tqdm import tqdm
 import numpy as np
@@ -16,11 +19,12 @@ from pycocotools.coco import COCO
 # the line below is for running in both the current directory 
 # and the repo's root directory
 import sys; sys.path.insert(0, '..'); sys.path.insert(0, '.')
-from util import mkdir2, print_stats
-from util.bbox import ltwh2ltrb_
+from util import mkdir2, print_stats, seq_frame_lists
 from util.runtime_dist import dist_from_dict
-from det import imread, parse_det_result, result_from_ccf
-from det.det_apis import init_detector, inference_detector
+from util.scheduler import DeadlineScheduler
+from det import imread, parse_det_result
+from det.cached_res import CachedResults
+from det.sim import simulate_seq, simulate_seq_k
 
 
 def parse_args():
@@ -29,6 +33,10 @@ def parse_args():
     parser.add_argument('--annot-path', type=str, required=True)
     parser.add_argument('--det-stride', type=float, default=1)
     parser.add_argument('--dynamic-schedule', action='store_true', default=False)
+    parser.add_argument('--n-worker', type=int, default=1, help='number of parallel detectors')
+    parser.add_argument('--dispatch', type=str, default='latest',
+        choices=['latest', 'round_robin', 'drop_oldest'])
+    parser.add_argument('--queue-size', type=int, default=2, help='drop_oldest dispatch')
     parser.add_argument('--in-scale', type=float, default=None)
     parser.add_argument('--fps', type=float, default=30)
     parser.add_argument('--no-mask', action='store_true', default=False)
@@ -36,7 +44,8 @@ def parse_args():
     parser.add_argument('--out-dir', type=str, required=True)
     parser.add_argument('--config', type=str, default=None)
     parser.add_argument('--weights', type=str, default=None)
-    parser.add_argument('--cached-res', type=str, default=None)
+    parser.add_argument('--cached-res', type=str, default=None,
+        help='results_ccf (pkl or json) or raw results by image id (pkl)')
     parser.add_argument('--runtime', type=str, required=True)
     parser.add_argument('--perf-factor', type=float, default=1)
     parser.add_argument('--seed', type=int, default=0)
@@ -47,6 +56,10 @@ def parse_args():
 
 def main():
     opts = parse_args()
+    # simulate_seq_k() with parallel detectors or another dispatch than simulate_seq()
+    opts.dispatched = opts.n_worker > 1 or opts.dispatch != 'latest'
+    assert not opts.dispatched or (opts.det_stride == 1 and not opts.dynamic_schedule), \
+        'no stride or schedule with parallel detectors or a dispatch other than latest'
 
     mkdir2(opts.out_dir)
 
@@ -58,126 +71,62 @@ def main():
         coco_mapping = np.asarray(coco_mapping)
     seqs = db.dataset['sequences']
     seq_dirs = db.dataset['seq_dirs']
+    frame_lists = seq_frame_lists(db)
 
     if opts.cached_res:
-        cache_in_ccf = '_ccf' in basename(opts.cached_res)
-        if cache_in_ccf:
-            # speed up based on the assumption of sequential storage
-            cache_end_idx = 0
-        cached_res = pickle.load(open(opts.cached_res, 'rb'))
+        cached_res = CachedResults(opts.cached_res, coco_mapping, n_class)
     else:
+        from det.det_apis import init_detector, inference_detector
         assert torch.cuda.device_count() == 1 # mmdet only supports single GPU testing
         model = init_detector(opts)
 
     np.random.seed(opts.seed)
     runtime = pickle.load(open(opts.runtime, 'rb'))
     runtime_dist = dist_from_dict(runtime, opts.perf_factor)
+    scheduler = None
+    if opts.dynamic_schedule:
+        scheduler = DeadlineScheduler(opts.fps, runtime_dist=runtime_dist)
 
     runtime_all = []
     n_processed = 0
     n_total = 0
 
     for sid, seq in enumerate(tqdm(seqs)):
-        frame_list = [img for img in db.imgs.values() if img['sid'] == sid]
+        frame_list = frame_lists[sid]
         n_frame = len(frame_list)
         n_total += n_frame
 
-        if not opts.cached_res:
+        if opts.cached_res:
+            get_result = lambda fidx: cached_res(frame_list[fidx])
+        else:
             # load all frames in advance
             frames = []
             for img in frame_list:
                 img_path = join(opts.data_root, seq_dirs[sid], img['name'])
                 frames.append(imread(img_path))
-        
-        timestamps = []
-        results_parsed = []
-        input_fidx = []
-        runtime = []
-        last_fidx = None
-        if opts.cached_res and cache_in_ccf:
-            results_raw = None
-        else:
-            results_raw = []
-        
-        t_total = n_frame/opts.fps
-        t_elapsed = 0
-        if opts.dynamic_schedule:
-            mean_rtf = runtime_dist.mean()*opts.fps
+
+            def get_result(fidx):
+                result = inference_detector(model, frames[fidx])
+                return (result,) + parse_det_result(result, coco_mapping, n_class)
+
+        keep_raw = not (opts.cached_res and cached_res.in_ccf)
+        if opts.dispatched:
+            out_dict = simulate_seq_k(
+                n_frame, get_result, runtime_dist, opts.fps, opts.n_worker,
+                opts.dispatch, opts.queue_size, keep_raw,
+            )
         else:
-            stride_cnt = 0
-
-        while 1:
-            if t_elapsed >= t_total:
-                break
-
-            # identify latest available frame
-            fidx_continous = t_elapsed*opts.fps
-            fidx = int(np.floor(fidx_continous))
-            if fidx == last_fidx:
-                # algorithm is fast and has some idle time
-                fidx += 1
-                if fidx == n_frame:
-                    break
-                t_elapsed = fidx/opts.fps
-                
-            last_fidx = fidx
-
-            if opts.dynamic_schedule:
-                if mean_rtf > 1:
-                    # when runtime <= 1, it should always process every frame
-                    fidx_remainder = fidx_continous - fidx
-                    if mean_rtf < np.floor(fidx_remainder + mean_rtf):
-                        # wait till next frame
-                        continue
-            else:
-                if stride_cnt % opts.det_stride == 0:
-                    stride_cnt = 1
-                else:
-                    stride_cnt += 1
-                    continue
-
-            if opts.cached_res:
-                img = frame_list[fidx]
-                if cache_in_ccf:
-                    cache_end_idx, bboxes, scores, labels, masks = \
-                        result_from_ccf(cached_res, img['id'], cache_end_idx)
-                    ltwh2ltrb_(bboxes)
-                else:
-                    result = cached_res[img['id']]
-                    bboxes, scores, labels, masks = \
-                        parse_det_result(result, coco_mapping, n_class)
-            else:
-                frame = frames[fidx]
-                result = inference_detector(model, frame)
-                bboxes, scores, labels, masks = \
-                    parse_det_result(result, coco_mapping, n_class)
-
-            rt_this = runtime_dist.draw()
-            t_elapsed += rt_this
-            if t_elapsed >= t_total:
-                break
-            
-            timestamps.append(t_elapsed)
-            if results_raw is not None:
-                results_raw.append(result)
-            results_parsed.append((bboxes, scores, labels, masks))
-            input_fidx.append(fidx)
-            runtime.append(rt_this)
+            out_dict = simulate_seq(
+                n_frame, get_result, runtime_dist, opts.fps, opts.det_stride, scheduler,
+                keep_raw,
+            )
 
         out_path = join(opts.out_dir, seq + '.pkl')
         if opts.overwrite or not isfile(out_path):
-            out_dict = {
-                'results_parsed': results_parsed,
-                'timestamps': timestamps,
-                'input_fidx': input_fidx,
-                'runtime': runtime,
-            }
-            if results_raw is not None:
-                out_dict['results_raw'] = results_raw
             pickle.dump(out_dict, open(out_path, 'wb'))
 
-        runtime_all += runtime
-        n_processed += len(results_parsed)
+        runtime_all += out_dict['runtime']
+        n_processed += len(out_dict['results_parsed'])
 
     runtime_all_np = np.array(runtime_all)
     n_small_runtime = (runtime_all_np < 1.0/opts.fps).sum()
@@ -189,6 +138,7 @@ def main():
             'n_processed': n_processed,
             'n_total': n_total,
             'n_small_runtime': n_small_runtime,
+            'schedule': None if scheduler is None else scheduler.summary(),
         }, open(out_path, 'wb'))  
 
     # convert to ms for display
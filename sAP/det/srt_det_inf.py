@@ -3,7 +3,7 @@ Simulated real-time detection with infinite GPUs
 '''
 
 import argparse, json, pickle
-from os.path import join, isfile, basename
+from os.path import join, isfile
 
 from tqdm import tqdm
 import numpy as np
@@ -15,11 +15,11 @@ from pycocotools.coco import COCO
 # the line below is for running in both the current directory 
 # and the repo's root directory
 import sys; sys.path.insert(0, '..'); sys.path.insert(0, '.')
-from util import mkdir2, print_stats
-from util.bbox import ltwh2ltrb_
+from util import mkdir2, print_stats, seq_frame_lists
 from util.runtime_dist import dist_from_dict
-from det import imread, parse_det_result, result_from_ccf
-from det.det_apis import init_detector, inference_detector
+from det import imread, parse_det_result
+from det.cached_res import CachedResults
+from det.sim import simulate_seq_inf
 
 
 def parse_args():
@@ -31,7 +31,8 @@ def parse_args():
     parser.add_argument('--fps', type=float, default=30)
     parser.add_argument('--config', type=str, default=None)
     parser.add_argument('--weights', type=str, default=None)
-    parser.add_argument('--cached-res', type=str, default=None)
+    parser.add_argument('--cached-res', type=str, default=None,
+        help='results_ccf (pkl or json) or raw results by image id (pkl)')
     parser.add_argument('--runtime', type=str, required=True)
     parser.add_argument('--perf-factor', type=float, default=1)
     parser.add_argument('--seed', type=int, default=0)
@@ -54,14 +55,12 @@ def main():
         coco_mapping = np.asarray(coco_mapping)
     seqs = db.dataset['sequences']
     seq_dirs = db.dataset['seq_dirs']
+    frame_lists = seq_frame_lists(db)
 
     if opts.cached_res:
-        cache_in_ccf = '_ccf' in basename(opts.cached_res)
-        if cache_in_ccf:
-            # speed up based on the assumption of sequential storage
-            cache_end_idx = 0
-        cached_res = pickle.load(open(opts.cached_res, 'rb'))
+        cached_res = CachedResults(opts.cached_res, coco_mapping, n_class)
     else:
+        from det.det_apis import init_detector, inference_detector
         assert torch.cuda.device_count() == 1 # mmdet only supports single GPU testing
         model = init_detector(opts)
 
@@ -74,79 +73,34 @@ def main():
     n_total = 0
 
     for sid, seq in enumerate(tqdm(seqs)):
-        frame_list = [img for img in db.imgs.values() if img['sid'] == sid]
+        frame_list = frame_lists[sid]
         n_frame = len(frame_list)
         n_total += n_frame
 
-        if not opts.cached_res:
+        if opts.cached_res:
+            get_result = lambda fidx: cached_res(frame_list[fidx])
+        else:
             # load all frames in advance
             frames = []
             for img in frame_list:
                 img_path = join(opts.data_root, seq_dirs[sid], img['name'])
                 frames.append(imread(img_path))
 
-        timestamps = []
-        results_raw = []
-        results_parsed = []
-        input_fidx = []
-        runtime = []
-        if opts.cached_res and cache_in_ccf:
-            results_raw = None
-        else:
-            results_raw = []
-
-        for ii in range(n_frame):
-            t = ii/opts.fps
-
-            if opts.cached_res:
-                img = frame_list[ii]
-                if cache_in_ccf:
-                    cache_end_idx, bboxes, scores, labels, masks = \
-                        result_from_ccf(cached_res, img['id'], cache_end_idx)
-                    ltwh2ltrb_(bboxes)
-                else:
-                    result = cached_res[img['id']]
-                    bboxes, scores, labels, masks = \
-                        parse_det_result(result, coco_mapping, n_class)
-            else:
-                frame = frames[ii]
-                result = inference_detector(model, frame)
-                bboxes, scores, labels, masks = \
-                    parse_det_result(result, coco_mapping, n_class)
-
-            rt_this = runtime_dist.draw()
-            t_finishing = t + rt_this
-
-            timestamps.append(t_finishing)
-            if results_raw is not None:
-                results_raw.append(result)
-            results_parsed.append((bboxes, scores, labels, masks))
-            input_fidx.append(ii)
-            runtime.append(rt_this)
-
-        # since parallel excecution, the order is not guaranteed
-        idx = np.argsort(timestamps)
-        timestamps = [timestamps[i] for i in idx]
-        if results_raw is not None:
-            results_raw = [results_raw[i] for i in idx]
-        results_parsed = [results_parsed[i] for i in idx]
-        input_fidx = [input_fidx[i] for i in idx]
-        runtime = [runtime[i] for i in idx]
-        
+            def get_result(fidx):
+                result = inference_detector(model, frames[fidx])
+                return (result,) + parse_det_result(result, coco_mapping, n_class)
+
+        out_dict = simulate_seq_inf(
+            n_frame, get_result, runtime_dist, opts.fps,
+            keep_raw=not (opts.cached_res and cached_res.in_ccf),
+        )
+
         out_path = join(opts.out_dir, seq + '.pkl')
         if opts.overwrite or not isfile(out_path):
-            out_dict = {
-                'results_parsed': results_parsed,
-                'timestamps': timestamps,
-                'input_fidx': input_fidx,
-                'runtime': runtime,
-            }
-            if results_raw is not None:
-                out_dict['results_raw'] = results_raw
             pickle.dump(out_dict, open(out_path, 'wb'))
 
-        runtime_all += runtime
-        n_processed += len(results_parsed)
+        runtime_all += out_dict['runtime']
+        n_processed += len(out_dict['results_parsed'])
 
     runtime_all_np = np.array(runtime_all)
     n_small_runtime = (runtime_all_np < 1.0/opts.fps).sum()
@@ -0,0 +1,241 @@
+'''
+Parallel simulated real-time detection
+Runs srt_det.py (or srt_det_inf.py with --inf) from cached results for every
+perf factor x seed, on a process pool over sequence x seed x perf factor,
+for Monte-Carlo estimates of the streaming accuracy and of its variance, with
+a single detector or, with --n-worker or --dispatch, dispatched frames as srt_det.py
+
+Every run is written to <out-dir>/pf<perf factor>_s<seed> in the format of
+srt_det.py, and the time info of all the runs is aggregated in
+<out-dir>/time_info_sweep.pkl. Each task is seeded from (seed, sequence),
+so that the runs do not depend on the number of processes, and the perf
+factors of a seed share their random numbers (the same runtime samples,
+scaled)
+'''
+
+import argparse, io, pickle
+import multiprocessing as mp
+from os.path import join, isfile
+from contextlib import redirect_stdout
+
+from tqdm import tqdm
+import numpy as np
+
+from pycocotools.coco import COCO
+
+# the line below is for running in both the current directory
+# and the repo's root directory
+import sys; sys.path.insert(0, '..'); sys.path.insert(0, '.')
+from util import mkdir2, seq_frame_lists
+from util.bbox import ltrb2ltwh
+from util.runtime_dist import dist_from_dict
+from util.scheduler import DeadlineScheduler
+from det import eval_ccf
+from det.cached_res import CachedResults
+from det.sim import simulate_seq, simulate_seq_inf, simulate_seq_k
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--annot-path', type=str, required=True)
+    parser.add_argument('--cached-res', type=str, required=True,
+        help='results_ccf (pkl or json) or raw results by image id (pkl)')
+    parser.add_argument('--runtime', type=str, required=True)
+    parser.add_argument('--perf-factors', type=float, nargs='+', default=[1])
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('--inf', action='store_true', default=False,
+        help='infinite detectors (srt_det_inf.py)')
+    parser.add_argument('--det-stride', type=float, default=1)
+    parser.add_argument('--dynamic-schedule', action='store_true', default=False)
+    parser.add_argument('--n-worker', type=int, default=1, help='number of parallel detectors')
+    parser.add_argument('--dispatch', type=str, default='latest',
+        choices=['latest', 'round_robin', 'drop_oldest'])
+    parser.add_argument('--queue-size', type=int, default=2, help='drop_oldest dispatch')
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--eta', type=float, default=0, help='eta >= -1')
+    parser.add_argument('--no-class-mapping', action='store_true', default=False)
+    parser.add_argument('--eval', action='store_true', default=False,
+        help='pair every run with the ground truth and evaluate it (see streaming_eval.py)')
+    parser.add_argument('--workers', type=int, default=mp.cpu_count())
+    parser.add_argument('--out-dir', type=str, required=True)
+    parser.add_argument('--overwrite', action='store_true', default=False)
+
+    opts = parser.parse_args()
+    return opts
+
+# read-only state of the workers, set once per process
+ctx = {}
+
+def init_worker(opts, db, cached_res, runtime):
+    ctx['opts'] = opts
+    ctx['db'] = db
+    ctx['seqs'] = db.dataset['sequences']
+    ctx['frame_lists'] = seq_frame_lists(db)
+    ctx['cached_res'] = cached_res
+    ctx['runtime'] = runtime
+
+def run_dir(opts, perf_factor, seed):
+    return join(opts.out_dir, f'pf{perf_factor:g}_s{seed}')
+
+def simulate_task(task):
+    perf_factor, seed, sid = task
+    opts = ctx['opts']
+    frame_list = ctx['frame_lists'][sid]
+    cached_res = ctx['cached_res']
+
+    np.random.seed(np.random.SeedSequence([seed, sid]).generate_state(1)[0])
+    runtime_dist = dist_from_dict(ctx['runtime'], perf_factor)
+    get_result = lambda fidx: cached_res(frame_list[fidx])
+    keep_raw = not cached_res.in_ccf
+    if opts.inf:
+        scheduler = None
+        out_dict = simulate_seq_inf(len(frame_list), get_result, runtime_dist, opts.fps, keep_raw)
+    elif opts.dispatched:
+        scheduler = None
+        out_dict = simulate_seq_k(len(frame_list), get_result, runtime_dist, opts.fps,
+            opts.n_worker, opts.dispatch, opts.queue_size, keep_raw)
+    else:
+        # a scheduler per sequence, it does not learn across the sequences as in srt_det.py
+        scheduler = DeadlineScheduler(opts.fps, runtime_dist=runtime_dist) \
+            if opts.dynamic_schedule else None
+        out_dict = simulate_seq(len(frame_list), get_result, runtime_dist, opts.fps,
+            opts.det_stride, scheduler, keep_raw)
+
+    out_path = join(run_dir(opts, perf_factor, seed), ctx['seqs'][sid] + '.pkl')
+    if opts.overwrite or not isfile(out_path):
+        pickle.dump(out_dict, open(out_path, 'wb'))
+
+    return task, {
+        'runtime': out_dict['runtime'],
+        'n_processed': len(out_dict['results_parsed']),
+        'n_total': len(frame_list),
+        'schedule': None if scheduler is None else scheduler.summary(),
+    }
+
+def pair_seq(frame_list, out_dict, fps, eta):
+    # pairs every frame with the latest output, as streaming_eval.py
+    results_ccf = []
+    timestamps = out_dict['timestamps']
+    tidx_p1 = 0
+    for ii, img in enumerate(frame_list):
+        t = (ii - eta)/fps
+        while tidx_p1 < len(timestamps) and timestamps[tidx_p1] <= t:
+            tidx_p1 += 1
+        if tidx_p1 == 0:
+            continue
+        bboxes, scores, labels = out_dict['results_parsed'][tidx_p1 - 1][:3]
+        if len(bboxes):
+            bboxes_ltwh = ltrb2ltwh(np.asarray(bboxes))
+        for i in range(len(bboxes)):
+            results_ccf.append({
+                'image_id': img['id'],
+                'bbox': bboxes_ltwh[i].tolist(),
+                'score': scores[i],
+                'category_id': labels[i],
+            })
+    return results_ccf
+
+def eval_task(run):
+    perf_factor, seed = run
+    opts = ctx['opts']
+    results_ccf = []
+    for seq, frame_list in zip(ctx['seqs'], ctx['frame_lists']):
+        out_dict = pickle.load(open(join(run_dir(opts, perf_factor, seed), seq + '.pkl'), 'rb'))
+        results_ccf += pair_seq(frame_list, out_dict, opts.fps, opts.eta)
+    if not results_ccf:
+        return run, None
+    with redirect_stdout(io.StringIO()):
+        eval_summary = eval_ccf(ctx['db'], results_ccf)
+    out_path = join(run_dir(opts, perf_factor, seed), 'eval_summary.pkl')
+    if opts.overwrite or not isfile(out_path):
+        pickle.dump(eval_summary, open(out_path, 'wb'))
+    return run, eval_summary['stats']
+
+def main():
+    opts = parse_args()
+    assert not (opts.inf and opts.dynamic_schedule), 'no schedule with infinite detectors'
+    # simulate_seq_k() with parallel detectors or another dispatch than simulate_seq()
+    opts.dispatched = opts.n_worker > 1 or opts.dispatch != 'latest'
+    assert not opts.dispatched or not (opts.inf or opts.dynamic_schedule or opts.det_stride != 1), \
+        'no stride or schedule with parallel detectors or a dispatch other than latest'
+
+    db = COCO(opts.annot_path)
+    n_class = len(db.dataset['categories'])
+    coco_mapping = None if opts.no_class_mapping else db.dataset.get('coco_mapping', None)
+    if coco_mapping is not None:
+        coco_mapping = np.asarray(coco_mapping)
+    n_seq = len(db.dataset['sequences'])
+    cached_res = CachedResults(opts.cached_res, coco_mapping, n_class)
+    runtime = pickle.load(open(opts.runtime, 'rb'))
+
+    runs = [(pf, seed) for pf in opts.perf_factors for seed in opts.seeds]
+    for pf, seed in runs:
+        mkdir2(run_dir(opts, pf, seed))
+    tasks = [(pf, seed, sid) for pf, seed in runs for sid in range(n_seq)]
+
+    seq_info = {}
+    stats = {}
+    initargs = (opts, db, cached_res, runtime)
+    with mp.Pool(min(opts.workers, len(tasks)), init_worker, initargs) as pool:
+        for task, info in tqdm(pool.imap_unordered(simulate_task, tasks), total=len(tasks)):
+            seq_info[task] = info
+        if opts.eval:
+            print('Evaluating the runs')
+            for run, run_stats in tqdm(pool.imap_unordered(eval_task, runs), total=len(runs)):
+                stats[run] = run_stats
+
+    # time info of every run in the format of srt_det.py, from the sequences in order
+    time_info = {}
+    for pf, seed in runs:
+        infos = [seq_info[(pf, seed, sid)] for sid in range(n_seq)]
+        runtime_all = sum((info['runtime'] for info in infos), [])
+        time_info[(pf, seed)] = {
+            'runtime_all': runtime_all,
+            'n_processed': sum(info['n_processed'] for info in infos),
+            'n_total': sum(info['n_total'] for info in infos),
+            'n_small_runtime': (np.array(runtime_all) < 1.0/opts.fps).sum(),
+            'schedule': [info['schedule'] for info in infos] if opts.dynamic_schedule else None,
+            'seed': seed,
+            'perf_factor': pf,
+        }
+        out_path = join(run_dir(opts, pf, seed), 'time_info.pkl')
+        if opts.overwrite or not isfile(out_path):
+            pickle.dump(time_info[(pf, seed)], open(out_path, 'wb'))
+
+    # across the seeds, for every perf factor
+    summary = {}
+    for pf in opts.perf_factors:
+        infos = [time_info[(pf, seed)] for seed in opts.seeds]
+        n_processed = np.array([info['n_processed'] for info in infos])
+        rt_mean = np.array([np.mean(info['runtime_all']) for info in infos])
+        summary[pf] = {
+            'n_processed': n_processed,
+            'runtime_mean': rt_mean,
+        }
+        if opts.eval:
+            summary[pf]['AP'] = np.array([
+                np.nan if stats[(pf, seed)] is None else stats[(pf, seed)][0]
+                for seed in opts.seeds
+            ])
+
+    out_path = join(opts.out_dir, 'time_info_sweep.pkl')
+    if opts.overwrite or not isfile(out_path):
+        pickle.dump({
+            'perf_factors': opts.perf_factors,
+            'seeds': opts.seeds,
+            'runs': time_info,
+            'summary': summary,
+        }, open(out_path, 'wb'))
+
+    print(f'{"perf factor":>12s}{"processed":>18s}{"runtime (ms)":>18s}'
+        + (f'{"AP":>18s}' if opts.eval else ''))
+    for pf in opts.perf_factors:
+        s = summary[pf]
+        line = f'{pf:12g}{s["n_processed"].mean():10.1f} ± {s["n_processed"].std():5.1f}' \
+            f'{1e3*s["runtime_mean"].mean():10.2f} ± {1e3*s["runtime_mean"].std():5.2f}'
+        if opts.eval:
+            line += f'{100*s["AP"].mean():10.2f} ± {100*s["AP"].std():5.2f}'
+        print(line)
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,8 @@ import cv2
 
 import pycocotools.mask as maskUtils
 
+from util.box_kernels import clean_up_
+
 
 def extrap_clean_up_single(bbox, w_img, h_img, min_size=75):
     # bbox in ltwh
@@ -25,33 +27,15 @@ def extrap_clean_up_single(bbox, w_img, h_img, min_size=75):
     bbox[2:] = bbox[2:] - bbox[:2]
 
     # int conversion is neccessary, otherwise, there are very small w, h that round up to 0
-    if bbox[2].astype(np.int)*bbox[3].astype(np.int) < min_size:
+    if int(bbox[2])*int(bbox[3]) < min_size:
         return None
 
     return bbox
 
 def extrap_clean_up(bboxes, w_img, h_img, min_size=75, lt=False):
     # bboxes in the format of [cx or l, cy or t, w, h]
-    wh_nz = bboxes[:, 2:] > 0
-    keep = np.logical_and(wh_nz[:, 0], wh_nz[:, 1])
-
-    if lt:
-        # convert [l, t, w, h] to [l, t, r, b]
-        bboxes[:, 2:] = bboxes[:, :2] + bboxes[:, 2:]
-    else:
-        # convert [cx, cy, w, h] to [l, t, r, b]
-        bboxes[:, :2] = bboxes[:, :2] - bboxes[:, 2:]/2
-        bboxes[:, 2:] = bboxes[:, :2] + bboxes[:, 2:]
-
-    # clip to the image
-    bboxes[:, [0, 2]] = bboxes[:, [0, 2]].clip(0, w_img)
-    bboxes[:, [1, 3]] = bboxes[:, [1, 3]].clip(0, h_img)
-
-    # convert [l, t, r, b] to [l, t, w, h]
-    bboxes[:, 2:] = bboxes[:, 2:] - bboxes[:, :2]
-
-    # int conversion is neccessary, otherwise, there are very small w, h that round up to 0
-    keep = np.logical_and(keep, bboxes[:, 2].astype(np.int)*bboxes[:, 3].astype(np.int) >= min_size)
+    # converted to [l, t, w, h] and clipped to the image in place
+    keep = clean_up_(bboxes, w_img, h_img, min_size, lt)
     bboxes = bboxes[keep]
     return bboxes, keep
 
@@ -92,8 +76,8 @@ def bbox_extrap_quad(bboxes1, bboxes2, v1, v2, tk, t32, w_img, h_img, min_size=7
 def warp_mask_to_box(masks1, bboxes1, bboxes2):
     # create a copy and convert list to numpy array
     # bboxes in ltwh
-    bboxes1 = np.array(bboxes1).astype(np.int)
-    bboxes2 = np.array(bboxes2).astype(np.int)
+    bboxes1 = np.array(bboxes1).astype(int)
+    bboxes2 = np.array(bboxes2).astype(int)
 
     masks2 = []
     for m1, b1, b2 in zip(masks1, bboxes1, bboxes2):
@@ -0,0 +1,131 @@
+'''
+Kalman Filter benchmark
+Times a tracking step (predict, keep the matched tracks, update, add the new
+tracks) of the batched torch matrix filter that the forecasters used to run
+against BatchKF on numpy and torch over the number of tracks, and checks
+that they give the same states
+'''
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+
+import torch
+
+# the line below is for running in both the current directory
+# and the repo's root directory
+import sys; sys.path.insert(0, '..'); sys.path.insert(0, '.')
+from forecast.kf_engine import BatchKF
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-tracks', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--n-step', type=int, default=50)
+    parser.add_argument('--keep-ratio', type=float, default=0.9)
+    parser.add_argument('--seed', type=int, default=0)
+
+    opts = parser.parse_args()
+    return opts
+
+class MatrixKF():
+    # the previous filter of pps_forecast_kf.py and streamer.py
+    def __init__(self):
+        self.F = torch.eye(8)
+        self.Q = torch.eye(8)
+        self.R = 10*torch.eye(4)
+        self.P_init = 100*torch.eye(8).unsqueeze(0)
+        self.x = torch.empty((0, 8, 1))
+        self.P = torch.empty((0, 8, 8))
+
+    def step(self, dt, order1, z, z_new):
+        self.F[[0, 1, 2, 3], [4, 5, 6, 7]] = dt
+        self.Q[range(8), range(8)] = dt*dt
+        x = self.F @ self.x
+        P = self.F @ self.P @ self.F.t() + self.Q
+        x, P = x[order1], P[order1]
+
+        y = torch.from_numpy(z).unsqueeze_(2) - x[:, :4]
+        S = P[:, :4, :4] + self.R
+        K = P[:, :, :4] @ S.inverse()
+        x += K @ y
+        P -= K @ P[:, :4]
+
+        x_new = torch.cat((torch.from_numpy(z_new), torch.zeros(z_new.shape)), dim=1).unsqueeze_(2)
+        self.x = torch.cat((x, x_new))
+        self.P = torch.cat((P, self.P_init.expand(len(z_new), -1, -1)))
+
+    def reset(self, bboxes):
+        self.x = torch.cat((torch.from_numpy(bboxes), torch.zeros(bboxes.shape)), dim=1).unsqueeze_(2)
+        self.P = self.P_init.expand(len(bboxes), -1, -1)
+
+def make_steps(rng, n, n_step, keep_ratio):
+    # tracks moving at a constant speed, with noisy detections,
+    # some tracks lost and as many new ones at each step
+    def rand_bboxes(k):
+        return np.stack((
+            rng.uniform(0, 1700, k), rng.uniform(0, 1000, k),
+            rng.uniform(20, 200, k), rng.uniform(20, 150, k),
+        ), axis=1).astype(np.float32)
+
+    bboxes_init = bboxes = rand_bboxes(n)
+    n_keep = int(keep_ratio*n)
+    steps = []
+    for _ in range(n_step):
+        dt = rng.randint(1, 4)
+        order1 = rng.permutation(n)[:n_keep]
+        z = bboxes[order1] + rng.normal(2*dt, 3, (n_keep, 4)).astype(np.float32)
+        z_new = rand_bboxes(n - n_keep)
+        bboxes = np.concatenate((z, z_new))
+        steps.append((dt, order1, z, z_new))
+    return bboxes_init, steps
+
+def run_matrix(bboxes, steps):
+    kf = MatrixKF()
+    kf.reset(bboxes)
+    t1 = perf_counter()
+    for dt, order1, z, z_new in steps:
+        kf.step(dt, order1, z, z_new)
+    t2 = perf_counter()
+    # the (a, b, c) entries of BatchKF
+    pos, vel = [0, 1, 2, 3], [4, 5, 6, 7]
+    P = torch.stack((kf.P[:, pos, pos], kf.P[:, pos, vel], kf.P[:, vel, vel]), dim=1)
+    return t2 - t1, kf.x[:, :, 0].numpy(), P.numpy()
+
+def run_batch(bboxes, steps, backend):
+    kf = BatchKF(r=10, p_init=100, backend=backend)
+    kf.reset(bboxes)
+    t1 = perf_counter()
+    for dt, order1, z, z_new in steps:
+        kf.predict(dt)
+        kf.compact(order1)
+        kf.update(z)
+        kf.append(z_new)
+    t2 = perf_counter()
+    x, P = kf.x[:len(kf)], kf.P[:len(kf)]
+    if backend == 'torch':
+        x, P = x.numpy(), P.numpy()
+    return t2 - t1, x, P
+
+def main():
+    opts = parse_args()
+    rng = np.random.RandomState(opts.seed)
+    torch.set_num_threads(1)
+
+    print(f'{"tracks":>7s}{"matrix (ms)":>13s}{"numpy (ms)":>12s}{"torch (ms)":>12s}'
+        f'{"speedup":>10s}{"max |dx|":>11s}{"max |dP|":>11s}')
+    for n in opts.n_tracks:
+        bboxes, steps = make_steps(rng, n, opts.n_step, opts.keep_ratio)
+        t_matrix, x_ref, P_ref = run_matrix(bboxes, steps)
+        t_numpy, x_numpy, P_numpy = run_batch(bboxes, steps, 'numpy')
+        t_torch, x_torch, P_torch = run_batch(bboxes, steps, 'torch')
+
+        dx = max(np.abs(x_numpy - x_ref).max(), np.abs(x_torch - x_ref).max())
+        dP = max(np.abs(P_numpy - P_ref).max(), np.abs(P_torch - P_ref).max())
+        t_matrix, t_numpy, t_torch = (1e3/opts.n_step*t for t in (t_matrix, t_numpy, t_torch))
+        print(f'{n:7d}{t_matrix:13.3f}{t_numpy:12.3f}{t_torch:12.3f}'
+            f'{t_matrix/t_numpy:9.1f}x{dx:11.2e}{dP:11.2e}')
+
+if __name__ == '__main__':
+    main()
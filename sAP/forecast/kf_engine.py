@@ -0,0 +1,135 @@
+'''
+Batched Kalman Filter engine for the box tracks
+A constant-velocity filter (state [l, t, w, h] and their velocities, H a
+slicing operation, F with dt on the velocity terms, Q = dt^2 I, diagonal R
+and P_init), with the state kept in preallocated arrays
+
+Since F, Q, H and R act on every coordinate separately, the covariance never
+couples two coordinates: each coordinate is a 2-state (position, velocity)
+filter with a symmetric 2x2 covariance [[a, b], [b, c]]. The engine only
+stores (a, b, c) per coordinate, so that prediction and update are a few
+element-wise operations with a scalar S per coordinate instead of batched
+8x8 matrix products and a 4x4 inverse
+
+Runs with numpy arrays or torch CPU tensors
+'''
+
+import numpy as np
+
+import torch
+
+
+class BatchKF():
+    def __init__(self, r=10, p_init=100, capacity=64, backend='numpy', dtype='float32'):
+        '''
+        r: diagonal of R, a scalar or one value per coordinate
+        p_init: diagonal of the initial covariance
+        capacity: initial number of tracks, doubled when exceeded
+        backend: "numpy" or "torch"
+        '''
+        self.backend = backend
+        self.dtype = dtype
+        self.p_init = p_init
+        self.n = 0
+        self.r = self._array(np.broadcast_to(np.asarray(r, dtype=dtype), (4,)).copy())
+        self._alloc(capacity)
+
+    def _array(self, a):
+        return torch.from_numpy(a) if self.backend == 'torch' else a
+
+    def _zeros(self, shape):
+        return self._array(np.zeros(shape, dtype=self.dtype))
+
+    def _alloc(self, capacity):
+        # state and covariance, plus buffers of the same size for the compaction
+        x, P = self._zeros((capacity, 8)), self._zeros((capacity, 3, 4))
+        if self.n:
+            x[:self.n] = self.x[:self.n]
+            P[:self.n] = self.P[:self.n]
+        self.x, self.P = x, P
+        self.x_buf, self.P_buf = self._zeros((capacity, 8)), self._zeros((capacity, 3, 4))
+        self.capacity = capacity
+
+    def _take(self, src, idx, out):
+        if self.backend == 'torch':
+            torch.index_select(src, 0, torch.as_tensor(idx, dtype=torch.long), out=out)
+        else:
+            np.take(src, idx, axis=0, out=out)
+
+    def __len__(self):
+        return self.n
+
+    def reset(self, bboxes=None):
+        ''' Drop all the tracks, and start new ones from the bboxes (ltwh) if given '''
+        self.n = 0
+        if bboxes is not None:
+            self.append(bboxes)
+
+    def append(self, bboxes):
+        ''' New tracks (ltwh) with zero velocity at the end '''
+        k = len(bboxes)
+        if self.n + k > self.capacity:
+            capacity = self.capacity
+            while self.n + k > capacity:
+                capacity *= 2
+            self._alloc(capacity)
+        end = self.n + k
+        self.x[self.n:end, :4] = self._array(np.asarray(bboxes, dtype=self.dtype))
+        self.x[self.n:end, 4:] = 0
+        self.P[self.n:end, 0] = self.p_init
+        self.P[self.n:end, 1] = 0
+        self.P[self.n:end, 2] = self.p_init
+        self.n = end
+
+    def compact(self, order):
+        ''' Keep the tracks in "order" (e.g. order1 of iou_assoc), in that order '''
+        k = len(order)
+        self._take(self.x[:self.n], order, self.x_buf[:k])
+        self._take(self.P[:self.n], order, self.P_buf[:k])
+        self.x, self.x_buf = self.x_buf, self.x
+        self.P, self.P_buf = self.P_buf, self.P
+        self.n = k
+
+    def predict(self, dt):
+        n = self.n
+        x, a, b, c = self.x[:n], self.P[:n, 0], self.P[:n, 1], self.P[:n, 2]
+        x[:, :4] += dt*x[:, 4:]
+        # P = FPF' + Q
+        a += 2*dt*b + dt*dt*c + dt*dt
+        b += dt*c
+        c += dt*dt
+
+    def update(self, z):
+        ''' Update the first len(z) tracks with the measurements z (ltwh) '''
+        k = len(z)
+        x, a, b, c = self.x[:k], self.P[:k, 0], self.P[:k, 1], self.P[:k, 2]
+        # y = z - Hx
+        y = self._array(np.asarray(z, dtype=self.dtype)) - x[:, :4]
+        # S = HPH' + R, K = PH'S^(-1), one scalar S per coordinate
+        k_pos = a/(a + self.r)
+        k_vel = b/(a + self.r)
+        # x = x + Ky
+        x[:, :4] += k_pos*y
+        x[:, 4:] += k_vel*y
+        # P = (I - KH)P
+        c -= k_vel*b
+        b -= k_pos*b
+        a -= k_pos*a
+
+    def bboxes(self):
+        ''' Current positions (ltwh) as a numpy view '''
+        x = self.x[:self.n, :4]
+        return x.numpy() if self.backend == 'torch' else x
+
+    def forecast(self, dt, n_moving, out=None):
+        '''
+        Positions dt ahead, extrapolating only the first n_moving tracks,
+        written to the first rows of out if given
+        '''
+        x = self.x[:self.n]
+        x = x.numpy() if self.backend == 'torch' else x
+        bboxes = np.empty((self.n, 4), dtype=x.dtype) if out is None else out[:self.n]
+        np.multiply(x[:n_moving, 4:], dt, out=bboxes[:n_moving])
+        bboxes[:n_moving] += x[:n_moving, :4]
+        bboxes[n_moving:] = x[n_moving:, :4]
+        return bboxes
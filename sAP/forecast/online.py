@@ -0,0 +1,118 @@
+'''
+Incremental Kalman Filter forecaster
+Same association and forecasting as pps_forecast_kf.py, but driven from the
+outside, so that it can run at query time in an evaluation loop or next to
+a live detector:
+    feed() each detection output with the index of its input frame
+    query() the boxes at any frame index, possibly in the future
+'''
+
+from time import perf_counter
+
+import numpy as np
+
+from util.box_kernels import ltrb2ltwh_, clean_up_
+from track import iou_assoc
+from forecast.kf_engine import BatchKF
+
+
+class KFForecaster():
+    def __init__(self, match_iou_th=0.3, r=10, p_init=100, min_size=75,
+        assoc_method='greedy', backend='numpy'):
+        self.match_iou_th = match_iou_th
+        self.min_size = min_size
+        self.assoc_method = assoc_method
+        self.kf = BatchKF(r=r, p_init=p_init, backend=backend)
+        self._alloc(64)
+        self.t_assoc = []
+        self.t_forecast = []
+        self.reset()
+
+    def reset(self):
+        ''' Start a new sequence, the timing is kept '''
+        self.kf.reset()
+        self.fidx = None            # input frame index of the latest detection
+        self.n_matched = 0          # the first n_matched tracks have a velocity
+        self.tkidx = 0              # track starting index
+        self.scores = self.labels = self.tracks = None
+
+    def _alloc(self, capacity):
+        # buffers of the forecasted boxes and of their clean-up
+        self.bboxes_buf = np.empty((capacity, 4), dtype=np.float32)
+        self.keep_buf = np.empty((capacity,), dtype=bool)
+        self.wh_buf = np.empty((capacity, 2), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.kf)
+
+    def feed(self, fidx, bboxes, scores, labels):
+        '''
+        Detection output (bboxes in ltrb) of the input frame fidx,
+        fed in the order of the input frames
+        '''
+        kf = self.kf
+        if len(kf):
+            kf.predict(int(fidx - self.fidx))
+        self.fidx = fidx
+
+        n = len(bboxes)
+        if not n:
+            return
+
+        t1 = perf_counter()
+        # put high scores det first for better iou matching
+        score_argsort = np.argsort(scores)[::-1]
+        bboxes = ltrb2ltwh_(np.asarray(bboxes, dtype=np.float32)[score_argsort])
+        scores = np.asarray(scores)[score_argsort]
+        labels = np.asarray(labels)[score_argsort]
+
+        updated = False
+        if len(kf):
+            order1, order2, n_matched, self.tracks, self.tkidx = iou_assoc(
+                kf.bboxes(), self.labels, self.tracks, self.tkidx,
+                bboxes, labels, self.match_iou_th,
+                no_unmatched1=True, method=self.assoc_method,
+            )
+            if n_matched:
+                kf.compact(order1)
+                kf.update(bboxes[order2[:n_matched]])
+                kf.append(bboxes[order2[n_matched:]])
+                self.n_matched = n_matched
+                self.labels = labels[order2]
+                self.scores = scores[order2]
+                updated = True
+
+        if not updated:
+            # start from scratch
+            kf.reset(bboxes)
+            self.n_matched = 0
+            self.labels = labels
+            self.scores = scores
+            self.tracks = np.arange(self.tkidx, self.tkidx + n, dtype=np.uint32)
+            self.tkidx += n
+        self.t_assoc.append(perf_counter() - t1)
+
+    def query(self, fidx, w_img, h_img):
+        ''' Boxes (ltwh), scores, labels and track ids forecasted at frame fidx '''
+        if not len(self.kf):
+            return np.empty((0, 4), np.float32), np.empty((0,), np.float32), \
+                np.empty((0,), np.int64), np.empty((0,), np.uint32)
+
+        t1 = perf_counter()
+        n = len(self.kf)
+        if n > len(self.bboxes_buf):
+            self._alloc(2*n)
+        bboxes = self.kf.forecast(fidx - self.fidx, self.n_matched, out=self.bboxes_buf)
+        keep = clean_up_(bboxes, w_img, h_img, self.min_size, lt=True,
+            keep=self.keep_buf, buf=self.wh_buf)
+        out = bboxes[keep], self.scores[keep], self.labels[keep], self.tracks[keep]
+        self.t_forecast.append(perf_counter() - t1)
+        return out
+
+    def summary(self):
+        return {
+            't_assoc': self.t_assoc,
+            't_forecast': self.t_forecast,
+            'match_iou_th': self.match_iou_th,
+            'assoc_method': self.assoc_method,
+        }
@@ -22,19 +22,19 @@ from pycocotools.coco import COCO
 # and the repo's root directory
 import sys; sys.path.insert(0, '..'); sys.path.insert(0, '.')
 from util import mkdir2, print_stats
-from util.bbox import ltrb2ltwh_, ltwh2ltrb_
+from util.box_kernels import ltrb2ltwh_, ltwh2ltrb_
 from util.runtime_dist import dist_from_dict
-from det import imread, parse_det_result
-from det.det_apis import init_detector, inference_detector
+from util.scheduler import DeadlineScheduler
+from util.clock import Clock
+from util.shm import FrameRing, DetResultBuffer
+from det import imread
+from det.backends import init_backend
 from track import track_based_shuffle
-# from track import iou_assoc
-from track.iou_assoc_cp import iou_assoc
+from track import iou_assoc
+# from track.iou_assoc_cp import iou_assoc
 
 from forecast import extrap_clean_up
-from forecast.pps_forecast_kf import \
-    bbox2z, bbox2x, x2bbox, make_F, make_Q, \
-    batch_kf_predict_only, batch_kf_predict, \
-    batch_kf_update
+from forecast.kf_engine import BatchKF
 
 
 def parse_args():
@@ -44,11 +44,19 @@ def parse_args():
     parser.add_argument('--fps', type=float, default=30)
     parser.add_argument('--eta', type=float, default=0, help='eta >= -1') # frame
 
-    parser.add_argument('--config', type=str, required=True)
+    parser.add_argument('--backend', type=str, default='mmdet', choices=['mmdet', 'streamyolo'])
+    parser.add_argument('--config', type=str, required=True,
+        help='mmdet config or StreamYOLO exp file')
     parser.add_argument('--weights', type=str, required=True)
     parser.add_argument('--in-scale', type=float, default=None)
     parser.add_argument('--no-mask', action='store_true', default=False)
     parser.add_argument('--cpu-pre', action='store_true', default=False)
+    parser.add_argument('--device', type=str, default='auto', help='streamyolo: cuda, cpu or auto')
+    parser.add_argument('--precision', type=str, default=None,
+        help='streamyolo: fp32, fp16 or bf16, fp16 on cuda and fp32 on cpu by default')
+    parser.add_argument('--fuse', action='store_true', default=False, help='streamyolo: fuse conv and bn')
+    parser.add_argument('--ring-size', type=int, default=2, help='frame slots in shared memory')
+    parser.add_argument('--max-det', type=int, default=100, help='detections kept per frame')
     
     parser.add_argument('--dynamic-schedule', action='store_true', default=False)
     parser.add_argument('--runtime', type=str, required=True)
@@ -63,47 +71,48 @@ def parse_args():
     opts = parser.parse_args()
     return opts
 
-def det_process(opts, frame_recv, det_res_send, w_img, h_img):
+def det_process(opts, frame_ring, det_res, frame_ready, res_ready, msg_send,
+    coco_mapping, n_class, w_img, h_img):
+    # frames and results go through shared memory, the events only signal them
     try:
-        model = init_detector(opts)
+        backend = init_backend(opts, coco_mapping, n_class, w_img, h_img)
 
-        # warm up the GPU
-        _ = inference_detector(model, np.zeros((h_img, w_img, 3), np.uint8))
-        torch.cuda.synchronize()
+        # warm up the device, through the buffer path as well
+        for _ in range(2):
+            backend(np.zeros((h_img, w_img, 3), np.uint8))
+        # signal ready, no errors
+        msg_send.send('ready')
 
         while 1:
-            fidx = frame_recv.recv()
-            if type(fidx) is list:
-                # new video, read all images in advance
-                frame_list = fidx
-                frames = [imread(img_path) for img_path in frame_list]
-                # signal ready, no errors
-                det_res_send.send('ready')
-                continue
-            elif fidx is None:
+            frame_ready.wait()
+            frame_ready.clear()
+            fidx, img, t1, first = frame_ring.recv()
+            if fidx < 0:
                 # exit flag
                 break
-            fidx, t1 = fidx
-            img = frames[fidx]
             t2 = perf_counter() 
             t_send_frame = t2 - t1
 
-            result = inference_detector(model, img, gpu_pre=not opts.cpu_pre)
-            torch.cuda.synchronize()
+            if first:
+                # new video, drop the state of the previous one
+                backend.reset()
+            bboxes, scores, labels = backend(img)
 
             t3 = perf_counter()
-            det_res_send.send([result, t_send_frame, t3])
+            det_res.write(bboxes, scores, labels, t_send_frame, t3)
+            res_ready.set()
 
     except Exception:
         # report all errors from the child process to the parent
         # forward traceback info as well
-        det_res_send.send(Exception("".join(traceback.format_exception(*sys.exc_info()))))
+        msg_send.send(Exception("".join(traceback.format_exception(*sys.exc_info()))))
+        res_ready.set()
 
 
 def main():
-    assert torch.cuda.device_count() == 1 # mmdet only supports single GPU testing
-
     opts = parse_args()
+    if opts.backend == 'mmdet':
+        assert torch.cuda.device_count() == 1 # mmdet only supports single GPU testing
     mkdir2(opts.out_dir)
 
     db = COCO(opts.annot_path)
@@ -119,28 +128,37 @@ def main():
     w_img, h_img = img['width'], img['height']
 
     mp.set_start_method('spawn')
-    frame_recv, frame_send = mp.Pipe(False)
-    det_res_recv, det_res_send = mp.Pipe(False)
-    det_proc = mp.Process(target=det_process, args=(opts, frame_recv, det_res_send, w_img, h_img))
+    frame_ring = FrameRing(opts.ring_size, h_img, w_img)
+    det_res = DetResultBuffer(opts.max_det)
+    frame_ready = mp.Event()
+    res_ready = mp.Event()
+    # only for the ready signal and errors
+    msg_recv, msg_send = mp.Pipe(False)
+    det_proc = mp.Process(target=det_process, args=(
+        opts, frame_ring, det_res, frame_ready, res_ready, msg_send,
+        coco_mapping, n_class, w_img, h_img,
+    ))
     det_proc.start()
+    msg = msg_recv.recv() # wait till the detector is ready
+    if isinstance(msg, Exception):
+        raise msg
 
     if opts.dynamic_schedule:
         runtime = pickle.load(open(opts.runtime, 'rb'))
         runtime_dist = dist_from_dict(runtime, opts.perf_factor)
-        mean_rtf = runtime_dist.mean()*opts.fps
+        scheduler = DeadlineScheduler(opts.fps, opts.eta, runtime_dist)
 
+    clock = Clock()
     n_total = 0
     t_det_all = []
+    t_write_frame_all = []
     t_send_frame_all = []
     t_recv_res_all = []
     t_assoc_all = []
     t_forecast_all = []
 
     with torch.no_grad():
-        kf_F = torch.eye(8)
-        kf_Q = torch.eye(8)
-        kf_R = 10*torch.eye(4)
-        kf_P_init = 100*torch.eye(8).unsqueeze(0)
+        kf = BatchKF(r=10, p_init=100)
 
         for sid, seq in enumerate(tqdm(seqs)):
             frame_list = [img for img in db.imgs.values() if img['sid'] == sid]
@@ -153,22 +171,16 @@ def main():
             input_fidx = []
             
             processing = False
+            first_frame = True
             fidx_t2 = None            # detection input index at t2
             fidx_latest = None
+            fidx_waited = None        # frame skipped by the dynamic schedule
             tkidx = 0                 # track starting index
-            kf_x = torch.empty((0, 8, 1))
-            kf_P = torch.empty((0, 8, 8))
+            kf.reset()
             n_matched12 = 0
 
-            # let detector process to read all the frames
-            frame_send.send(frame_list)
-            # it is possible that unfetched results remain in the pipe
-            while 1:
-                msg = det_res_recv.recv() # wait till the detector is ready
-                if msg == 'ready':
-                    break
-                elif isinstance(msg, Exception):
-                    raise msg
+            # read all the frames in advance
+            frames = [imread(img_path) for img_path in frame_list]
 
             t_total = n_frame/opts.fps
             t_unit = 1/opts.fps
@@ -182,54 +194,58 @@ def main():
                 # identify latest available frame
                 fidx_continous = t_elapsed*opts.fps
                 fidx = int(np.floor(fidx_continous))
-                if fidx == fidx_latest:
+                if fidx == fidx_latest or fidx == fidx_waited:
                     # algorithm is fast and has some idle time
                     wait_for_next = True
                 else:
                     wait_for_next = False
-                    if opts.dynamic_schedule:
-                        if mean_rtf >= 1:
-                            # when runtime < 1, it should always process every frame
-                            fidx_remainder = fidx_continous - fidx
-                            if mean_rtf < np.floor(fidx_remainder + mean_rtf):
-                                # wait till next frame
-                                wait_for_next = True
+                    if opts.dynamic_schedule and not processing:
+                        # decide once per frame, only when the detector is idle
+                        if scheduler.should_wait(t_elapsed, fidx_t2):
+                            # wait till next frame
+                            wait_for_next = True
+                            fidx_waited = fidx
 
                 if wait_for_next:
-                    # sleep
+                    # sleep till the next frame instead of polling
+                    clock.sleep_until(t_start + (fidx + 1)*t_unit)
                     continue
 
                 if not processing:
                     t_start_frame = perf_counter()
-                    frame_send.send((fidx, t_start_frame))
+                    # camera write, the detector reads the slot in place
+                    slot = frame_ring.write(frames[fidx])
+                    t_frame_written = perf_counter()
+                    t_write_frame_all.append(t_frame_written - t_start_frame)
+                    frame_ring.send(fidx, slot, t_frame_written, first_frame)
+                    first_frame = False
+                    frame_ready.set()
                     fidx_latest = fidx
                     processing = True
   
                 # wait till query - forecast-rt-ub
                 wait_time = t_unit - opts.forecast_rt_ub
-                if det_res_recv.poll(wait_time): # wait
+                if res_ready.wait(wait_time): # wait
                     # new result
-                    result = det_res_recv.recv() 
-                    if isinstance(result, Exception):
-                        raise result
-                    result, t_send_frame, t_start_res = result
-                    bboxes_t2, scores_t2, labels_t2, _ = \
-                        parse_det_result(result, coco_mapping, n_class)
+                    res_ready.clear()
+                    if msg_recv.poll():
+                        raise msg_recv.recv()
+                    bboxes_t2, scores_t2, labels_t2, t_send_frame, t_start_res = det_res.read()
                     processing = False
                     t_det_end = perf_counter()
                     t_det_all.append(t_det_end - t_start_frame)
+                    if opts.dynamic_schedule:
+                        scheduler.update(t_det_end - t_start_frame)
                     t_send_frame_all.append(t_send_frame)
                     t_recv_res_all.append(t_det_end - t_start_res)
 
                     # associate across frames
                     t_assoc_start = perf_counter()
-                    if len(kf_x):
+                    if len(kf):
                         dt = fidx_latest - fidx_t2
 
-                        kf_F = make_F(kf_F, dt)
-                        kf_Q = make_Q(kf_Q, dt)
-                        kf_x, kf_P = batch_kf_predict(kf_F, kf_x, kf_P, kf_Q)
-                        bboxes_f = x2bbox(kf_x)
+                        kf.predict(dt)
+                        bboxes_f = kf.bboxes()
                                         
                     fidx_t2 = fidx_latest
 
@@ -244,7 +260,7 @@ def main():
                         ltrb2ltwh_(bboxes_t2)
 
                     updated = False
-                    if len(kf_x):
+                    if len(kf):
                         order1, order2, n_matched12, tracks, tkidx = iou_assoc(
                             bboxes_f, labels, tracks, tkidx,
                             bboxes_t2, labels_t2, opts.match_iou_th,
@@ -252,28 +268,16 @@ def main():
                         )
 
                         if n_matched12:
-                            kf_x = kf_x[order1]
-                            kf_P = kf_P[order1]
-                            kf_x, kf_P = batch_kf_update(
-                                bbox2z(bboxes_t2[order2[:n_matched12]]),
-                                kf_x,
-                                kf_P,
-                                kf_R,
-                            )
-                    
-                            kf_x_new = bbox2x(bboxes_t2[order2[n_matched12:]])
-                            n_unmatched2 = len(bboxes_t2) - n_matched12
-                            kf_P_new = kf_P_init.expand(n_unmatched2, -1, -1)
-                            kf_x = torch.cat((kf_x, kf_x_new))
-                            kf_P = torch.cat((kf_P, kf_P_new))
+                            kf.compact(order1)
+                            kf.update(bboxes_t2[order2[:n_matched12]])
+                            kf.append(bboxes_t2[order2[n_matched12:]])
                             labels = labels_t2[order2]
                             scores = scores_t2[order2]
                             updated = True
 
                     if not updated:
                         # start from scratch
-                        kf_x = bbox2x(bboxes_t2)
-                        kf_P = kf_P_init.expand(len(bboxes_t2), -1, -1)
+                        kf.reset(bboxes_t2)
                         labels = labels_t2
                         scores = scores_t2
                         tracks = np.arange(tkidx, tkidx + n, dtype=np.uint32)
@@ -286,14 +290,10 @@ def main():
                 t_forecast_start = perf_counter()
                 query_pointer = fidx + opts.eta + 1
                 
-                if len(kf_x):
+                if len(kf):
                     dt = (query_pointer - fidx_t2)
 
-                    kf_x_np = kf_x[:, :, 0].numpy()
-                    bboxes_t3 = kf_x_np[:n_matched12, :4] + dt*kf_x_np[:n_matched12, 4:]
-                    if n_matched12 < len(kf_x):
-                        bboxes_t3 = np.concatenate((bboxes_t3, kf_x_np[n_matched12:, :4]))
-                        
+                    bboxes_t3 = kf.forecast(dt, n_matched12)
                     bboxes_t3, keep = extrap_clean_up(bboxes_t3, w_img, h_img, lt=True)
                     labels_t3 = labels[keep]
                     scores_t3 = scores[keep]
@@ -320,6 +320,16 @@ def main():
                     results_parsed.append((bboxes_t3, scores_t3, labels_t3, None, tracks_t3))
                     input_fidx.append(fidx_t2)
 
+            if processing:
+                # the result of the last frame must land before the buffers are reused,
+                # unless the detector died without reporting it (e.g. killed or crashed)
+                while not res_ready.wait(1):
+                    if not det_proc.is_alive():
+                        raise RuntimeError(f'the detector process exited with code {det_proc.exitcode}')
+                res_ready.clear()
+                if msg_recv.poll():
+                    raise msg_recv.recv()
+
             out_path = join(opts.out_dir, seq + '.pkl')
             if opts.overwrite or not isfile(out_path):
                 pickle.dump({
@@ -329,26 +339,38 @@ def main():
                 }, open(out_path, 'wb'))
 
     # terminates the child process
-    frame_send.send(None)
+    frame_ring.send(-1, 0, 0)
+    frame_ready.set()
+    det_proc.join()
 
     out_path = join(opts.out_dir, 'time_info.pkl')
     if opts.overwrite or not isfile(out_path):
         pickle.dump({
+            'backend': opts.backend,
             'n_total': n_total,
             't_det': t_det_all,
+            't_write_frame': t_write_frame_all,
             't_send_frame': t_send_frame_all,
             't_recv_res': t_recv_res_all,
             't_assoc': t_assoc_all,
             't_forecast': t_forecast_all,
+            'schedule': scheduler.summary() if opts.dynamic_schedule else None,
+            'clock': clock.summary(),
         }, open(out_path, 'wb'))
  
     # convert to ms for display
     s2ms = lambda x: 1e3*x
     print_stats(t_det_all, 'Runtime detection (ms)', cvt=s2ms)
+    print_stats(t_write_frame_all, 'Runtime writing the frame (ms)', cvt=s2ms)
     print_stats(t_send_frame_all, 'Runtime sending the frame (ms)', cvt=s2ms)
     print_stats(t_recv_res_all, 'Runtime receiving the result (ms)', cvt=s2ms)
     print_stats(t_assoc_all, "Runtime association (ms)", cvt=s2ms)
     print_stats(t_forecast_all, "Runtime forecasting (ms)", cvt=s2ms)
+    clock_info = clock.summary()
+    print(f'Waiting for frames: {clock_info["t_sleep"]:.3g}s slept, '
+        f'{clock_info["t_spin"]:.3g}s spinning '
+        f'({100.0*clock_info["t_sleep"]/clock_info["wall_time"]:.4g}% of the wall time freed), '
+        f'{1e3*clock_info["mean_late"]:.3g}ms mean wake-up delay')
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
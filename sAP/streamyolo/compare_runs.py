@@ -0,0 +1,54 @@
+'''
+Compare two streaming runs
+Reads the outputs of streamyolo_det.py (time_info.pkl) and streaming_eval.py
+(eval_summary.pkl) of a baseline and a test run (e.g. fp16 vs int8) and
+prints the sAP and runtime deltas
+'''
+
+import argparse, pickle
+from os.path import join
+
+import numpy as np
+
+# the line below is for running in both the current directory
+# and the repo's root directory
+import sys; sys.path.insert(0, '..'); sys.path.insert(0, '.')
+from util import print_stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-dir', type=str, required=True)
+    parser.add_argument('--test-dir', type=str, required=True)
+    parser.add_argument('--fps', type=float, default=30)
+
+    opts = parser.parse_args()
+    return opts
+
+# names of the first 6 COCOeval stats
+stat_names = ['sAP', 'sAP50', 'sAP75', 'sAPs', 'sAPm', 'sAPl']
+
+def main():
+    opts = parse_args()
+
+    runs = [opts.base_dir, opts.test_dir]
+    stats = [pickle.load(open(join(d, 'eval_summary.pkl'), 'rb'))['stats'] for d in runs]
+    time_info = [pickle.load(open(join(d, 'time_info.pkl'), 'rb')) for d in runs]
+
+    print(f'{"":8s}{"base":>10s}{"test":>10s}{"delta":>10s}')
+    for i, name in enumerate(stat_names):
+        base, test = 100*stats[0][i], 100*stats[1][i]
+        print(f'{name:8s}{base:10.2f}{test:10.2f}{test - base:+10.2f}')
+
+    # convert to ms for display
+    s2ms = lambda x: 1e3*x
+
+    runtime = [np.asarray(t['runtime_all']) for t in time_info]
+    for name, r, t in zip(['base', 'test'], runtime, time_info):
+        print_stats(r, f'Runtime {name} (ms)', cvt=s2ms)
+        print(f'{t["n_processed"]}/{t["n_total"]} frames processed, '
+            f'{100.0*(r < 1.0/opts.fps).mean():.4g}% within the frame interval')
+    print(f'Mean runtime speedup: {runtime[0].mean()/runtime[1].mean():.3g}x')
+
+if __name__ == '__main__':
+    main()
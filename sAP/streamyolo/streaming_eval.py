@@ -17,10 +17,11 @@ from pycocotools.coco import COCO
 # the line below is for running in both the current directory 
 # and the repo's root directory
 import sys; sys.path.insert(0, '..'); sys.path.insert(0, '.')
-from util import mkdir2
-from util.bbox import ltrb2ltwh
+from util import mkdir2, print_stats, seq_frame_lists
+from util.bbox import ltrb2ltwh, ltwh2ltrb_
 from det import imread, vis_det, eval_ccf
 from track import vis_track
+from forecast.online import KFForecaster
 
 
 def parse_args():
@@ -36,6 +37,13 @@ def parse_args():
     parser.add_argument('--no-class-mapping', action='store_true', default=False)    
     parser.add_argument('--no-eval', action='store_true', default=False)
     parser.add_argument('--eval-mask', action='store_true', default=False)
+    parser.add_argument('--per-scale', action='store_true', default=False,
+        help='also evaluate separately the frames paired with each input scale '
+        '(outputs of streamyolo_det.py --in-scales)')
+    parser.add_argument('--forecast', type=str, default=None, choices=['kf', 'live'],
+        help='"kf" forecasts the detections to every frame with the Kalman Filter, '
+        '"live" evaluates the forecasts of streamyolo_det.py --forecast')
+    parser.add_argument('--match-iou-th', type=float, default=0.3)
     parser.add_argument('--overwrite', action='store_true', default=False)
     parser.add_argument('--vis_dir', action='store_true', default=False)
 
@@ -45,6 +53,7 @@ def parse_args():
 
 def main():
     opts = parse_args()
+    assert not (opts.forecast and opts.eval_mask), 'the forecasts have no masks'
 
     out_dir = mkdir2(opts.out_dir) if opts.out_dir else opts.result_dir
     vis_out = bool(opts.vis_dir)
@@ -64,19 +73,39 @@ def main():
     in_time = 0
     miss = 0
     mismatch = 0
+    # input scale -> ids of the images paired with an output at that scale
+    scale_iids = {}
+    forecaster = KFForecaster(opts.match_iou_th) if opts.forecast == 'kf' else None
+    frame_lists = seq_frame_lists(db)
 
     print('Pairing the output with the ground truth')
 
     for sid, seq in enumerate(tqdm(seqs)):
-        frame_list = [img for img in db.imgs.values() if img['sid'] == sid]
+        frame_list = frame_lists[sid]
         
         results = pickle.load(open(join(opts.result_dir, seq + '.pkl'), 'rb'))
         # use raw results when possible in case we change class subset during evaluation
 
-        results_parsed = results['results_parsed']
-        timestamps = results['timestamps']
-        input_fidx = results['input_fidx']
-
+        in_scale = results.get('in_scale', None)
+        if opts.forecast == 'live':
+            # forecasts of the query frames, made at the query time
+            det_timestamps = results['timestamps']
+            results = results['forecast']
+            results_parsed = results['results_parsed']
+            timestamps = results['timestamps']
+            input_fidx = results['query_fidx']
+            if in_scale:
+                # the scale of the latest detection output fed to the forecaster
+                didx = np.searchsorted(det_timestamps, timestamps, side='right') - 1
+                in_scale = [in_scale[max(d, 0)] for d in didx]
+        else:
+            results_parsed = results['results_parsed']
+            timestamps = results['timestamps']
+            input_fidx = results['input_fidx']
+
+        if forecaster is not None:
+            forecaster.reset()
+            tidx_fed = None
         tidx_p1 = 0
         for ii, img in enumerate(frame_list):
             # pred, gt association by time
@@ -94,12 +123,24 @@ def main():
                 in_time += int(ii == ifidx)
                 mismatch += ii - ifidx
 
-                result = results_parsed[tidx]
-                bboxes, scores, labels, masks = result[:4]
-                if len(result) > 4:
-                    tracks = result[4]
+                if in_scale is not None:
+                    scale_iids.setdefault(in_scale[tidx], []).append(img['id'])
+
+                if forecaster is None:
+                    result = results_parsed[tidx]
+                    bboxes, scores, labels, masks = result[:4]
+                    if len(result) > 4:
+                        tracks = result[4]
+                    else:
+                        tracks = None
                 else:
-                    tracks = None
+                    if tidx != tidx_fed:
+                        forecaster.feed(ifidx, *results_parsed[tidx][:3])
+                        tidx_fed = tidx
+                    bboxes, scores, labels, tracks = \
+                        forecaster.query(ii, img['width'], img['height'])
+                    ltwh2ltrb_(bboxes)
+                    masks = None
                     
             if vis_out:
                 img_path = join(opts.data_root, seq_dirs[sid], img['name'])
@@ -138,6 +179,18 @@ def main():
 
                 results_ccf.append(result_dict)
 
+    if forecaster is not None:
+        forecast_info = forecaster.summary()
+        s2ms = lambda x: 1e3*x
+        if len(forecast_info['t_assoc']):
+            print_stats(forecast_info['t_assoc'], 'RT association (ms)', cvt=s2ms)
+        if len(forecast_info['t_forecast']):
+            print_stats(forecast_info['t_forecast'], 'RT forecasting (ms)', cvt=s2ms)
+        # next to the time_info.pkl of the detector
+        out_path = join(out_dir, 'time_info_forecast.pkl')
+        if opts.overwrite or not isfile(out_path):
+            pickle.dump(forecast_info, open(out_path, 'wb'))
+
     out_path = join(out_dir, 'results_ccf.pkl')
     if opts.overwrite or not isfile(out_path):
         pickle.dump(results_ccf, open(out_path, 'wb'))
@@ -161,6 +214,14 @@ def main():
             out_path = join(out_dir, 'eval_summary_mask.pkl')
             if opts.overwrite or not isfile(out_path):
                 pickle.dump(eval_summary, open(out_path, 'wb'))
+        if opts.per_scale and scale_iids:
+            eval_summary = {}
+            for scale in sorted(scale_iids):
+                print(f'Evaluating the {len(scale_iids[scale])} frames at input scale {scale}')
+                eval_summary[scale] = eval_ccf(db, results_ccf, img_ids=scale_iids[scale])
+            out_path = join(out_dir, 'eval_summary_scale.pkl')
+            if opts.overwrite or not isfile(out_path):
+                pickle.dump(eval_summary, open(out_path, 'wb'))
 
     if vis_out:
         print(f'python vis/make_videos.py "{opts.vis_dir}" --fps {opts.fps}')
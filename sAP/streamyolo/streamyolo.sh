@@ -25,3 +25,29 @@ python streaming_eval.py \
 	# --vis-dir "/data/online_resuklt/m_s50/vis" \
 	# --vis-scale 0.5 \
 	#--overwrite \
+
+# int8 on CPU, then compare with the run above
+# python streamyolo_det.py \
+# 	--data-root "$dataDir/Argoverse-1.1/tracking" \
+# 	--annot-path "$dataDir/Argoverse-HD/annotations/val.json" \
+# 	--calib-annot-path "$dataDir/Argoverse-HD/annotations/train.json" \
+# 	--fps 30 \
+# 	--weights $weights \
+# 	--in_scale 0.5 \
+# 	--no-mask \
+# 	--int8 \
+# 	--out-dir "/data/online_resuklt/m_s50_int8" \
+# 	--overwrite \
+# 	--config $config \
+#    &&
+# python streaming_eval.py \
+# 	--data-root "$dataDir/Argoverse-1.1/tracking" \
+# 	--annot-path "$dataDir/Argoverse-HD/annotations/val.json" \
+# 	--fps 30 \
+# 	--eta 0 \
+# 	--result-dir "/data/online_resuklt/m_s50_int8" \
+# 	--out-dir "/data/online_resuklt/m_s50_int8" \
+#    &&
+# python compare_runs.py \
+# 	--base-dir "/data/online_resuklt/m_s50" \
+# 	--test-dir "/data/online_resuklt/m_s50_int8"
@@ -7,7 +7,6 @@ import argparse, json, pickle
 
 from os.path import join, isfile, basename
 from glob import glob
-from time import perf_counter
 
 from tqdm import tqdm
 import numpy as np
@@ -19,12 +18,20 @@ from pycocotools.coco import COCO
 # the line below is for running in both the current directory 
 # and the repo's root directory
 import sys; sys.path.insert(0, '..'); sys.path.insert(0, '.')
-from util import mkdir2, print_stats
+from util import mkdir2, print_stats, seq_frame_lists
+from util.box_kernels import ltwh2ltrb_
+from util.runtime_dist import dist_from_dict
+from util.scheduler import DeadlineScheduler
+from util.clock import Clock, VirtualClock
+from forecast.online import KFForecaster
 from torchvision.ops import batched_nms
 import cv2
 from yolox.exp import get_exp
-from yolox.utils import fuse_model
-import time
+from caryle.streamyolo.StreamYOLO.exps.model.prepare import prepare_model, prepare_input
+from caryle.streamyolo.StreamYOLO.exps.model.quantize import quantize_model
+from caryle.streamyolo.StreamYOLO.exps.utils.device import device_synchronize, get_device, get_dtype
+from caryle.streamyolo.StreamYOLO.exps.utils.cpu_runtime import CPURuntime
+from caryle.streamyolo.StreamYOLO.exps.utils.scale_controller import ScaleController, resize_buffer
 
 
 def parse_args():
@@ -33,11 +40,48 @@ def parse_args():
     parser.add_argument('--annot-path', type=str, required=True)
     parser.add_argument('--det-stride', type=float, default=1)
     parser.add_argument('--in_scale', type=float, default=0.5)
+    parser.add_argument('--in-scales', type=float, nargs='+', default=None,
+        help='switch between these input scales depending on the measured latency, '
+        'starting from --in_scale')
+    parser.add_argument('--scale-window', type=int, default=10,
+        help='frames of the latency window of the scale controller')
+    parser.add_argument('--scale-switch', type=str, default='reset', choices=['reset', 'resample'],
+        help='restart from the star state or resample the buffer when the scale changes')
     parser.add_argument('--fps', type=float, default=30)
     parser.add_argument('--no-mask', action='store_true', default=False)
     parser.add_argument('--no-class-mapping', action='store_true', default=False)
     parser.add_argument('--cpu-pre', action='store_true', default=False)
     parser.add_argument('--dynamic-schedule', action='store_true', default=False)
+    parser.add_argument('--runtime', type=str, default=None,
+        help='offline runtime distribution (pkl), prior of the dynamic schedule')
+    parser.add_argument('--perf-factor', type=float, default=1)
+    parser.add_argument('--sim-runtime', type=str, default=None,
+        help='runtime distribution (pkl) to simulate on a virtual clock instead of '
+        'measuring the real runtime, for deterministic runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--forecast', action='store_true', default=False,
+        help='also forecast the latest detections to every frame that arrives while '
+        'the detector is idle, evaluated by streaming_eval.py --forecast live')
+    parser.add_argument('--match-iou-th', type=float, default=0.3)
+    parser.add_argument('--device', type=str, default='auto', help='cuda, cpu or auto')
+    parser.add_argument('--precision', type=str, default=None,
+        help='fp32, fp16 or bf16, fp16 on cuda and fp32 on cpu by default')
+    parser.add_argument('--fuse', action='store_true', default=False)
+    parser.add_argument('--channels-last', action='store_true', default=False)
+    parser.add_argument('--int8', action='store_true', default=False,
+        help='post-training int8 quantization, runs on cpu')
+    parser.add_argument('--quantized-buffer', action='store_true', default=False,
+        help='keep the DFP buffer in int8 between frames')
+    parser.add_argument('--calib-annot-path', type=str, default=None,
+        help='sequences for the int8 calibration, --annot-path if not set')
+    parser.add_argument('--calib-seqs', type=int, default=3)
+    parser.add_argument('--calib-frames', type=int, default=30)
+    parser.add_argument('--cpu-runtime', action='store_true', default=False,
+        help='pinned model threads, preprocessing and NMS on worker threads (cpu only)')
+    parser.add_argument('--cores', type=str, default=None,
+        help='cores of the cpu runtime, e.g. "0-7" or "0,2,4", the process affinity by default')
+    parser.add_argument('--model-threads', type=int, default=None,
+        help='cores given to the model by the cpu runtime, tuned during warm-up by default')
     parser.add_argument('--out-dir', type=str, required=True)
     parser.add_argument('--config', type=str, required=True)
     parser.add_argument('--weights', type=str, required=True)
@@ -48,17 +92,38 @@ def parse_args():
 
 
 
-def time_synchronized():
-    """pytorch-accurate time"""
-    if torch.cuda.is_available():
-        torch.cuda.synchronize()
-    return time.time()
+def scaled_size(in_scale):
+    # Argoverse frames are 1920x1200
+    return int(1200 * in_scale), int(1920 * in_scale)
 
 def preproc(img, input_size, swap=(2, 0, 1)):
     resized_img = cv2.resize(img, (input_size[1], input_size[0]), interpolation=cv2.INTER_LINEAR,)
     resized_img = resized_img.transpose(swap)
     return resized_img
 
+def parse_cores(cores):
+    if cores is None:
+        return None
+    out = []
+    for part in cores.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            out += list(range(int(first), int(last) + 1))
+        else:
+            out.append(int(part))
+    return out
+
+def calib_sequences(opts, input_size):
+    db = COCO(opts.calib_annot_path or opts.annot_path)
+    seq_dirs = db.dataset['seq_dirs']
+    for sid in range(min(opts.calib_seqs, len(seq_dirs))):
+        frame_list = [img for img in db.imgs.values() if img['sid'] == sid]
+        frames = []
+        for img in frame_list[:opts.calib_frames]:
+            frame = cv2.imread(join(opts.data_root, seq_dirs[sid], img['name']))
+            frames.append(torch.from_numpy(preproc(frame, input_size)).unsqueeze(0).float())
+        yield frames
+
 def inference(outputs, conf_thre=0.01, nms_thresh=0.65, in_scale = 0.5):
     box_corner = outputs.new(outputs.shape)
     box_corner[:, 0] = outputs[:, 0] - outputs[:, 2] / 2
@@ -95,37 +160,95 @@ def main():
     db = COCO(opts.annot_path)
     seqs = db.dataset['sequences']
     seq_dirs = db.dataset['seq_dirs']
+    frame_lists = seq_frame_lists(db)
 
     ###model 
     exp = get_exp(opts.config, None)
     model = exp.get_model()
-    model.cuda()
     model.eval()
     ckpt = torch.load(opts.weights, map_location="cpu")
     model.load_state_dict(ckpt["model"])
     print("loaded checkpoint done.")
-    # model = fuse_model(model)
-    model.eval()
-    model.half()
-    # tensor_type = torch.cuda.FloatTensor
-    tensor_type = torch.cuda.HalfTensor
-
-    # warm up the GPU
-    img = db.imgs[0]
-    w_img, h_img = img['width'], img['height']
-    tmp_image = torch.ones(1, 3, int(h_img/2), int(w_img/2)).type(tensor_type)
-    buffer_ = None
-    for i in range(10):
-        _, _ = model(tmp_image, buffer=buffer_, mode='on_pipe')
-
-    torch.cuda.synchronize()
+    if opts.int8:
+        device, dtype = get_device('cpu'), torch.float32
+        input_size = scaled_size(opts.in_scale)
+        model = quantize_model(model, calib_sequences(opts, input_size), input_size,
+            quantized_buffer=opts.quantized_buffer)
+        print("int8 calibration done.")
+    else:
+        device = get_device(opts.device)
+        precision = opts.precision or ('fp16' if device.type == 'cuda' else 'fp32')
+        dtype = get_dtype(precision, device)
+        model.to(device)
+        if opts.fuse or opts.channels_last:
+            # in fp32, before the precision conversion
+            model = prepare_model(model, fuse=opts.fuse, channels_last=opts.channels_last)
+        model.eval()
+        model.to(dtype)
+
+    # warm up the device at every input scale
+    scales = opts.in_scales or [opts.in_scale]
+    with torch.no_grad():
+        for scale in scales:
+            tmp_image = prepare_input(torch.ones(1, 3, *scaled_size(scale)).to(device, dtype), model)
+            buffer_ = None
+            for i in range(10):
+                _, _ = model(tmp_image, buffer=buffer_, mode='on_pipe')
+
+    device_synchronize(device)
+
+    def to_input(frame, scale):
+        frame = preproc(frame, input_size=scaled_size(scale))  # [3,600,960]
+        frame = torch.from_numpy(frame).unsqueeze(0).to(device, dtype)    # [1,3,600,960]
+        return prepare_input(frame, model)
+
+    cpu_runtime = None
+    if opts.cpu_runtime:
+        assert device.type == 'cpu', 'the cpu runtime needs --device cpu'
+        cpu_runtime = CPURuntime(parse_cores(opts.cores), opts.model_threads)
+        if opts.model_threads is None:
+            # tune the core split on the first frame
+            img = db.imgs[0]
+            tune_frame = cv2.imread(join(opts.data_root, seq_dirs[img['sid']], img['name']))
+            tune_buffer = [None]
+            def tune_model(x):
+                with torch.no_grad():
+                    result, tune_buffer[0] = model(x, buffer=tune_buffer[0], mode='on_pipe')
+                return result
+            cpu_runtime.tune(lambda: to_input(tune_frame, opts.in_scale), tune_model,
+                lambda r: inference(r[0], in_scale=opts.in_scale))
+        print(f'CPU runtime: {cpu_runtime.model_threads} model threads on cores '
+            f'{cpu_runtime.model_cores}, workers on cores {cpu_runtime.worker_cores}')
+
+    scale_controller = None
+    if opts.in_scales:
+        scale_controller = ScaleController(opts.in_scales, opts.fps, opts.in_scale, opts.scale_window)
+
+    scheduler = None
+    if opts.dynamic_schedule:
+        runtime_dist = None
+        if opts.runtime:
+            runtime_dist = dist_from_dict(pickle.load(open(opts.runtime, 'rb')), opts.perf_factor)
+        scheduler = DeadlineScheduler(opts.fps, runtime_dist=runtime_dist)
+
+    if opts.sim_runtime:
+        assert cpu_runtime is None, 'the simulated runtime needs the synchronous loop'
+        np.random.seed(opts.seed)
+        clock = VirtualClock(dist_from_dict(pickle.load(open(opts.sim_runtime, 'rb')), opts.perf_factor))
+    else:
+        clock = Clock()
+
+    forecaster = None
+    if opts.forecast:
+        assert cpu_runtime is None, 'the forecaster needs the synchronous loop'
+        forecaster = KFForecaster(opts.match_iou_th)
 
     runtime_all = []
     n_processed = 0
     n_total = 0
 
     for sid, seq in enumerate(tqdm(seqs)):
-        frame_list = [img for img in db.imgs.values() if img['sid'] == sid]
+        frame_list = frame_lists[sid]
         
         # load all frames in advance
         frames = []
@@ -134,23 +257,67 @@ def main():
             frames.append(cv2.imread(img_path))
         n_frame = len(frames)
         n_total += n_frame
+        h_img, w_img = frames[0].shape[:2]
         
         timestamps = []
         results_raw = []
         results_parsed = []
         input_fidx = []
         runtime = []
+        in_scales = []
         last_fidx = None
+        if forecaster is not None:
+            forecaster.reset()
+            forecast_timestamps = []
+            forecast_fidx = []
+            forecast_results = []
         if not opts.dynamic_schedule:
             stride_cnt = 0
         
         t_total = n_frame/opts.fps
-        t_start = perf_counter()
+        t_start = clock.now()
+
+        def record(result, fidx, t1, scale):
+            # runs on the postprocessing thread with the cpu runtime, returns
+            # the runtime (None past the end) for update()
+            bboxes, scores, labels, masks = inference(result[0], in_scale=scale)
+
+            device_synchronize(device)
+            clock.advance()
+
+            t2 = clock.now()
+            t_elapsed = t2 - t_start
+            if t_elapsed >= t_total:
+                return
+
+            timestamps.append(t_elapsed)
+            results_raw.append(result)
+            results_parsed.append((bboxes, scores, labels, masks))
+            input_fidx.append(fidx)
+            runtime.append(t2 - t1)
+            in_scales.append(scale)
+            if forecaster is not None:
+                forecaster.feed(fidx, bboxes, scores, labels)
+            return t2 - t1
+
+        def update(rt_list):
+            # on the main thread, which reads the scheduler and the scale
+            # controller, in the order of the frames
+            for rt in rt_list:
+                if rt is None:
+                    continue
+                if scale_controller is not None:
+                    scale_controller.update(rt)
+                if scheduler is not None:
+                    scheduler.update(rt)
 
         buffer = None  # buffer feature
+        buffer_scale = None
 
         while 1:
-            t1 = perf_counter()
+            if cpu_runtime is not None:
+                update(cpu_runtime.done_posts())
+            t1 = clock.now()
             t_elapsed = t1 - t_start
             if t_elapsed >= t_total:
                 break
@@ -159,12 +326,21 @@ def main():
             fidx_continous = t_elapsed*opts.fps
             fidx = int(np.floor(fidx_continous))
             if fidx == last_fidx:
+                # sleep till the next frame instead of polling
+                clock.sleep_until(t_start + (fidx + 1)/opts.fps)
                 continue
             
             last_fidx = fidx
+            if forecaster is not None and len(forecaster):
+                # output for the frame that just arrived
+                bboxes, scores, labels, tracks = forecaster.query(fidx, w_img, h_img)
+                forecast_timestamps.append(clock.now() - t_start)
+                forecast_fidx.append(fidx)
+                forecast_results.append((ltwh2ltrb_(bboxes), scores, labels, None, tracks))
+
             if opts.dynamic_schedule:
-                fidx_remainder = fidx_continous - fidx
-                if fidx_remainder > 0.5:
+                if scheduler.should_wait(t_elapsed, input_fidx[-1] if input_fidx else None):
+                    # wait till next frame
                     continue
             else:
                 if stride_cnt % opts.det_stride == 0:
@@ -173,26 +349,29 @@ def main():
                     stride_cnt += 1
                     continue
 
-            frame = frames[fidx]
-            h_img, w_img = int(1200 * opts.in_scale), int(1920 * opts.in_scale)
-            frame = preproc(frame, input_size=(h_img, w_img))  # [3,600,960]
-            with torch.no_grad():
-                frame = torch.from_numpy(frame).unsqueeze(0).type(tensor_type)    # [1,3,600,960]
-                result, buffer = model(frame, buffer=buffer, mode='on_pipe')
-                bboxes, scores, labels, masks = inference(result[0])
-
-            torch.cuda.synchronize()
-
-            t2 = perf_counter()
-            t_elapsed = t2 - t_start
-            if t_elapsed >= t_total:
-                break
+            scale = opts.in_scale if scale_controller is None else scale_controller.scale
+            if scale != buffer_scale and buffer is not None:
+                if opts.scale_switch == 'reset':
+                    # star state, the frame is its own support frame
+                    buffer = None
+                else:
+                    buffer = resize_buffer(buffer, model.backbone.buffer_shapes(scaled_size(scale)))
+            buffer_scale = scale
+
+            if cpu_runtime is None:
+                frame = to_input(frames[fidx], scale)
+                with torch.no_grad():
+                    result, buffer = model(frame, buffer=buffer, mode='on_pipe')
+                update([record(result, fidx, t1, scale)])
+            else:
+                frame = cpu_runtime.submit_pre(to_input, frames[fidx], scale).result()
+                with torch.no_grad():
+                    result, buffer = model(frame, buffer=buffer, mode='on_pipe')
+                # the NMS of this frame runs while the next one goes through the model
+                cpu_runtime.submit_post(record, result, fidx, t1, scale)
 
-            timestamps.append(t_elapsed)
-            results_raw.append(result)
-            results_parsed.append((bboxes, scores, labels, masks))
-            input_fidx.append(fidx)
-            runtime.append(t2 - t1)
+        if cpu_runtime is not None:
+            update(cpu_runtime.wait())
 
         out_path = join(opts.out_dir, seq + '.pkl')
         if opts.overwrite or not isfile(out_path):
@@ -202,6 +381,12 @@ def main():
                 'timestamps': timestamps,
                 'input_fidx': input_fidx,
                 'runtime': runtime,
+                'in_scale': in_scales,
+                'forecast': None if forecaster is None else {
+                    'timestamps': forecast_timestamps,
+                    'query_fidx': forecast_fidx,
+                    'results_parsed': forecast_results,
+                },
             }, open(out_path, 'wb'))
 
         runtime_all += runtime
@@ -217,6 +402,15 @@ def main():
             'n_processed': n_processed,
             'n_total': n_total,
             'n_small_runtime': n_small_runtime,
+            'int8': opts.int8,
+            'device': str(device),
+            'dtype': str(dtype),
+            'cpu_runtime': None if cpu_runtime is None else cpu_runtime.config(),
+            'in_scales': scales,
+            'n_scale_switch': 0 if scale_controller is None else scale_controller.n_switch,
+            'schedule': None if scheduler is None else scheduler.summary(),
+            'clock': clock.summary(),
+            'forecast': None if forecaster is None else forecaster.summary(),
         }, open(out_path, 'wb'))
 
     # convert to ms for display
@@ -227,6 +421,20 @@ def main():
     print(f'Runtime smaller than unit time interval: '
         f'{n_small_runtime}/{n_processed} '
         f'({100.0*n_small_runtime/n_processed:.4g}%)')
+    if not opts.sim_runtime:
+        clock_info = clock.summary()
+        print(f'Waiting for frames: {clock_info["t_sleep"]:.3g}s slept, '
+            f'{clock_info["t_spin"]:.3g}s spinning '
+            f'({100.0*clock_info["t_sleep"]/clock_info["wall_time"]:.4g}% of the wall time freed), '
+            f'{1e3*clock_info["mean_late"]:.3g}ms mean wake-up delay')
+    if forecaster is not None:
+        forecast_info = forecaster.summary()
+        if len(forecast_info['t_assoc']):
+            print_stats(forecast_info['t_assoc'], 'RT association (ms)', cvt=s2ms)
+        if len(forecast_info['t_forecast']):
+            print_stats(forecast_info['t_forecast'], 'RT forecasting (ms)', cvt=s2ms)
+    if cpu_runtime is not None:
+        cpu_runtime.shutdown()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
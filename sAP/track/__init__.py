@@ -8,6 +8,7 @@ import mmcv, cv2
 
 import pycocotools.mask as maskUtils
 from det import imwrite
+from track.assoc import matchers, match_to_orders
 
 def vis_track(img, bboxes, tracks, labels, class_names,
     masks=None, scores=None, score_th=0,
@@ -53,7 +54,7 @@ def vis_track(img, bboxes, tracks, labels, class_names,
                     m.astype(np.uint8), out_scale,
                     interpolation='nearest'
                 )
-            m = m.astype(np.bool)
+            m = m.astype(bool)
             img[m] = 0.5*img[m] + 0.5*color
 
 
@@ -87,94 +88,37 @@ def vis_track(img, bboxes, tracks, labels, class_names,
 vis_track.palettes = np.random.randint(0, 256, (100, 3), dtype=np.uint8)
 
 
-def iou_assoc(bboxes1, labels1, tracks1, tkidx, bboxes2, labels2, match_iou_th, no_unmatched1=False):
-    # iou-based association
-    # shuffle all elements so that matched stays in the front
+def assoc_ious(bboxes1, bboxes2):
     # bboxes are in the form of a list of [l, t, w, h]
     m, n = len(bboxes1), len(bboxes2)
-        
+    if m == 0 or n == 0:
+        return np.zeros((m, n))
     _ = n*[0]
-    ious = maskUtils.iou(bboxes1, bboxes2, _)
-
-    match_fwd = m*[None]
-    matched1 = []
-    matched2 = []
-    unmatched2 = []
-
-    for j in range(n):
-        best_iou = match_iou_th
-        match_i = None
-        for i in range(m):
-            if match_fwd[i] is not None \
-                or labels1[i] != labels2[j] \
-                or ious[i, j] < best_iou:
-                continue
-            best_iou = ious[i, j]
-            match_i = i
-        if match_i is None:
-            unmatched2.append(j)
-        else:
-            matched1.append(match_i)
-            matched2.append(j)
-            match_fwd[match_i] = j
+    return maskUtils.iou(bboxes1, bboxes2, _)
 
-    if no_unmatched1:
-        order1 = matched1
-    else:
-        unmatched1 = list(set(range(m)) - set(matched1))
-        order1 = matched1 + unmatched1
-    order2 = matched2 + unmatched2
+def iou_assoc(bboxes1, labels1, tracks1, tkidx, bboxes2, labels2, match_iou_th,
+    no_unmatched1=False, method='greedy'):
+    # iou-based association
+    # shuffle all elements so that matched stays in the front
+    order1, order2, n_matched = iou_assoc_no_tracks(
+        bboxes1, labels1, bboxes2, labels2, match_iou_th, no_unmatched1, method,
+    )
 
-    n_matched = len(matched2)
-    n_unmatched2 = len(unmatched2)
+    n_unmatched2 = len(bboxes2) - n_matched
     tracks2 = np.concatenate((tracks1[order1][:n_matched],
         np.arange(tkidx, tkidx + n_unmatched2, dtype=tracks1.dtype)))
     tkidx += n_unmatched2
 
     return order1, order2, n_matched, tracks2, tkidx
 
-def iou_assoc_no_tracks(bboxes1, labels1, bboxes2, labels2, match_iou_th, no_unmatched1=False):
+def iou_assoc_no_tracks(bboxes1, labels1, bboxes2, labels2, match_iou_th,
+    no_unmatched1=False, method='greedy'):
     # iou-based association
     # shuffle all elements so that matched stays in the front
-    # bboxes are in the form of a list of [l, t, w, h]
-    m, n = len(bboxes1), len(bboxes2)
-        
-    _ = n*[0]
-    ious = maskUtils.iou(bboxes1, bboxes2, _)
-
-    match_fwd = m*[None]
-    matched1 = []
-    matched2 = []
-    unmatched2 = []
-
-    for j in range(n):
-        best_iou = match_iou_th
-        match_i = None
-        for i in range(m):
-            if match_fwd[i] is not None \
-                or labels1[i] != labels2[j] \
-                or ious[i, j] < best_iou:
-                continue
-            best_iou = ious[i, j]
-            match_i = i
-        if match_i is None:
-            unmatched2.append(j)
-        else:
-            matched1.append(match_i)
-            matched2.append(j)
-            match_fwd[match_i] = j
-
-    if no_unmatched1:
-        order1 = matched1
-    else:
-        unmatched1 = list(set(range(m)) - set(matched1))
-        order1 = matched1 + unmatched1
-    order2 = matched2 + unmatched2
-
-    n_matched = len(matched2)
-    n_unmatched2 = len(unmatched2)
-
-    return order1, order2, n_matched
+    # method: "greedy" (boxes 2 in order, each takes its best box 1) or "hungarian"
+    ious = assoc_ious(bboxes1, bboxes2)
+    match = matchers[method](ious, labels1, labels2, match_iou_th)
+    return match_to_orders(match, len(bboxes1), no_unmatched1)
 
 def track_based_shuffle(tracks1, tracks2, no_unmatched1=False):
     # shuffle all elements so that matched stays in the front
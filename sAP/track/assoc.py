@@ -0,0 +1,77 @@
+'''
+Vectorized IoU matching
+The matchers take the (m, n) IoU matrix between boxes 1 and boxes 2 and
+return for each box 2 the index of its box 1, or -1 if unmatched
+'''
+
+import numpy as np
+
+
+def greedy_match(ious, labels1, labels2, match_iou_th):
+    '''
+    Same result as visiting the boxes 2 in order and giving each one the
+    unmatched box 1 of the same label with the highest IoU (>= match_iou_th,
+    the last one on ties), but in vectorized rounds over the candidate pairs.
+    In every round, each pending box 2 proposes its best available box 1.
+    A proposal is final when no earlier pending box 2 can take that box 1:
+    the boxes available only shrink, so it stays the best of what is left
+    when its turn comes. The first pending box 2 is always final, there are
+    usually a few rounds
+    '''
+    m, n = ious.shape
+    match = np.full(n, -1, dtype=np.int64)
+    if m == 0 or n == 0:
+        return match
+    ii, jj = np.nonzero(
+        (np.asarray(labels1)[:, None] == np.asarray(labels2)[None, :])
+        & (ious >= match_iou_th)
+    )
+    # for each box 2, its candidates by decreasing IoU, the last box 1 first on ties
+    order = np.lexsort((-ii, -ious[ii, jj], jj))
+    ii, jj = ii[order], jj[order]
+    while len(ii):
+        proposal = np.concatenate(([True], jj[1:] != jj[:-1]))
+        prop_i, prop_j = ii[proposal], jj[proposal]
+        # first pending box 2 that could take each box 1
+        first = np.full(m, n)
+        np.minimum.at(first, ii, jj)
+        final = first[prop_i] == prop_j
+        match[prop_j[final]] = prop_i[final]
+        taken = np.zeros(m, dtype=bool)
+        taken[prop_i[final]] = True
+        keep = ~taken[ii] & (match[jj] < 0)
+        ii, jj = ii[keep], jj[keep]
+    return match
+
+def hungarian_match(ious, labels1, labels2, match_iou_th):
+    ''' Matching with the maximum total IoU over the pairs of the same label above the threshold '''
+    from scipy.optimize import linear_sum_assignment
+
+    m, n = ious.shape
+    match = np.full(n, -1, dtype=np.int64)
+    if m == 0 or n == 0:
+        return match
+    valid = (np.asarray(labels1)[:, None] == np.asarray(labels2)[None, :]) \
+        & (ious >= match_iou_th)
+    rows, cols = linear_sum_assignment(np.where(valid, ious, 0), maximize=True)
+    keep = valid[rows, cols]
+    match[cols[keep]] = rows[keep]
+    return match
+
+matchers = {
+    'greedy': greedy_match,
+    'hungarian': hungarian_match,
+}
+
+def match_to_orders(match, m, no_unmatched1=False):
+    ''' Orders that put the matched elements first, as lists '''
+    matched2 = np.nonzero(match >= 0)[0]
+    unmatched2 = np.nonzero(match < 0)[0]
+    matched1 = match[matched2]
+    if no_unmatched1:
+        order1 = matched1
+    else:
+        unmatched1 = np.setdiff1d(np.arange(m), matched1)
+        order1 = np.concatenate((matched1, unmatched1))
+    order2 = np.concatenate((matched2, unmatched2))
+    return order1.tolist(), order2.tolist(), len(matched2)
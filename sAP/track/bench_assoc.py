@@ -0,0 +1,107 @@
+'''
+IoU association benchmark
+Times the python greedy loop that iou_assoc used to run against the
+vectorized greedy and the hungarian matchers over the number of boxes,
+and checks that the vectorized greedy gives the same matches as the loop
+'''
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+import pycocotools.mask as maskUtils
+
+# the line below is for running in both the current directory
+# and the repo's root directory
+import sys; sys.path.insert(0, '..'); sys.path.insert(0, '.')
+from track.assoc import greedy_match, hungarian_match
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-boxes', type=int, nargs='+', default=[10, 50, 100, 200, 500])
+    parser.add_argument('--n-trial', type=int, default=20)
+    parser.add_argument('--n-class', type=int, default=8)
+    parser.add_argument('--match-iou-th', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+
+    opts = parser.parse_args()
+    return opts
+
+def loop_match(ious, labels1, labels2, match_iou_th):
+    # the previous matching loop of iou_assoc
+    m, n = ious.shape
+    match_fwd = m*[None]
+    match = np.full(n, -1, dtype=np.int64)
+    for j in range(n):
+        best_iou = match_iou_th
+        match_i = None
+        for i in range(m):
+            if match_fwd[i] is not None \
+                or labels1[i] != labels2[j] \
+                or ious[i, j] < best_iou:
+                continue
+            best_iou = ious[i, j]
+            match_i = i
+        if match_i is not None:
+            match[j] = match_i
+            match_fwd[match_i] = j
+    return match
+
+def make_frames(rng, n, n_class, w_img=1920, h_img=1200):
+    # boxes 2 are jittered boxes 1, with some boxes leaving and entering
+    # boxes are packed in a band of the image so that they overlap a lot
+    bboxes1 = np.stack((
+        rng.uniform(0, w_img - 200, n),
+        rng.uniform(h_img/3, h_img/2, n),
+        rng.uniform(20, 200, n),
+        rng.uniform(20, 150, n),
+    ), axis=1)
+    labels1 = rng.randint(0, n_class, n)
+    keep = rng.rand(n) < 0.9
+    bboxes2 = bboxes1[keep] + rng.normal(0, 8, (keep.sum(), 4))
+    bboxes2[:, 2:] = np.maximum(bboxes2[:, 2:], 5)
+    labels2 = labels1[keep]
+    n_new = n - len(bboxes2)
+    bboxes2 = np.concatenate((bboxes2, np.stack((
+        rng.uniform(0, w_img - 200, n_new),
+        rng.uniform(h_img/3, h_img/2, n_new),
+        rng.uniform(20, 200, n_new),
+        rng.uniform(20, 150, n_new),
+    ), axis=1)))
+    labels2 = np.concatenate((labels2, rng.randint(0, n_class, n_new)))
+    order = rng.permutation(n)
+    return bboxes1, labels1, bboxes2[order], labels2[order]
+
+def main():
+    opts = parse_args()
+    rng = np.random.RandomState(opts.seed)
+    # scipy import and first call
+    hungarian_match(np.ones((2, 2)), [0, 0], [0, 0], opts.match_iou_th)
+
+    print(f'{"boxes":>6s}{"iou (ms)":>12s}{"loop (ms)":>12s}{"greedy (ms)":>13s}'
+        f'{"hungarian (ms)":>16s}{"speedup":>10s}{"identical":>11s}')
+    for n in opts.n_boxes:
+        t = np.zeros(4)
+        identical = True
+        for _ in range(opts.n_trial):
+            bboxes1, labels1, bboxes2, labels2 = make_frames(rng, n, opts.n_class)
+
+            t1 = perf_counter()
+            ious = maskUtils.iou(bboxes1, bboxes2, n*[0])
+            t2 = perf_counter()
+            match_loop = loop_match(ious, labels1, labels2, opts.match_iou_th)
+            t3 = perf_counter()
+            match_greedy = greedy_match(ious, labels1, labels2, opts.match_iou_th)
+            t4 = perf_counter()
+            hungarian_match(ious, labels1, labels2, opts.match_iou_th)
+            t5 = perf_counter()
+
+            t += (t2 - t1, t3 - t2, t4 - t3, t5 - t4)
+            identical &= np.array_equal(match_loop, match_greedy)
+        t *= 1e3/opts.n_trial
+        print(f'{n:6d}{t[0]:12.3f}{t[1]:12.3f}{t[2]:13.3f}{t[3]:16.3f}'
+            f'{t[1]/t[2]:9.1f}x{str(identical):>11s}')
+
+if __name__ == '__main__':
+    main()
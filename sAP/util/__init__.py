@@ -10,6 +10,13 @@ def mkdir2(path):
         os.makedirs(path)
     return path
 
+def seq_frame_lists(db):
+    # frames of each sequence, in one pass over the images
+    frame_lists = [[] for _ in db.dataset['sequences']]
+    for img in db.imgs.values():
+        frame_lists[img['sid']].append(img)
+    return frame_lists
+
 def print_stats(var, name='', fmt='%.3g', cvt=lambda x: x):
     var = np.asarray(var)
     
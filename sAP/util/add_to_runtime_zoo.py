@@ -1,6 +1,11 @@
 '''
 Extract runtime information from existing runs
 and add it to the model zoo for future simulation
+
+The empirical and mixture models are fitted on the runtimes of time_info.pkl,
+while the AR and load-conditioned ones need the runtimes in order and the
+number of detections of each output, and are fitted on the sequence outputs
+next to it (srt_det.py or streamyolo_det.py runs)
 '''
 
 import argparse, pickle
@@ -13,6 +18,7 @@ import numpy as np
 # and the repo's root directory
 import sys; sys.path.insert(0, '..'); sys.path.insert(0, '.')
 from util import mkdir2
+from util.runtime_dist import fit_ar, fit_load, fit_mixture, dist_from_dict
 
 
 def parse_args():
@@ -20,11 +26,28 @@ def parse_args():
     parser.add_argument('--time-info', type=str, required=True)
     parser.add_argument('--out-path', type=str, required=True)
     parser.add_argument('--method-type', type=str, default='det')
+    parser.add_argument('--model', type=str, default='empirical',
+        choices=['empirical', 'ar', 'load', 'mixture'])
+    parser.add_argument('--n-bin', type=int, default=4, help='load-conditioned model')
+    parser.add_argument('--min-samples', type=int, default=20, help='load-conditioned model')
+    parser.add_argument('--n-comp', type=int, default=2, help='mixture model')
     parser.add_argument('--overwrite', action='store_true', default=False)
 
     opts = parser.parse_args()
     return opts
 
+def load_seq_outputs(run_dir):
+    # runtimes and number of detections of every sequence of a run
+    runtimes, loads = [], []
+    for path in sorted(glob(join(run_dir, '*.pkl'))):
+        out_dict = pickle.load(open(path, 'rb'))
+        if not isinstance(out_dict, dict) or 'results_parsed' not in out_dict \
+            or 'runtime' not in out_dict:
+            continue
+        runtimes.append(np.asarray(out_dict['runtime']))
+        loads.append(np.array([len(r[0]) for r in out_dict['results_parsed']]))
+    return runtimes, loads
+
 def main():
     opts = parse_args()
     if not opts.overwrite and isfile(opts.out_path):
@@ -34,10 +57,24 @@ def main():
     time_info = pickle.load(open(opts.time_info, 'rb'))
     if opts.method_type == 'det':
         rt_samples = time_info['runtime_all']
-        rt_dist = {'type': 'empirical', 'samples': rt_samples}
+        if opts.model == 'empirical':
+            rt_dist = {'type': 'empirical', 'samples': rt_samples}
+        elif opts.model == 'mixture':
+            rt_dist = fit_mixture(rt_samples, opts.n_comp)
+        else:
+            runtimes, loads = load_seq_outputs(dirname(opts.time_info))
+            assert runtimes, 'no sequence outputs next to the time info'
+            if opts.model == 'ar':
+                rt_dist = fit_ar(runtimes)
+            else:
+                rt_dist = fit_load(np.concatenate(runtimes), np.concatenate(loads),
+                    opts.n_bin, opts.min_samples)
     else:
         raise ValueError(f'Unknown method type "{opts.method_type}"')
     pickle.dump(rt_dist, open(opts.out_path, 'wb'))
 
+    dist = dist_from_dict(rt_dist)
+    print(f'{opts.model} runtime model: mean {1e3*dist.mean():.3g} ms, std {1e3*dist.std():.3g} ms')
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,89 @@
+'''
+Box kernel benchmark
+Times the previous extrap_clean_up (fancy-indexed copies) against the
+fused kernel of util/box_kernels.py with preallocated buffers, in the lt
+and centre formats and over the number of boxes, and checks that they give
+the same boxes and masks
+'''
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+
+# the line below is for running in both the current directory
+# and the repo's root directory
+import sys; sys.path.insert(0, '..'); sys.path.insert(0, '.')
+from util.box_kernels import clean_up_
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-boxes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--n-trial', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+
+    opts = parser.parse_args()
+    return opts
+
+def extrap_clean_up_ref(bboxes, w_img, h_img, min_size=75, lt=False):
+    # the previous extrap_clean_up
+    wh_nz = bboxes[:, 2:] > 0
+    keep = np.logical_and(wh_nz[:, 0], wh_nz[:, 1])
+
+    if lt:
+        bboxes[:, 2:] = bboxes[:, :2] + bboxes[:, 2:]
+    else:
+        bboxes[:, :2] = bboxes[:, :2] - bboxes[:, 2:]/2
+        bboxes[:, 2:] = bboxes[:, :2] + bboxes[:, 2:]
+
+    bboxes[:, [0, 2]] = bboxes[:, [0, 2]].clip(0, w_img)
+    bboxes[:, [1, 3]] = bboxes[:, [1, 3]].clip(0, h_img)
+
+    bboxes[:, 2:] = bboxes[:, 2:] - bboxes[:, :2]
+
+    keep = np.logical_and(keep, bboxes[:, 2].astype(int)*bboxes[:, 3].astype(int) >= min_size)
+    bboxes = bboxes[keep]
+    return bboxes, keep
+
+def make_boxes(rng, n, w_img=1920, h_img=1200):
+    # forecasted boxes, some leaving the image, some degenerate or tiny
+    return np.stack((
+        rng.uniform(-200, w_img + 100, n),
+        rng.uniform(-200, h_img + 100, n),
+        rng.choice([-5, 0.5, 3, 50, 120, 300], n)*rng.uniform(0.5, 1.5, n),
+        rng.choice([-5, 0.5, 3, 50, 120, 300], n)*rng.uniform(0.5, 1.5, n),
+    ), axis=1).astype(np.float32)
+
+def main():
+    opts = parse_args()
+    rng = np.random.RandomState(opts.seed)
+    w_img, h_img = 1920, 1200
+
+    print(f'{"boxes":>6s}{"format":>8s}{"previous (us)":>15s}{"kernel (us)":>13s}'
+        f'{"speedup":>10s}{"identical":>11s}')
+    for n in opts.n_boxes:
+        for lt in (True, False):
+            bboxes = make_boxes(rng, n)
+            work = np.empty_like(bboxes)
+            keep_buf = np.empty(n, dtype=bool)
+            wh_buf = np.empty((n, 2), dtype=np.float32)
+
+            t1 = perf_counter()
+            for _ in range(opts.n_trial):
+                work[:] = bboxes
+                bboxes_ref, keep_ref = extrap_clean_up_ref(work, w_img, h_img, lt=lt)
+            t2 = perf_counter()
+            for _ in range(opts.n_trial):
+                work[:] = bboxes
+                keep = clean_up_(work, w_img, h_img, lt=lt, keep=keep_buf, buf=wh_buf)
+                bboxes_k = work[keep]
+            t3 = perf_counter()
+
+            identical = np.array_equal(keep, keep_ref) and np.array_equal(bboxes_k, bboxes_ref)
+            t_ref, t_k = (1e6/opts.n_trial*t for t in (t2 - t1, t3 - t2))
+            print(f'{n:6d}{"ltwh" if lt else "cxywh":>8s}{t_ref:15.2f}{t_k:13.2f}'
+                f'{t_ref/t_k:9.1f}x{str(identical):>11s}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+'''
+Box kernels for the per-frame hot paths
+In-place operations on (n, 4) float arrays, without the ndim branches of
+util/bbox.py and without fancy-indexed copies: every step is a ufunc
+writing to the boxes or to optional preallocated buffers
+'''
+
+import numpy as np
+
+def ltwh2ltrb_(bboxes):
+    np.add(bboxes[:, 2:], bboxes[:, :2], out=bboxes[:, 2:])
+    return bboxes
+
+def ltrb2ltwh_(bboxes):
+    np.subtract(bboxes[:, 2:], bboxes[:, :2], out=bboxes[:, 2:])
+    return bboxes
+
+def cxywh2ltwh_(bboxes, buf=None):
+    # buf: (>= n, 2) buffer of the same dtype
+    half_wh = np.multiply(bboxes[:, 2:], 0.5, out=None if buf is None else buf[:len(bboxes)])
+    np.subtract(bboxes[:, :2], half_wh, out=bboxes[:, :2])
+    return bboxes
+
+def ltwh2cxywh_(bboxes, buf=None):
+    half_wh = np.multiply(bboxes[:, 2:], 0.5, out=None if buf is None else buf[:len(bboxes)])
+    np.add(bboxes[:, :2], half_wh, out=bboxes[:, :2])
+    return bboxes
+
+def clip_ltrb_(bboxes, w_img, h_img):
+    # np.clip goes through a python wrapper, slow on a few boxes
+    np.maximum(bboxes, 0, out=bboxes)
+    np.minimum(bboxes, (w_img, h_img, w_img, h_img), out=bboxes)
+    return bboxes
+
+def clean_up_(bboxes, w_img, h_img, min_size=75, lt=False, keep=None, buf=None):
+    '''
+    Converts [cx or l, cy or t, w, h] to ltwh clipped to the image, and
+    returns the mask of the boxes with a positive size whose area, with the
+    integer part of w and h, is at least min_size
+    keep: (>= n,) bool buffer for the mask
+    buf: (>= n, 2) buffer of the same dtype as the boxes
+    '''
+    n = len(bboxes)
+    keep = np.empty(n, dtype=bool) if keep is None else keep[:n]
+    buf = np.empty((n, 2), dtype=bboxes.dtype) if buf is None else buf[:n]
+    xy, wh = bboxes[:, :2], bboxes[:, 2:]
+    if min_size <= 0:
+        pos = (wh > 0).all(axis=1)
+
+    if not lt:
+        np.multiply(wh, 0.5, out=buf)
+        np.subtract(xy, buf, out=xy)
+    np.add(wh, xy, out=wh)
+    clip_ltrb_(bboxes, w_img, h_img)
+    np.subtract(wh, xy, out=wh)
+
+    # the integer part is neccessary, otherwise, there are very small w, h that round up to 0
+    # a box without a positive size ends up with w <= 0 or h <= 0 after the clipping,
+    # hence a zero area once the negative sizes are zeroed
+    np.trunc(wh, out=buf)
+    np.maximum(buf, 0, out=buf)
+    area = buf[:, 0]
+    np.multiply(area, buf[:, 1], out=area)
+    np.greater_equal(area, min_size, out=keep)
+    if min_size <= 0:
+        keep &= pos
+    return keep
@@ -0,0 +1,92 @@
+'''
+Clocks for the real-time loops
+Clock waits for the next frame with a coarse sleep followed by a short spin,
+instead of polling perf_counter, so that an idle loop does not hold a core.
+VirtualClock is a drop-in replacement whose time only moves when waited on or
+advanced, for deterministic runs with simulated runtimes
+'''
+
+import time
+
+
+class Clock():
+    def __init__(self, spin=0.002):
+        '''
+        spin: the last "spin" seconds of a wait are spent polling, covering
+        the wake-up latency of the OS sleep
+        '''
+        self.spin = spin
+        self.t_sleep = 0
+        self.t_spin = 0
+        self.n_wait = 0
+        self.late = 0
+        self.cpu_start = time.process_time()
+        self.wall_start = self.now()
+
+    def now(self):
+        return time.perf_counter()
+
+    def sleep_until(self, t):
+        t1 = self.now()
+        if t <= t1:
+            return t1
+        self.n_wait += 1
+        t2 = t1
+        if t - t1 > self.spin:
+            time.sleep(t - t1 - self.spin)
+            t2 = self.now()
+            self.t_sleep += t2 - t1
+        t3 = t2
+        while t3 < t:
+            t3 = self.now()
+        self.t_spin += t3 - t2
+        self.late += t3 - t
+        return t3
+
+    def advance(self, dt=None):
+        # real work already takes real time
+        pass
+
+    def summary(self):
+        wall = self.now() - self.wall_start
+        return {
+            'wall_time': wall,
+            'cpu_time': time.process_time() - self.cpu_start,
+            # CPU time given back to other threads and processes
+            't_sleep': self.t_sleep,
+            't_spin': self.t_spin,
+            'n_wait': self.n_wait,
+            'mean_late': self.late/max(self.n_wait, 1),
+        }
+
+class VirtualClock():
+    def __init__(self, runtime_dist=None, t=0, eps=1e-9):
+        '''
+        runtime_dist: drawn from by advance() when no duration is given,
+        to simulate the runtime of a processing step
+        eps: every wait moves the time by at least eps, so that a polling loop
+        whose frame index is off by a rounding error still makes progress
+        '''
+        self.runtime_dist = runtime_dist
+        self.t = t
+        self.eps = eps
+        self.n_wait = 0
+
+    def now(self):
+        return self.t
+
+    def sleep_until(self, t):
+        self.n_wait += 1
+        self.t = max(t, self.t + self.eps)
+        return self.t
+
+    def advance(self, dt=None):
+        if dt is None:
+            dt = self.runtime_dist.draw()
+        self.t += dt
+
+    def summary(self):
+        return {
+            'wall_time': float(self.t),
+            'n_wait': self.n_wait,
+        }
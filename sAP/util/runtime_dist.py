@@ -1,5 +1,8 @@
 '''
 Runtime distributions
+draw() returns a runtime, and draw(size) an array of runtimes, e.g. to
+pre-sample a sequence, all from np.random. The fit_* functions give the
+dicts of the models for dist_from_dict (see add_to_runtime_zoo.py)
 '''
 
 
@@ -13,8 +16,8 @@ class Empirical():
             self.samples /= perf_factor
         self.sidx = 0
 
-    def draw(self):
-        return np.random.choice(self.samples)
+    def draw(self, size=None):
+        return np.random.choice(self.samples, size)
 
     def draw_sequential(self):
         sample = self.samples[self.sidx]
@@ -33,10 +36,330 @@ class Empirical():
     def max(self):
         return self.samples.max()
 
+class DecayedHistogram():
+    '''
+    Online runtime histogram with exponential forgetting
+    Every update scales the existing counts by "decay", so that the
+    distribution tracks drifting runtimes (e.g. thermal throttling or
+    other load on the device). Each bin is represented by the mean of its
+    samples rather than its center. Runtimes above the last bin go to it
+    '''
+
+    def __init__(self, bin_width, n_bin, decay=0.98, samples=None, prior_weight=20):
+        self.bin_width = bin_width
+        self.centers = (np.arange(n_bin) + 0.5)*bin_width
+        self.counts = np.zeros(n_bin)
+        self.sums = np.zeros(n_bin)
+        self.decay = decay
+        if samples is not None and len(samples):
+            # prior from an offline profile, worth "prior_weight" online samples
+            samples = np.asarray(samples, dtype=np.float64)
+            w = prior_weight/len(samples)
+            idx = self.bin_idx(samples)
+            np.add.at(self.counts, idx, w)
+            np.add.at(self.sums, idx, w*samples)
+
+    def bin_idx(self, x):
+        return np.minimum(np.asarray(x)//self.bin_width, len(self.counts) - 1).astype(int)
+
+    def update(self, x):
+        self.counts *= self.decay
+        self.sums *= self.decay
+        idx = self.bin_idx(x)
+        self.counts[idx] += 1
+        self.sums[idx] += x
+
+    def n_eff(self):
+        return self.counts.sum()
+
+    def values(self):
+        nonzero = self.counts > 0
+        values = self.centers.copy()
+        values[nonzero] = self.sums[nonzero]/self.counts[nonzero]
+        return values
+
+    def pmf(self):
+        return self.counts/self.counts.sum()
+
+    def draw(self):
+        return np.random.choice(self.values(), p=self.pmf())
+
+    def mean(self):
+        return self.sums.sum()/self.counts.sum()
+
+    def std(self):
+        return np.sqrt((self.pmf()*(self.values() - self.mean())**2).sum())
+
+    def min(self):
+        return self.values()[self.counts > 0][0]
+
+    def max(self):
+        return self.values()[self.counts > 0][-1]
+
+class LogNormal():
+    ''' Runtime whose log is normal, mostly as a mixture component '''
+
+    def __init__(self, mu, sigma, perf_factor=1):
+        assert perf_factor > 0, perf_factor
+        self.mu = mu - np.log(perf_factor)
+        self.sigma = sigma
+
+    def draw(self, size=None):
+        return np.exp(np.random.normal(self.mu, self.sigma, size))
+
+    def mean(self):
+        return np.exp(self.mu + self.sigma**2/2)
+
+    def std(self):
+        return self.mean()*np.sqrt(np.expm1(self.sigma**2))
+
+    def min(self):
+        return 0.0
+
+    def max(self):
+        return np.inf
+
+class AutoRegressive():
+    '''
+    AR(1) model of the log runtime, for detectors whose consecutive runtimes
+    are correlated (scene complexity, clock throttling, other load):
+        log r_t = mu + phi*(log r_{t-1} - mu) + e_t
+    with e_t bootstrapped from the residuals of the fit. The chain starts
+    from one of the samples the model was fitted on, which also give the
+    marginal statistics. The chain carries over across the draws, and
+    draw(n) continues it for n steps
+    '''
+
+    def __init__(self, mu, phi, residuals, samples, perf_factor=1, block=64):
+        assert perf_factor > 0, perf_factor
+        assert abs(phi) < 1, phi
+        self.mu = mu - np.log(perf_factor)
+        self.phi = phi
+        self.residuals = np.asarray(residuals, dtype=np.float64)
+        self.samples = np.array(samples, dtype=np.float64)/perf_factor
+        # lower triangular phi^(i - j), to run the recurrence a block at a time
+        i = np.arange(block)
+        self.decay = np.tril(phi**np.maximum(i[:, None] - i[None, :], 0))
+        self.reset()
+
+    def reset(self):
+        self.z = None       # log runtime of the last draw minus mu
+
+    def draw(self, size=None):
+        if self.z is None:
+            self.z = np.log(np.random.choice(self.samples)) - self.mu
+        if size is None:
+            self.z = self.phi*self.z + np.random.choice(self.residuals)
+            return np.exp(self.mu + self.z)
+
+        e = np.random.choice(self.residuals, size)
+        z = np.empty(size)
+        block = len(self.decay)
+        for start in range(0, size, block):
+            n = min(block, size - start)
+            z[start:start + n] = self.decay[:n, :n] @ e[start:start + n] \
+                + self.phi*self.decay[:n, 0]*self.z
+            self.z = z[start + n - 1]
+        return np.exp(self.mu + z)
+
+    def mean(self):
+        return self.samples.mean()
+
+    def std(self):
+        return self.samples.std(ddof=1)
+
+    def min(self):
+        return self.samples.min()
+
+    def max(self):
+        return self.samples.max()
+
+class LoadConditioned():
+    '''
+    Runtime given the load of the step, i.e., the number of detections,
+    whose post-processing (NMS, mask pasting) dominates on crowded frames.
+    The loads are split into bins at "edges" (bin i holds the loads in
+    [edges[i - 1], edges[i])), each with its own runtime samples. Without
+    a load, draw() samples the marginal
+    '''
+
+    load_conditioned = True
+
+    def __init__(self, edges, samples, perf_factor=1):
+        assert perf_factor > 0, perf_factor
+        self.edges = np.asarray(edges)
+        assert len(samples) == len(self.edges) + 1
+        self.counts = np.array([len(s) for s in samples])
+        assert self.counts.all(), 'empty load bin'
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1]))
+        # the samples of all the bins, in order
+        self.samples = np.concatenate([np.asarray(s, dtype=np.float64) for s in samples])
+        if perf_factor != 1:
+            self.samples /= perf_factor
+
+    def bin_idx(self, load):
+        return np.searchsorted(self.edges, load, side='right')
+
+    def draw(self, size=None, load=None):
+        ''' load: a load, or one load per draw '''
+        if load is None:
+            return np.random.choice(self.samples, size)
+        b = self.bin_idx(load)
+        if size is not None:
+            b = np.broadcast_to(b, size)
+        i = self.starts[b] + (np.random.random_sample(np.shape(b))*self.counts[b]).astype(int)
+        return self.samples[i]
+
+    def mean(self):
+        return self.samples.mean()
+
+    def std(self):
+        return self.samples.std(ddof=1)
+
+    def min(self):
+        return self.samples.min()
+
+    def max(self):
+        return self.samples.max()
+
+class Mixture():
+    '''
+    Mixture of runtime distributions, e.g. a nominal mode and rare slow
+    frames (garbage collection, page faults, contention)
+    '''
+
+    def __init__(self, weights, components, perf_factor=1):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.weights /= self.weights.sum()
+        self.components = [dist_from_dict(c, perf_factor) for c in components]
+
+    def draw(self, size=None):
+        n_comp = len(self.components)
+        if size is None:
+            return self.components[np.random.choice(n_comp, p=self.weights)].draw()
+        cidx = np.random.choice(n_comp, size, p=self.weights)
+        out = np.empty(size)
+        for j, c in enumerate(self.components):
+            mask = cidx == j
+            n = mask.sum()
+            if n:
+                out[mask] = c.draw(n)
+        return out
+
+    def mean(self):
+        return sum(w*c.mean() for w, c in zip(self.weights, self.components))
+
+    def std(self):
+        m2 = sum(w*(c.std()**2 + c.mean()**2) for w, c in zip(self.weights, self.components))
+        return np.sqrt(m2 - self.mean()**2)
+
+    def min(self):
+        return min(c.min() for c in self.components)
+
+    def max(self):
+        return max(c.max() for c in self.components)
+
+def fit_ar(runtimes):
+    '''
+    AR model (dict) of a list of runtime sequences (or of a single one),
+    fitted by least squares on the log runtimes, without the pairs across
+    the sequences
+    '''
+    if np.ndim(runtimes[0]) == 0:
+        runtimes = [runtimes]
+    logs = [np.log(np.asarray(r, dtype=np.float64)) for r in runtimes]
+    y = np.concatenate(logs)
+    mu = y.mean()
+    prev = np.concatenate([l[:-1] for l in logs]) - mu
+    cur = np.concatenate([l[1:] for l in logs]) - mu
+    den = (prev*prev).sum()
+    phi = (prev*cur).sum()/den if den > 0 else 0.0
+    # kept stationary
+    phi = float(np.clip(phi, -0.99, 0.99))
+    residuals = cur - phi*prev if len(cur) else y - mu
+    residuals -= residuals.mean()
+    return {
+        'type': 'ar',
+        'mu': mu,
+        'phi': phi,
+        'residuals': residuals,
+        'samples': np.exp(y),
+    }
+
+def fit_load(runtimes, loads, n_bin=4, min_samples=20):
+    '''
+    Load-conditioned model (dict), with bins at the quantiles of the loads,
+    merged until each bin has at least min_samples runtimes
+    '''
+    runtimes = np.asarray(runtimes, dtype=np.float64)
+    loads = np.asarray(loads)
+    edges = list(np.unique(np.quantile(loads, np.arange(1, n_bin)/n_bin)))
+    while edges:
+        counts = np.bincount(np.searchsorted(edges, loads, side='right'), minlength=len(edges) + 1)
+        small = np.flatnonzero(counts < min_samples)
+        if not len(small):
+            break
+        # merged with the previous bin (or the next one for the first bin)
+        del edges[max(small[0] - 1, 0)]
+    bidx = np.searchsorted(edges, loads, side='right')
+    return {
+        'type': 'load',
+        'edges': np.array(edges),
+        'samples': [runtimes[bidx == i] for i in range(len(edges) + 1)],
+    }
+
+def fit_mixture(samples, n_comp=2, n_iter=200, tol=1e-8, sigma_min=1e-3):
+    '''
+    Mixture of n_comp log-normals (dict), fitted by EM on the log runtimes,
+    for multi-modal runtimes that a single mode misses
+    sigma_min: keeps a component from collapsing on repeated runtimes
+    '''
+    y = np.log(np.asarray(samples, dtype=np.float64))[:, None]
+    # initialized at the quantiles
+    mu = np.quantile(y, (np.arange(n_comp) + 0.5)/n_comp)
+    sigma = np.full(n_comp, max(y.std()/n_comp, sigma_min))
+    w = np.full(n_comp, 1/n_comp)
+    ll_prev = -np.inf
+    for _ in range(n_iter):
+        # E-step, in the log domain
+        logp = np.log(w) - np.log(sigma) - 0.5*((y - mu)/sigma)**2
+        logp_max = logp.max(axis=1, keepdims=True)
+        p = np.exp(logp - logp_max)
+        p_sum = p.sum(axis=1, keepdims=True)
+        ll = (np.log(p_sum) + logp_max).sum()
+        resp = p/p_sum
+
+        # M-step
+        nk = resp.sum(axis=0) + 1e-12
+        w = nk/len(y)
+        mu = (resp*y).sum(axis=0)/nk
+        sigma = np.maximum(np.sqrt((resp*(y - mu)**2).sum(axis=0)/nk), sigma_min)
+        if ll - ll_prev <= tol*abs(ll):
+            break
+        ll_prev = ll
+
+    return {
+        'type': 'mixture',
+        'weights': w,
+        'components': [
+            {'type': 'lognormal', 'mu': m, 'sigma': s} for m, s in zip(mu, sigma)
+        ],
+    }
+
 def dist_from_dict(dist_dict, perf_factor=1):
-    if dist_dict['type'] == 'empirical':
+    dist_type = dist_dict['type']
+    if dist_type == 'empirical':
         return Empirical(dist_dict['samples'], perf_factor)
+    elif dist_type == 'lognormal':
+        return LogNormal(dist_dict['mu'], dist_dict['sigma'], perf_factor)
+    elif dist_type == 'ar':
+        return AutoRegressive(
+            dist_dict['mu'], dist_dict['phi'], dist_dict['residuals'],
+            dist_dict['samples'], perf_factor,
+        )
+    elif dist_type == 'load':
+        return LoadConditioned(dist_dict['edges'], dist_dict['samples'], perf_factor)
+    elif dist_type == 'mixture':
+        return Mixture(dist_dict['weights'], dist_dict['components'], perf_factor)
     else:
-        raise ValueError(f'Unknown distribution type "{dist_dict["type"]}"')
-
-    
\ No newline at end of file
+        raise ValueError(f'Unknown distribution type "{dist_type}"')
@@ -1,71 +1,96 @@
-
-''' 
+'''
 Scheduling Simulator
 It tests out the empirical temporal mismatch
 of different scheduling policies
 
 For more information, check out Section B.1 in the appendix
+The simulator itself is in util/stream_sim.py
 '''
 
-import math
+import argparse
 from fractions import Fraction
 
-# r = 1.51108
-r = 1 + Fraction(1, 2)  # runtime in rational number form, exact computation!
-T = 13                  # number of frames
-eta = 0                 # observation pointer - query pointer
+import numpy as np
+
+# the line below is for running in both the current directory
+# and the repo's root directory
+import sys; sys.path.insert(0, '..'); sys.path.insert(0, '.')
+from util.runtime_dist import Empirical
+from util.scheduler import DeadlineScheduler
+from util.stream_sim import policies, simulate, simulate_batch, load_trace, sample_runtimes
 
-##
-def sim(policy, r, T, eta):
-    assert eta >= -1        # not implemented for eta < -1
-    cmismatch = 0           # cumulative mismatch
-    result_idx = None       # latest result input index
-    process_idx = 0         # data index under processing
-    t_finish = r            # always start with no idle time
-    for t in range(T - eta):
-        if t_finish < t:
-            result_idx = process_idx
-            if policy(t_finish, r):
-                # wait
-                t_finish = t + r
-                process_idx = t
-            else:
-                process_idx = t if t_finish == t or result_idx == t - 1 else t - 1
-                # result == t - 1 means r <= 1, the algorithm is already waiting
-                t_finish += r
-        # report latest result (excluding empty output cases)
-        if t + eta >= 0 and result_idx is not None:
-            cmismatch += t + eta - result_idx
-    return cmismatch
 
-##
-tail = lambda x: x - math.floor(x)
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--r', type=str, default='3/2',
+        help='runtime in frames, as a rational number for an exact computation')
+    parser.add_argument('--n-frame', type=int, default=13)
+    parser.add_argument('--eta', type=int, default=0, help='observation pointer - query pointer')
+    parser.add_argument('--n-worker', type=int, default=1)
+    parser.add_argument('--forecast-runtime', type=str, default=None,
+        help='runtime of the forecasting stage in frames, no forecasting by default')
+    parser.add_argument('--n-sim-frame', type=int, default=2000)
+    parser.add_argument('--n-seed', type=int, default=5)
+    parser.add_argument('--time-info', type=str, nargs='*', default=[],
+        help='time_info.pkl of real runs, whose runtimes are replayed')
+    parser.add_argument('--fps', type=float, default=30)
 
-def p_idle_free(t_finish, r):
-    return False
+    opts = parser.parse_args()
+    return opts
 
-def p_idle_next(t_finish, r):
-    return True
+def print_policies(opts, runtimes, r_mean, fc_rt):
+    # runtimes in frames, every policy over the runs at once,
+    # and the scheduler (without a prior) run by run
+    n_run, n_sim_frame = runtimes.shape
+    cmismatch, n_empty = simulate_batch(
+        n_sim_frame, runtimes, list(policies.values()), r_mean,
+        opts.n_worker, opts.eta, fc_rt if fc_rt is None else float(fc_rt),
+    )
+    for name, c in zip(policies, cmismatch):
+        print(f'{name}: {c.sum()/(n_run*n_sim_frame):.6g}')
+    cmismatch = 0
+    for row in runtimes:
+        out = simulate(
+            n_sim_frame, row, scheduler=DeadlineScheduler(1), n_worker=opts.n_worker,
+            eta=opts.eta, forecast_runtime=fc_rt,
+        )
+        cmismatch += out['cmismatch']
+    print(f'deadline_scheduler: {cmismatch/(n_run*n_sim_frame):.6g}')
 
-def p_shrinking_tail(t_finish, r):
-    cur_tail = tail(t_finish)
-    next_tail = tail(t_finish + r)
-    return cur_tail > next_tail
+def main():
+    opts = parse_args()
+    r = Fraction(opts.r)
+    T = opts.n_frame
+    fc_rt = None if opts.forecast_runtime is None else Fraction(opts.forecast_runtime)
 
-def p_half_tail(t_finish, r):
-    cur_tail = tail(t_finish)
-    return cur_tail >= 0.5
+    for name, p in policies.items():
+        cmismatch = simulate(T, r, p, n_worker=opts.n_worker, eta=opts.eta,
+            forecast_runtime=fc_rt)['cmismatch']
+        print(f'{name}: {cmismatch}, {cmismatch/T:.6g}')
 
-def p_half_next_tail(t_finish, r):
-    next_tail = tail(t_finish + r)
-    return next_tail < 0.5
+    ## stochastic runtimes (in frames), the scheduler starts without a prior
+    rng = np.random.RandomState(0)
+    dists = {
+        'const 1.5': Empirical([1.5]),
+        'const 1.51108': Empirical([1.51108]),
+        'lognormal 1.5': Empirical(1.5*rng.lognormal(0, 0.2, 1000)),
+        'lognormal 2.3': Empirical(2.3*rng.lognormal(0, 0.3, 1000)),
+        'bimodal 1.2/2.6': Empirical(np.r_[rng.normal(1.2, 0.05, 700), rng.normal(2.6, 0.1, 300)]),
+    }
+    for dist_name, dist in dists.items():
+        print(f'\nruntime {dist_name}: mean {dist.mean():.3g} frames')
+        runtimes = []
+        for seed in range(opts.n_seed):
+            np.random.seed(seed)
+            runtimes.append(dist.draw(opts.n_sim_frame))
+        print_policies(opts, np.array(runtimes), dist.mean(), fc_rt)
 
-##
-all_vars = list(globals().keys())
-for name in all_vars:
-    if not name.startswith('p_'):
-        continue
-    p = globals()[name]
-    cmismatch = sim(p, r, T, eta)
-    print(f'{name[2:]}: {cmismatch}, {cmismatch/T:.6g}')
+    ## replay of real runtimes (in seconds)
+    for path in opts.time_info:
+        trace = load_trace(path)
+        runtimes = sample_runtimes(trace, 1, opts.n_sim_frame, opts.fps)
+        print(f'\nruntime trace {path}: mean {trace.mean()*opts.fps:.3g} frames')
+        print_policies(opts, runtimes, None, fc_rt)
 
+if __name__ == '__main__':
+    main()
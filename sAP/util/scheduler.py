@@ -0,0 +1,105 @@
+'''
+Deadline-aware dynamic scheduling
+Decides, whenever the detector is idle, whether to process the latest frame
+now or to wait for the next one, based on an online estimate of the runtime
+distribution. The decision minimizes the expected temporal mismatch (query
+index - input index of the output used for that query) summed over the
+queries of a common horizon. Both options are rolled out with runtimes drawn
+from the current estimate, assuming the following jobs start on the first
+new frame after the previous job finishes
+
+All times are in seconds in the interface and in frames internally
+'''
+
+import numpy as np
+
+from util.runtime_dist import DecayedHistogram
+
+
+def tri(x):
+    # sum of the query indices in [1, floor(x)]
+    fx = np.floor(x)
+    return fx*(fx + 1)/2
+
+def served_mismatch(a, b, input_idx):
+    # sum of (query - input_idx) over the queries in (a, b]
+    return tri(b) - tri(a) - input_idx*(np.floor(b) - np.floor(a))
+
+class DeadlineScheduler():
+    def __init__(self, fps, eta=0, runtime_dist=None, decay=0.98,
+        bins_per_frame=20, max_rtf=8, n_rollout=128, n_step=4, seed=0):
+        '''
+        fps: frame rate of the stream
+        eta: observation pointer - query pointer (frames)
+        runtime_dist: optional offline runtime distribution used as the prior
+        decay: forgetting factor of the runtime histogram
+        bins_per_frame, max_rtf: histogram resolution and range in frames
+        n_rollout, n_step: number and length of the simulated futures
+        '''
+        self.fps = fps
+        self.eta = eta
+        self.n_step = n_step
+        samples = None
+        if runtime_dist is not None:
+            samples = runtime_dist.samples*fps if hasattr(runtime_dist, 'samples') \
+                else runtime_dist.draw(1000)*fps
+        self.hist = DecayedHistogram(
+            1/bins_per_frame, int(max_rtf*bins_per_frame), decay, samples,
+        )
+        # common random numbers, so that both options see the same futures
+        # and the decision is deterministic given the histogram
+        self.u = np.random.RandomState(seed).rand(n_rollout, n_step)
+        self.n_wait = 0
+        self.n_decision = 0
+
+    def update(self, runtime):
+        ''' Add a measured runtime (s) '''
+        self.hist.update(runtime*self.fps)
+
+    def expected_mismatch(self, t, last_input, start, horizon, r):
+        '''
+        Expected mismatch summed over the queries in (t, horizon] (frames) if
+        the latest frame at "start" begins processing then, given the runtime
+        samples r (n_rollout x n_step) and the latest output from frame last_input.
+        The following jobs start on the first frame after the previous one is done
+        '''
+        n = len(r)
+        inputs = np.empty_like(r)
+        t_done = np.empty_like(r)
+        inputs[:, 0] = np.floor(start)
+        t_done[:, 0] = start + r[:, 0]
+        for i in range(1, r.shape[1]):
+            inputs[:, i] = np.ceil(t_done[:, i - 1])
+            t_done[:, i] = inputs[:, i] + r[:, i]
+        t_done = np.minimum(t_done, horizon)
+        bounds = np.concatenate((np.full((n, 1), t), t_done, np.full((n, 1), horizon)), axis=1)
+        inputs = np.concatenate((np.full((n, 1), last_input), inputs), axis=1)
+        cost = served_mismatch(bounds[:, :-1], bounds[:, 1:], inputs).sum(axis=1)
+        return cost.mean() + self.eta*(np.floor(horizon) - np.floor(t))
+
+    def should_wait(self, t_elapsed, last_input):
+        '''
+        t_elapsed: time since the start of the stream (s)
+        last_input: input frame index of the latest output, None if there is none
+        returns True to wait for the next frame, False to process the latest one
+        '''
+        if last_input is None or self.hist.n_eff() == 0:
+            # nothing to show or nothing known yet, process right away
+            return False
+        t = t_elapsed*self.fps
+        t_next = np.floor(t) + 1
+        cdf = np.cumsum(self.hist.pmf())
+        r = self.hist.values()[np.minimum(np.searchsorted(cdf, self.u), len(cdf) - 1)]
+        horizon = t_next + self.n_step*self.hist.mean()
+        wait = self.expected_mismatch(t, last_input, t_next, horizon, r) \
+            < self.expected_mismatch(t, last_input, t, horizon, r)
+        self.n_decision += 1
+        self.n_wait += int(wait)
+        return bool(wait)
+
+    def summary(self):
+        return {
+            'n_decision': self.n_decision,
+            'n_wait': self.n_wait,
+            'mean_runtime': float(self.hist.mean()/self.fps),
+        }
@@ -0,0 +1,97 @@
+'''
+Shared-memory arrays for exchanging frames and results between processes
+The arrays have a fixed layout decided by the parent and are handed to the
+child process when it is created, so that nothing is pickled afterwards
+'''
+
+import multiprocessing as mp
+
+import numpy as np
+
+
+class SharedArrays():
+    def __init__(self, **specs):
+        '''
+        specs: name -> (shape, dtype), each becomes a numpy array attribute
+        '''
+        self.specs = specs
+        self.raw = {
+            name: mp.RawArray('b', int(np.prod(shape))*np.dtype(dtype).itemsize)
+            for name, (shape, dtype) in specs.items()
+        }
+        self._make_views()
+
+    def _make_views(self):
+        for name, (shape, dtype) in self.specs.items():
+            setattr(self, name, np.frombuffer(self.raw[name], dtype).reshape(shape))
+
+    def __getstate__(self):
+        # only valid when spawning a process, the memory itself is not copied
+        return {'specs': self.specs, 'raw': self.raw}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._make_views()
+
+class FrameRing(SharedArrays):
+    ''' Ring of frame slots, plus the request for the frame to process '''
+
+    def __init__(self, n_slot, h, w, c=3):
+        super().__init__(
+            frames=((n_slot, h, w, c), np.uint8),
+            # frame index (-1 to exit), slot, send time, first frame of a sequence
+            request=((4,), np.float64),
+        )
+        self.n_slot = n_slot
+        self.n_written = 0
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.n_slot = len(self.frames)
+
+    def write(self, img):
+        slot = self.n_written % self.n_slot
+        self.frames[slot] = img
+        self.n_written += 1
+        return slot
+
+    def send(self, fidx, slot, t, first=False):
+        self.request[:] = (fidx, slot, t, first)
+
+    def recv(self):
+        fidx, slot, t, first = self.request
+        return int(fidx), self.frames[int(slot)], t, bool(first)
+
+class DetResultBuffer(SharedArrays):
+    ''' Detection output with at most max_det boxes, plus the timing of the detector '''
+
+    def __init__(self, max_det):
+        super().__init__(
+            bboxes=((max_det, 4), np.float32),
+            scores=((max_det,), np.float32),
+            labels=((max_det,), np.int32),
+            # number of detections, frame transfer time, send time
+            meta=((3,), np.float64),
+        )
+        self.max_det = max_det
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.max_det = len(self.scores)
+
+    def write(self, bboxes, scores, labels, t_send_frame, t):
+        n = len(scores)
+        if n > self.max_det:
+            # keep the most confident ones
+            sel = np.argsort(scores)[::-1][:self.max_det]
+            bboxes, scores, labels = bboxes[sel], scores[sel], labels[sel]
+            n = self.max_det
+        self.bboxes[:n] = bboxes
+        self.scores[:n] = scores
+        self.labels[:n] = labels
+        self.meta[:] = (n, t_send_frame, t)
+
+    def read(self):
+        n = int(self.meta[0])
+        return self.bboxes[:n].copy(), self.scores[:n].copy(), self.labels[:n].copy(), \
+            self.meta[1], self.meta[2]
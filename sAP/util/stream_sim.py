@@ -0,0 +1,301 @@
+'''
+Event-driven streaming simulator
+Computes the temporal mismatch of a streaming detector without running it,
+in frame units: frame i arrives at time i, and the query at time t asks for
+frame t + eta. The mismatch of a query is the query frame minus the input
+frame of the output it gets, as in Section B.1 in the appendix
+
+Detector workers pick the latest frame not taken by another worker, or
+wait for the next one if the scheduling policy tells them to. A query gets
+the latest output finished strictly before it (as in the appendix, and
+even if its input is older than that of a previous output, as in
+streaming_eval.py), the one with the latest input among those finished at
+the same time. With a forecasting stage, a forecast is started at
+every query while the stage is idle, from the latest detection output,
+and a query gets the latest forecast finished by then
+
+simulate() runs one simulation on an event queue, with exact arithmetic
+for rational runtimes (fractions.Fraction), while simulate_batch() runs
+many policies over many runtime sequences at once with numpy arrays
+'''
+
+import pickle
+from heapq import heappush, heappop
+from math import floor, ceil
+
+import numpy as np
+
+
+## vectorized scheduling policies, policy(t_finish, r) -> wait for the next frame
+# t_finish: time the previous frame finished, r: (mean) runtime, in frames
+
+def p_idle_free(t_finish, r):
+    return np.zeros(np.shape(t_finish), dtype=bool)
+
+def p_idle_next(t_finish, r):
+    return np.ones(np.shape(t_finish), dtype=bool)
+
+def p_shrinking_tail(t_finish, r):
+    return t_finish % 1 > (t_finish + r) % 1
+
+def p_half_tail(t_finish, r):
+    return t_finish % 1 >= 0.5
+
+def p_half_next_tail(t_finish, r):
+    return (t_finish + r) % 1 < 0.5
+
+policies = {
+    'idle_free': p_idle_free,
+    'idle_next': p_idle_next,
+    'shrinking_tail': p_shrinking_tail,
+    'half_tail': p_half_tail,
+    'half_next_tail': p_half_next_tail,
+}
+
+class Trace():
+    '''
+    Runtimes replayed in order, and cycled, e.g. those of a real run, or a
+    single constant runtime. The items are kept as is, so that
+    fractions.Fraction runtimes stay exact
+    '''
+
+    def __init__(self, runtimes):
+        self.runtimes = list(runtimes) if np.ndim(runtimes) else [runtimes]
+        self.idx = 0
+
+    def draw(self, size=None):
+        if size is None:
+            sample = self.runtimes[self.idx]
+            self.idx = (self.idx + 1) % len(self.runtimes)
+            return sample
+        idx = (self.idx + np.arange(size)) % len(self.runtimes)
+        self.idx = (self.idx + size) % len(self.runtimes)
+        return np.asarray(self.runtimes, dtype=np.float64)[idx]
+
+    def mean(self):
+        return sum(self.runtimes)/len(self.runtimes)
+
+def load_trace(time_info_path):
+    ''' Runtimes (in seconds) of a real run, from its time_info.pkl '''
+    return Trace(pickle.load(open(time_info_path, 'rb'))['runtime_all'])
+
+def as_source(runtime):
+    # a runtime distribution, or a constant or a sequence of runtimes replayed in order
+    return runtime if hasattr(runtime, 'draw') else Trace(runtime)
+
+def sample_runtimes(runtime, n_run, n_frame, fps=1):
+    '''
+    Runtimes (n_run, n_frame) in frames, one row of draws per run, for
+    simulate_batch(). fps converts runtimes in seconds
+    '''
+    runtime = as_source(runtime)
+    return np.stack([np.asarray(runtime.draw(n_frame), dtype=np.float64) for _ in range(n_run)])*fps
+
+# event kinds, in the order that they are handled at the same time
+FORECAST_DONE, QUERY, WORKER_FREE = range(3)
+
+def simulate(n_frame, runtime, policy=None, scheduler=None, n_worker=1, eta=0,
+    forecast_runtime=None, fps=1):
+    '''
+    runtime, forecast_runtime: a runtime distribution, or a constant or a
+    sequence of runtimes replayed in order, in seconds with fps, or in
+    frames with fps=1 (the default)
+    policy: policy(t_finish, r_mean) -> wait, with times in frames
+    scheduler: replaces the policy, updated with each runtime and asked
+    should_wait() with times in seconds (see util/scheduler.py)
+    The first frame of every worker is processed without a decision
+    '''
+    runtime = as_source(runtime)
+    r_mean = runtime.mean()*fps
+    if forecast_runtime is not None:
+        forecast_runtime = as_source(forecast_runtime)
+    t_last = n_frame - 1 - eta       # time of the last query
+
+    events = [(0, WORKER_FREE, w) for w in range(n_worker)]
+    events.append((0, QUERY, 0))
+    events.sort()
+    jobs = [None]*n_worker          # (input fidx, runtime) of the frame under processing
+    last_claimed = -1               # latest frame taken by a worker
+    det_out = None                  # input fidx of the latest detection output
+    fc_in = None                    # input fidx of the forecast under processing
+    fc_busy = False
+    fc_out = None                   # input fidx of the latest forecast output
+
+    input_fidx, timestamps, runtimes, workers = [], [], [], []
+    cmismatch = 0
+    n_query = 0
+    n_empty = 0
+
+    while events:
+        t, kind, w = heappop(events)
+        if t > t_last:
+            break
+
+        if kind == WORKER_FREE:
+            wait = False
+            if jobs[w] is not None:
+                fidx, r = jobs[w]
+                if det_out is None or t > timestamps[-1] or fidx > det_out:
+                    det_out = fidx
+                input_fidx.append(fidx)
+                timestamps.append(t)
+                runtimes.append(r)
+                workers.append(w)
+                if scheduler is not None:
+                    scheduler.update(r/fps)
+                    wait = scheduler.should_wait(t/fps, fidx)
+                elif policy is not None:
+                    wait = policy(t, r_mean)
+
+            latest = floor(t)
+            if wait or latest <= last_claimed:
+                fidx = max(latest, last_claimed) + 1
+                t_start = fidx
+            else:
+                fidx = latest
+                t_start = t
+            if fidx >= n_frame:
+                jobs[w] = None
+                continue
+            last_claimed = fidx
+            r = runtime.draw()*fps
+            jobs[w] = (fidx, r)
+            heappush(events, (t_start + r, WORKER_FREE, w))
+
+        elif kind == QUERY:
+            if forecast_runtime is None:
+                out = det_out
+            else:
+                if not fc_busy:
+                    fc_in = det_out
+                    r = forecast_runtime.draw()*fps
+                    if r:
+                        fc_busy = True
+                        heappush(events, (t + r, FORECAST_DONE, 0))
+                    else:
+                        fc_out = fc_in
+                out = fc_out
+
+            if t + eta >= 0:
+                n_query += 1
+                if out is None:
+                    n_empty += 1
+                else:
+                    cmismatch += t + eta - out
+            if t + 1 <= t_last:
+                heappush(events, (t + 1, QUERY, 0))
+
+        else:
+            fc_out = fc_in
+            fc_busy = False
+
+    return {
+        'cmismatch': cmismatch,
+        'n_query': n_query,
+        'n_empty': n_empty,
+        'input_fidx': input_fidx,
+        'timestamps': timestamps,
+        'runtime': runtimes,
+        'worker': workers,
+    }
+
+def forecast_starts(t_last, forecast_runtime):
+    # the forecasts start at the first query after the previous one is done
+    starts = [0]
+    while 1:
+        t = max(ceil(starts[-1] + forecast_runtime), starts[-1] + 1)
+        if t > t_last:
+            break
+        starts.append(t)
+    return np.array(starts)
+
+def simulate_batch(n_frame, runtimes, policies, r_mean=None, n_worker=1, eta=0,
+    forecast_runtime=None):
+    '''
+    Every policy over every run, in lockstep, same as simulate() in floating point
+    runtimes: (n_run, >= n_frame) runtimes in frames, the i-th frame processed
+    in a run takes the i-th runtime of the row
+    policies: list of vectorized policies (or None to never wait)
+    r_mean: mean runtime (in frames) given to the policies, a scalar or one
+    per run, the mean of each row by default
+    forecast_runtime: constant runtime of the forecasting stage, in frames
+    Returns the cumulative mismatch and the number of queries without an
+    output, both (n_policy, n_run)
+    '''
+    runtimes = np.asarray(runtimes, dtype=np.float64)
+    n_run = len(runtimes)
+    n_policy = len(policies)
+    n_sim = n_policy*n_run
+    if r_mean is None:
+        r_mean = runtimes.mean(axis=1)
+    r_mean = np.tile(np.broadcast_to(r_mean, (n_run,)), n_policy)
+    runtimes = np.tile(runtimes, (n_policy, 1))
+    t_last = n_frame - 1 - eta
+    rows = np.arange(n_sim)
+
+    free = np.zeros((n_sim, n_worker))          # time each worker is free
+    has_prev = np.zeros((n_sim, n_worker), dtype=bool)
+    last_claimed = np.full(n_sim, -1)
+    n_job = np.zeros(n_sim, dtype=int)
+    job_fidx = np.full((n_sim, n_frame), -1)
+    job_finish = np.full((n_sim, n_frame), np.inf)
+
+    while 1:
+        # the next worker free in every simulation
+        w = free.argmin(axis=1)
+        t = free[rows, w]
+        act = t <= t_last
+        if not act.any():
+            break
+        t = np.where(act, t, 0)
+
+        wait = np.zeros(n_sim, dtype=bool)
+        for p, policy in enumerate(policies):
+            if policy is not None:
+                sl = slice(p*n_run, (p + 1)*n_run)
+                wait[sl] = policy(t[sl], r_mean[sl])
+        wait &= has_prev[rows, w]
+
+        latest = np.floor(t).astype(int)
+        skip = wait | (latest <= last_claimed)
+        fidx = np.where(skip, np.maximum(latest, last_claimed) + 1, latest)
+        t_start = np.where(skip, fidx, t)
+        valid = act & (fidx < n_frame)
+
+        b = rows[valid]
+        finish = t_start[valid] + runtimes[b, n_job[b]]
+        job_fidx[b, n_job[b]] = fidx[valid]
+        job_finish[b, n_job[b]] = finish
+        n_job[b] += 1
+        last_claimed[b] = fidx[valid]
+        free[b, w[b]] = finish
+        has_prev[b, w[b]] = True
+        done = act & ~valid
+        free[done, w[done]] = np.inf
+
+    # the detection output seen by each query, the latest finished strictly
+    # before the query, or before the start of the forecast it gets
+    t_query = np.arange(max(0, -eta), t_last + 1)
+    t_seen = t_query
+    has_out = np.ones(len(t_query), dtype=bool)
+    if forecast_runtime is not None and forecast_runtime > 0:
+        starts = forecast_starts(t_last, forecast_runtime)
+        sidx = np.searchsorted(starts + forecast_runtime, t_query, side='right') - 1
+        has_out = sidx >= 0
+        t_seen = starts[np.maximum(sidx, 0)]
+
+    # one sorted search for all the simulations, with an offset per simulation
+    order = np.lexsort((job_fidx, job_finish), axis=1)
+    finish_sorted = np.minimum(np.take_along_axis(job_finish, order, axis=1), t_last + 1)
+    fidx_sorted = np.take_along_axis(job_fidx, order, axis=1)
+    offset = t_last + 2
+    flat = (finish_sorted + offset*rows[:, None]).ravel()
+    pos = np.searchsorted(flat, (t_seen + offset*rows[:, None]).ravel(), side='left')
+    pos = pos.reshape(n_sim, -1) - n_frame*rows[:, None] - 1
+    has_out = has_out & (pos >= 0)
+    out_fidx = fidx_sorted[rows[:, None], np.maximum(pos, 0)]
+    mismatch = np.where(has_out, (t_query + eta) - out_fidx, 0)
+
+    cmismatch = mismatch.sum(axis=1).reshape(n_policy, n_run)
+    n_empty = (~has_out).sum(axis=1).reshape(n_policy, n_run)
+    return cmismatch, n_empty
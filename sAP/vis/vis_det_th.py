@@ -128,7 +128,7 @@ def vis_obj_fancy(
                     fx=out_scale, fy=out_scale,
                     interpolation=cv2.INTER_NEAREST,
                 )
-            m = m.astype(np.bool)
+            m = m.astype(bool)
             img[m] = (1 - alpha)*img[m] + alpha*color
             b = find_boundaries(m)
             img[b] = color
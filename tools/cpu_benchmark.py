@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Copyright (c) Megvii, Inc. and its affiliates.
+
+import argparse
+import copy
+import time
+from loguru import logger
+
+import numpy as np
+import torch
+from tabulate import tabulate
+
+from yolox.exp import get_exp
+
+from caryle.streamyolo.StreamYOLO.exps.model.prepare import prepare_input, prepare_model
+
+
+def make_parser():
+    parser = argparse.ArgumentParser("StreamYOLO CPU latency benchmark")
+    parser.add_argument(
+        "-f",
+        "--exp_files",
+        nargs="+",
+        required=True,
+        type=str,
+        help="experiment description files, e.g. the s/m/l cfgs",
+    )
+    parser.add_argument("-c", "--ckpt", default=None, type=str, help="ckpt, random weights if None")
+    parser.add_argument("--tsize", default=None, type=int, nargs=2, help="test img size (h w)")
+    parser.add_argument("--threads", default=None, type=int, help="intra-op threads")
+    parser.add_argument("--warmup", default=5, type=int, help="warm up frames")
+    parser.add_argument("--iters", default=20, type=int, help="timed frames")
+    parser.add_argument("--bf16", action="store_true", help="also time the prepared model in bfloat16")
+    return parser
+
+
+@torch.no_grad()
+def time_on_pipe(model, test_size, warmup, iters):
+    """Per-frame latency (s) of the on_pipe model over a stream of frames."""
+    dtype = next(model.parameters()).dtype
+    frame = prepare_input(torch.rand(1, 3, test_size[0], test_size[1]).to(dtype) * 255, model)
+    buffer = None
+    runtime = []
+    for i in range(warmup + iters):
+        t1 = time.perf_counter()
+        _, buffer = model(frame, buffer=buffer, mode='on_pipe')
+        if i >= warmup:
+            runtime.append(time.perf_counter() - t1)
+    return np.asarray(runtime)
+
+
+def main(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    variants = [
+        ("baseline", None),
+        ("fused", dict(fuse=True, channels_last=False)),
+        ("fused + channels last", dict(fuse=True, channels_last=True)),
+    ]
+    if args.bf16:
+        variants.append(("fused + channels last, bf16", dict(fuse=True, channels_last=True)))
+
+    rows = []
+    for exp_file in args.exp_files:
+        exp = get_exp(exp_file, None)
+        test_size = exp.test_size if args.tsize is None else tuple(args.tsize)
+        base_model = exp.get_model()
+        if args.ckpt is not None:
+            base_model.load_state_dict(torch.load(args.ckpt, map_location="cpu")["model"])
+        base_model.eval()
+
+        for name, kwargs in variants:
+            model = copy.deepcopy(base_model)
+            if kwargs is not None:
+                model = prepare_model(model, **kwargs)
+            if "bf16" in name:
+                model.to(torch.bfloat16)
+            runtime = 1e3 * time_on_pipe(model, test_size, args.warmup, args.iters)
+            rows.append(
+                [exp.exp_name, "{}x{}".format(*test_size), name,
+                 runtime.mean(), runtime.std(), np.median(runtime)]
+            )
+            logger.info("{} {}: {:.1f}ms".format(exp.exp_name, name, runtime.mean()))
+
+    logger.info("\n" + tabulate(
+        rows,
+        headers=["exp", "size", "model", "mean (ms)", "std (ms)", "median (ms)"],
+        tablefmt="pipe",
+        floatfmt=".1f",
+    ))
+
+
+if __name__ == "__main__":
+    args = make_parser().parse_args()
+    main(args)
@@ -17,12 +17,14 @@ from yolox.exp import get_exp
 from yolox.utils import (
     configure_module,
     configure_nccl,
-    fuse_model,
     get_local_rank,
     get_model_info,
     setup_logger
 )
 
+from caryle.streamyolo.StreamYOLO.exps.model.prepare import prepare_model
+from caryle.streamyolo.StreamYOLO.exps.utils.device import get_device
+
 
 def make_parser():
     parser = argparse.ArgumentParser("YOLOX Eval")
@@ -68,6 +70,16 @@ def make_parser():
         action="store_true",
         help="Adopting mix precision evaluating.",
     )
+    parser.add_argument(
+        "--bf16",
+        dest="bf16",
+        default=False,
+        action="store_true",
+        help="Evaluating in bfloat16, e.g. on cpu.",
+    )
+    parser.add_argument(
+        "--device", default="auto", type=str, help="cuda, cpu or auto"
+    )
     parser.add_argument(
         "--fuse",
         dest="fuse",
@@ -75,6 +87,13 @@ def make_parser():
         action="store_true",
         help="Fuse conv and bn for testing.",
     )
+    parser.add_argument(
+        "--channels-last",
+        dest="channels_last",
+        default=False,
+        action="store_true",
+        help="Use channels last memory format for testing.",
+    )
     parser.add_argument(
         "--trt",
         dest="trt",
@@ -154,8 +173,11 @@ def main(exp, args, num_gpu):
     evaluator.per_class_AP = True
     evaluator.per_class_AR = True
 
-    torch.cuda.set_device(rank)
-    model.cuda(rank)
+    device = get_device(args.device)
+    if device.type == "cuda":
+        torch.cuda.set_device(rank)
+        device = torch.device("cuda", rank)
+    model.to(device)
     model.eval()
 
     if not args.speed and not args.trt:
@@ -164,18 +186,22 @@ def main(exp, args, num_gpu):
         else:
             ckpt_file = args.ckpt
         logger.info("loading checkpoint from {}".format(ckpt_file))
-        loc = "cuda:{}".format(rank)
-        ckpt = torch.load(ckpt_file, map_location=loc)
+        ckpt = torch.load(ckpt_file, map_location=device)
         model.load_state_dict(ckpt["model"])
         logger.info("loaded checkpoint done.")
 
+    if args.fuse or args.channels_last:
+        logger.info("\tPreparing model...")
+        model = prepare_model(
+            model, fuse=args.fuse, channels_last=args.channels_last, check=not args.speed
+        )
+
+    if args.bf16:
+        model.to(torch.bfloat16)
+
     if is_distributed:
         model = DDP(model, device_ids=[rank])
 
-    if args.fuse:
-        logger.info("\tFusing model...")
-        model = fuse_model(model)
-
     if args.trt:
         assert (
             not args.fuse and not is_distributed and args.batch_size == 1
@@ -206,7 +232,11 @@ if __name__ == "__main__":
     if not args.experiment_name:
         args.experiment_name = exp.exp_name
 
-    num_gpu = torch.cuda.device_count() if args.devices is None else args.devices
+    if get_device(args.device).type == "cpu":
+        # a single process
+        num_gpu = 0
+    else:
+        num_gpu = torch.cuda.device_count() if args.devices is None else args.devices
     assert num_gpu <= torch.cuda.device_count()
 
     dist_url = "auto" if args.dist_url is None else args.dist_url
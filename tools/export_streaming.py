@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Copyright (c) Megvii, Inc. and its affiliates.
+
+import argparse
+import os
+from loguru import logger
+
+import torch
+
+from yolox.exp import get_exp
+
+from caryle.streamyolo.StreamYOLO.exps.model.export import (
+    ONNXStreamingModel,
+    check_streaming_parity,
+    export_onnx,
+    export_torchscript
+)
+from caryle.streamyolo.StreamYOLO.exps.model.prepare import prepare_model
+
+
+def make_parser():
+    parser = argparse.ArgumentParser("StreamYOLO streaming export")
+    parser.add_argument(
+        "--output-name", type=str, default="streamyolo", help="output name of models, without extension"
+    )
+    parser.add_argument(
+        "-f",
+        "--exp_file",
+        default=None,
+        type=str,
+        help="experiment description file",
+    )
+    parser.add_argument("-c", "--ckpt", default=None, type=str, help="ckpt path")
+    parser.add_argument("--tsize", default=None, type=int, nargs=2, help="input img size (h w)")
+    parser.add_argument("--opset", default=11, type=int, help="onnx opset version")
+    parser.add_argument(
+        "--fuse", action="store_true", help="fuse conv and bn and buffer the projected features"
+    )
+    parser.add_argument("--no-onnx", action="store_true", help="only export torchscript")
+    parser.add_argument("--frames", default=5, type=int, help="frames of the parity check")
+    return parser
+
+
+@logger.catch
+def main():
+    args = make_parser().parse_args()
+    logger.info("args value: {}".format(args))
+    exp = get_exp(args.exp_file, None)
+    input_size = exp.test_size if args.tsize is None else tuple(args.tsize)
+
+    model = exp.get_model()
+    if args.ckpt is None:
+        ckpt_file = os.path.join(exp.output_dir, exp.exp_name, "best_ckpt.pth")
+    else:
+        ckpt_file = args.ckpt
+    ckpt = torch.load(ckpt_file, map_location="cpu")
+    model.load_state_dict(ckpt["model"])
+    model.eval()
+    logger.info("loading checkpoint done.")
+    if args.fuse:
+        model = prepare_model(model, fuse=True)
+
+    ts_file = args.output_name + ".torchscript.pt"
+    export_torchscript(model, input_size, ts_file)
+    diffs = check_streaming_parity(model, torch.jit.load(ts_file), input_size, args.frames)
+    logger.info("generated torchscript model named {}, max difference {:.3g}".format(ts_file, max(diffs)))
+
+    if not args.no_onnx:
+        onnx_file = args.output_name + ".onnx"
+        export_onnx(model, input_size, onnx_file, args.opset)
+        diffs = check_streaming_parity(model, ONNXStreamingModel(onnx_file), input_size, args.frames)
+        logger.info("generated onnx model named {}, max difference {:.3g}".format(onnx_file, max(diffs)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Copyright (c) Megvii, Inc. and its affiliates.
+
+import argparse
+import copy
+from loguru import logger
+
+import torch
+
+from yolox.utils import bboxes_iou
+
+from caryle.streamyolo.StreamYOLO.exps.model.tal_head import TALHead
+
+
+def make_parser():
+    parser = argparse.ArgumentParser("TALHead loss parity with the per-image temporal weighting")
+    parser.add_argument("--trials", default=30, type=int, help="random batches")
+    parser.add_argument("--num-classes", default=8, type=int)
+    parser.add_argument("--width", default=0.25, type=float)
+    parser.add_argument("--max-gt", default=12, type=int, help="padded labels per image")
+    parser.add_argument("--tsize", default=[192, 320], type=int, nargs=2, help="img size (h w)")
+    return parser
+
+
+class PerImageTALHead(TALHead):
+    """TALHead with the temporal ious computed image by image, as before get_temporal_ious."""
+
+    def get_temporal_ious(self, gt_bboxes, support_gt_bboxes, support_nlabel):
+        temporal_ious = gt_bboxes.new_zeros(gt_bboxes.shape[:2])
+        for batch_idx in range(gt_bboxes.shape[0]):
+            num_gt = int((gt_bboxes[batch_idx].sum(dim=1) > 0).sum())
+            support_num_gt = int(support_nlabel[batch_idx])
+            gt_bboxes_per_image = gt_bboxes[batch_idx, :num_gt]
+            if num_gt == 0:
+                continue
+            if support_num_gt == 0:
+                ious = gt_bboxes_per_image.new_ones(num_gt)
+            else:
+                pair_iou_between_current_and_support = bboxes_iou(
+                    gt_bboxes_per_image, support_gt_bboxes[batch_idx, :support_num_gt], False
+                )
+                ious, support_id = torch.max(pair_iou_between_current_and_support, dim=1)
+                filter_id = (ious < self.ignore_thr)
+                ious[filter_id] = self.ignore_value
+            temporal_ious[batch_idx, :num_gt] = ious
+        return temporal_ious
+
+
+def random_labels(g, batch_size, max_gt, num_gt, num_classes, img_size):
+    """[batch, max_gt, 5] padded labels (class, cx, cy, w, h), num_gt boxes per image."""
+    h, w = img_size
+    labels = torch.zeros(batch_size, max_gt, 5)
+    for b in range(batch_size):
+        n = int(num_gt[b])
+        labels[b, :n, 0] = torch.randint(0, num_classes, (n,), generator=g).float()
+        labels[b, :n, 1] = torch.rand(n, generator=g) * w
+        labels[b, :n, 2] = torch.rand(n, generator=g) * h
+        labels[b, :n, 3:5] = torch.rand(n, 2, generator=g) * 60 + 4
+    return labels
+
+
+def main(args):
+    in_channels = [256, 512, 1024]
+    strides = [8, 16, 32]
+    h, w = args.tsize
+    max_diff = 0.0
+    for trial in range(args.trials):
+        g = torch.Generator().manual_seed(trial)
+        torch.manual_seed(trial)
+        batch_size = int(torch.randint(1, 5, (1,), generator=g))
+        head = TALHead(args.num_classes, width=args.width, in_channels=in_channels).train()
+        ref = copy.deepcopy(head)
+        ref.__class__ = PerImageTALHead
+        head.use_l1 = ref.use_l1 = trial % 2 == 1
+
+        xin = [
+            torch.randn(batch_size, int(c * args.width), h // s, w // s, generator=g)
+            for c, s in zip(in_channels, strides)
+        ]
+        num_gt = torch.randint(0, 6, (batch_size,), generator=g)
+        support_num_gt = torch.randint(0, 6, (batch_size,), generator=g)
+        # images without gt and without support gt
+        if trial % 4 == 0:
+            num_gt[0] = 0
+        if trial % 3 == 0:
+            support_num_gt[-1] = 0
+        labels = random_labels(g, batch_size, args.max_gt, num_gt, args.num_classes, args.tsize)
+        # support gt near the current gt, the first support_num_gt of them
+        support_labels = labels.clone()
+        support_labels[..., 1:3] += torch.randn(batch_size, args.max_gt, 2, generator=g) * 6
+        support_labels *= (torch.arange(args.max_gt)[None, :, None] < support_num_gt[:, None, None])
+
+        # same weights, the head outputs and the assignments match
+        losses = head(xin, labels=(labels, support_labels))
+        ref_losses = ref(xin, labels=(labels, support_labels))
+        diffs = [
+            float((torch.as_tensor(a, dtype=torch.float64) - torch.as_tensor(b, dtype=torch.float64)).abs().max())
+            for a, b in zip(losses, ref_losses)
+        ]
+        max_diff = max(max_diff, *diffs)
+        logger.info("batch {} gt {} support gt {} l1 {}: max difference {:.3g}".format(
+            trial, num_gt.tolist(), support_num_gt.tolist(), head.use_l1, max(diffs)))
+
+    logger.info("max difference of the five loss outputs over {} batches: {:.3g}".format(args.trials, max_diff))
+
+
+if __name__ == "__main__":
+    args = make_parser().parse_args()
+    main(args)
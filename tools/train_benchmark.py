@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Copyright (c) Megvii, Inc. and its affiliates.
+
+import argparse
+import copy
+import time
+from loguru import logger
+
+import numpy as np
+import torch
+from tabulate import tabulate
+
+from yolox.exp import get_exp
+
+
+def make_parser():
+    parser = argparse.ArgumentParser("StreamYOLO off_pipe training throughput benchmark")
+    parser.add_argument(
+        "-f",
+        "--exp_files",
+        nargs="+",
+        required=True,
+        type=str,
+        help="experiment description files, e.g. the s/m/l cfgs",
+    )
+    parser.add_argument("-b", "--batch-size", default=4, type=int, help="images per batch")
+    parser.add_argument("--n-support", default=1, type=int, help="support frames per image")
+    parser.add_argument("--tsize", default=None, type=int, nargs=2, help="train img size (h w)")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", type=str)
+    parser.add_argument("--threads", default=None, type=int, help="intra-op threads")
+    parser.add_argument("--warmup", default=3, type=int, help="warm up iterations")
+    parser.add_argument("--iters", default=10, type=int, help="timed iterations")
+    return parser
+
+
+def sync(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def train_step(fpn, inputs):
+    """off_pipe forward and backward of the DFP PAFPN, with the sum of its outputs as loss."""
+    fpn.zero_grad(set_to_none=True)
+    outputs = fpn(inputs, mode="off_pipe")
+    sum(x.float().sum() for x in outputs).backward()
+    return outputs
+
+
+def time_train(fpn, inputs, warmup, iters):
+    """Time (s) of the training iterations."""
+    device = inputs.device
+    runtime = []
+    for i in range(warmup + iters):
+        sync(device)
+        t1 = time.perf_counter()
+        train_step(fpn, inputs)
+        sync(device)
+        if i >= warmup:
+            runtime.append(time.perf_counter() - t1)
+    return np.asarray(runtime)
+
+
+def max_diff(fpn_a, fpn_b, inputs):
+    """
+    Largest difference of the outputs and batch norm buffers after a step, and
+    largest relative difference of the gradients, which only differ by the
+    order of the sums over the batch.
+    """
+    diffs = [(a - b).abs().max().item() for a, b in zip(train_step(fpn_a, inputs), train_step(fpn_b, inputs))]
+    for b_a, b_b in zip(fpn_a.buffers(), fpn_b.buffers()):
+        diffs.append((b_a.float() - b_b.float()).abs().max().item())
+    grad_diffs = [
+        ((p_a.grad - p_b.grad).abs().max() / p_a.grad.abs().max().clamp(min=1e-12)).item()
+        for p_a, p_b in zip(fpn_a.parameters(), fpn_b.parameters())
+    ]
+    return max(diffs), max(grad_diffs)
+
+
+def main(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    device = torch.device(args.device)
+
+    rows = []
+    for exp_file in args.exp_files:
+        exp = get_exp(exp_file, None)
+        input_size = exp.input_size if args.tsize is None else tuple(args.tsize)
+        base_fpn = exp.get_model().backbone.to(device).train()
+        inputs = torch.rand(
+            args.batch_size, 3 * (1 + args.n_support), *input_size, device=device
+        ) * 255
+
+        fpns = {}
+        for name, stack_frames in [("one pass per frame", False), ("stacked frames", True)]:
+            fpns[name] = copy.deepcopy(base_fpn)
+            fpns[name].stack_frames = stack_frames
+        diff, grad_diff = max_diff(*copy.deepcopy(list(fpns.values())), inputs)
+
+        base_time = None
+        for name, fpn in fpns.items():
+            runtime = time_train(fpn, inputs, args.warmup, args.iters)
+            base_time = runtime.mean() if base_time is None else base_time
+            rows.append(
+                [exp.exp_name, "{}x{}".format(*input_size), name, 1e3 * runtime.mean(),
+                 1e3 * runtime.std(), args.batch_size / runtime.mean(), base_time / runtime.mean()]
+            )
+            logger.info("{} {}: {:.1f}ms".format(exp.exp_name, name, 1e3 * runtime.mean()))
+        logger.info("{}: max difference {:.3g}, max relative gradient difference {:.3g}".format(
+            exp.exp_name, diff, grad_diff))
+
+    logger.info("\n" + tabulate(
+        rows,
+        headers=["exp", "size", "trunk", "mean (ms)", "std (ms)", "img/s", "speedup"],
+        tablefmt="pipe",
+        floatfmt=".2f",
+    ))
+
+
+if __name__ == "__main__":
+    args = make_parser().parse_args()
+    main(args)